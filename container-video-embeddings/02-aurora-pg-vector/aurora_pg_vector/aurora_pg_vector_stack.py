@@ -17,6 +17,10 @@ from lambdas import Lambdas
 bedrock_user            = "bedrock_user"
 table_name              = "knowledge_bases"
 default_database_name   = "kbdata"
+content_type_indexes    = ["text", "image"] # partial HNSW index per content type, [] to disable
+vector_storage          = "full" # HNSW index storage: full, halfvec or binary (re-ranked with full vectors), measure recall before switching
+drop_unused_vector_indexes = False # drop the HNSW indexes of the other storages once the vector_storage one is valid
+setup_revision          = 1 # bump to re-run the setup (e.g. after an index build outlasted the deploy)
 
 
 class AuroraPgVectorVideoStack(Stack):
@@ -52,6 +56,10 @@ class AuroraPgVectorVideoStack(Stack):
                 table_name=table_name,
                 database_name=default_database_name,
                 credentials_arn = self.bedrock_secret.secret_arn,
+                content_type_indexes = content_type_indexes,
+                vector_storage = vector_storage,
+                drop_unused_vector_indexes = drop_unused_vector_indexes,
+                setup_revision = setup_revision,
             )
         ) 
         pg_setup.node.add_dependency(self.cluster.cluster)
@@ -66,4 +74,11 @@ class AuroraPgVectorVideoStack(Stack):
 
         ssm.StringParameter( self, "cluster_arn_ssm", parameter_name=f"/videopgvector/cluster_arn", string_value=self.cluster.cluster.cluster_arn)
         ssm.StringParameter( self, "secret_arn_ssm", parameter_name=f"/videopgvector/secret_arn", string_value=self.bedrock_secret.secret_arn)
-        ssm.StringParameter( self, "table_ssm", parameter_name=f"/videopgvector/video_table_name", string_value=default_database_name) 
\ No newline at end of file
+        # direct connections of the retrieval stack (db_backend=psycopg): the writer endpoint and the security group the cluster allows
+        ssm.StringParameter( self, "cluster_endpoint_ssm", parameter_name=f"/videopgvector/cluster_endpoint", string_value=self.cluster.cluster.cluster_endpoint.hostname)
+        ssm.StringParameter( self, "db_client_sg_ssm", parameter_name=f"/videopgvector/db_client_security_group_id", string_value=self.cluster.security_group.security_group_id)
+        ssm.StringParameter( self, "table_ssm", parameter_name=f"/videopgvector/video_table_name", string_value=default_database_name)
+        # storage with a valid index, vector_storage once its index build is done: read by the retrieval stack
+        ssm.StringParameter( self, "vector_storage_ssm", parameter_name=f"/videopgvector/vector_storage", string_value=pg_setup.get_att_string("VectorStorage"))
+        # content types whose partial index of that storage is valid ("none" without any)
+        ssm.StringParameter( self, "content_type_indexes_ssm", parameter_name=f"/videopgvector/content_type_indexes", string_value=pg_setup.get_att_string("ContentTypeIndexes")) 
\ No newline at end of file
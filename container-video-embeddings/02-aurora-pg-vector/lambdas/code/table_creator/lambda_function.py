@@ -67,13 +67,23 @@ def create(event, context):
             secrets_arn=secrets_arn,
             database_name=database_name,
             table_name = table_name,
-            credentials_arn= credentials_arn
+            credentials_arn= credentials_arn,
+            content_type_indexes=props.get('content_type_indexes', []),
+            vector_storage=props.get('vector_storage', 'full'),
+            # CloudFormation sends the properties as strings
+            drop_unused_vector_indexes=str(props.get('drop_unused_vector_indexes', 'false')).lower() == 'true'
         )        
         
         try:
-            PG.setup()
+            # wait for index builds while the function has time left to answer CloudFormation
+            ready_storage, ready_content_types = PG.setup(wait_seconds=context.get_remaining_time_in_millis() / 1000 - 120)
             event['PhysicalResourceId'] = f"{table_name}|SETUP"
-            send_response(event, context, "SUCCESS", {"Message": "Resource creation successful!"})
+            send_response(event, context, "SUCCESS", {
+                "Message": "Resource creation successful!",
+                "VectorStorage": ready_storage,
+                # SSM parameters cannot be empty
+                "ContentTypeIndexes": ",".join(ready_content_types) or "none",
+            })
         except Exception as e:
             print(f"Error during PG.setup(): {str(e)}")
             send_response(event, context, "FAILED", {"Message": f"Resource creation failed: {str(e)}"})
@@ -1,5 +1,7 @@
 import boto3
 import json
+import re
+import time
 from botocore.exceptions import ClientError  # import botocore.exceptions
 import logging  # import logging
 
@@ -9,8 +11,20 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class PGSetup():
-    def __init__(self, client, cluster_arn, secrets_arn, database_name, table_name,credentials_arn):
+    def __init__(self, client, cluster_arn, secrets_arn, database_name, table_name,credentials_arn, content_type_indexes=None,
+                 vector_storage="full", embedding_dimension=1024, drop_unused_vector_indexes=False):
         self.cluster_arn = cluster_arn
+        # HNSW index storage: "full" vector(1024), "halfvec" (2 bytes per dimension) or "binary" (1 bit per dimension).
+        # Quantized modes index an expression of the same embedding column, results are re-ranked with full vectors.
+        if vector_storage not in ("full", "halfvec", "binary"):
+            raise ValueError("vector_storage must be full, halfvec or binary")
+        self.vector_storage = vector_storage
+        # the indexes of the other storages are kept (instant rollback) unless this is set, and even
+        # then only dropped once the index of vector_storage is valid
+        self.drop_unused_vector_indexes = drop_unused_vector_indexes
+        self.embedding_dimension = int(embedding_dimension)
+        # one partial HNSW index per content type (e.g. ["text", "image"]), optional
+        self.content_type_indexes = content_type_indexes if content_type_indexes else []
         self.secrets_arn = secrets_arn
         self.credentials_arn = credentials_arn
         self.database_name = database_name
@@ -27,14 +41,16 @@ class PGSetup():
             print(f"Error retrieving secret: {e}")
             raise
 
-    def setup(self):
+    def setup(self, wait_seconds=0):
+        """Returns the vector storage and the content type indexes the retrieval stack can use
+        (see ready_vector_storage and ready_content_types)"""
         self.create_extension_vector()
         self.create_schema()
         self.create_role()
         self.grant_privileges()
-        self.create_tables()
+        return self.create_tables(wait_seconds)
 
-    def create_tables(self):
+    def create_tables(self, wait_seconds=0):
         table_name = self.table_name
         sql = f"CREATE TABLE IF NOT EXISTS bedrock_integration.{table_name} (id uuid PRIMARY KEY, embedding vector(1024), chunks text, time integer, metadata json, \"date\" text, source text, sourceurl text, topic text, content_type text, language varchar(10));"
 
@@ -48,17 +64,188 @@ class PGSetup():
         del response['ResponseMetadata']
         logging.info(f"CREATE TABLE  : {response}") # import logging
 
-        response2 = self.client.execute_statement(
-            resourceArn=self.cluster_arn, 
-            secretArn=self.credentials_arn,
-            sql=f"CREATE INDEX on bedrock_integration.{table_name} USING hnsw (embedding vector_cosine_ops)",
+        self.create_search_function()
+
+        # Index builds over existing rows outlast the 45 s Data API call: they run concurrently
+        # (ingestion and retrieval keep going) and in the background, setup waits up to wait_seconds.
+        # An index that is already valid is left alone, so stack updates run no DDL.
+        indexes = {self.vector_index_name(): f"USING hnsw {self.hnsw_index_expression()}"}
+        indexes.update(self.content_type_indexes_definitions())
+        indexes.update(self.filter_indexes_definitions())
+        indexes.update(self.text_search_index_definitions())
+        states = self.build_indexes(indexes, wait_seconds)
+
+        ready_storage = self.ready_vector_storage()
+        if self.drop_unused_vector_indexes and "building" not in states.values():
+            self.drop_unused_indexes(ready_storage)
+        return ready_storage, self.ready_content_types(ready_storage)
+
+    def run_sql(self, sql, secret_arn=None):
+        response = self.client.execute_statement(
+            resourceArn=self.cluster_arn,
+            secretArn=secret_arn if secret_arn else self.credentials_arn,
+            sql=sql,
             database=self.database_name,
             formatRecordsAs='JSON'
         )
-        del response2['ResponseMetadata']
-        logging.info(f"CREATE INDEX  : {response2}") # import logging
+        del response['ResponseMetadata']
+        logging.info(f"{sql} : {response}")
+        return response
+
+    def run_ddl(self, sql):
+        # continueAfterTimeout: the statement keeps running when the Data API call times out (45 s),
+        # without it the server cancels it. Returns False while it is still running.
+        try:
+            self.client.execute_statement(
+                resourceArn=self.cluster_arn,
+                secretArn=self.credentials_arn,
+                sql=sql,
+                database=self.database_name,
+                continueAfterTimeout=True,
+            )
+            logging.info(f"{sql} : done")
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "StatementTimeoutException":
+                raise
+            logging.info(f"{sql} : still running after the Data API timeout")
+            return False
 
-        return response2
+    def index_state(self, index_name):
+        # None (no index), "valid", "building" or "invalid" (left over by a failed concurrent build)
+        response = self.run_sql(
+            "SELECT i.indisvalid AS valid, EXISTS (SELECT 1 FROM pg_stat_progress_create_index p WHERE p.index_relid = c.oid) AS building "
+            "FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid JOIN pg_namespace n ON n.oid = c.relnamespace "
+            f"WHERE n.nspname = 'bedrock_integration' AND c.relname = '{index_name}'"
+        )
+        records = json.loads(response.get("formattedRecords") or "[]")
+        if not records:
+            return None
+        if records[0]["valid"]:
+            return "valid"
+        return "building" if records[0]["building"] else "invalid"
+
+    def ensure_index(self, index_name, definition):
+        # CREATE INDEX CONCURRENTLY only when the index is missing, an invalid one is dropped and built again
+        state = self.index_state(index_name)
+        if state in ("valid", "building"):
+            logging.info(f"index {index_name}: {state}")
+            return state
+        if state == "invalid":
+            self.run_ddl(f"DROP INDEX CONCURRENTLY IF EXISTS bedrock_integration.{index_name}")
+        self.run_ddl(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON bedrock_integration.{self.table_name} {definition}"
+        )
+        state = self.index_state(index_name)
+        logging.info(f"index {index_name}: {state}")
+        return state
+
+    def build_indexes(self, indexes, wait_seconds):
+        # One build at a time: concurrent builds on the same table wait for each other's snapshots
+        # and can fail with a deadlock. The next one starts once the previous one is done, until
+        # wait_seconds is over, the rest is built by the next setup run.
+        deadline = time.time() + wait_seconds
+        started = set()
+        while True:
+            states = {name: self.index_state(name) for name in indexes}
+            if "building" not in states.values():
+                # each index is tried once per run, a build that fails is not retried in a loop
+                pending = [name for name, state in states.items() if state != "valid" and name not in started]
+                if not pending:
+                    break
+                started.add(pending[0])
+                self.ensure_index(pending[0], indexes[pending[0]])
+                continue
+            if time.time() >= deadline:
+                break
+            time.sleep(15)
+        logging.info(f"index builds: {states}")
+        return states
+
+    def vector_index_name(self, vector_storage=None):
+        vector_storage = vector_storage or self.vector_storage
+        # full: the name Postgres generated for the original unnamed index
+        if vector_storage == "full":
+            return f"{self.table_name}_embedding_idx"
+        return f"{self.table_name}_embedding_{vector_storage}_idx"
+
+    def ready_vector_storage(self):
+        # vector_storage once its index is valid. Until then the storage of a valid index that
+        # is already there, so the retrieval stack keeps querying an index that exists.
+        for vector_storage in [self.vector_storage, "full", "halfvec", "binary"]:
+            if self.index_state(self.vector_index_name(vector_storage)) == "valid":
+                return vector_storage
+        return self.vector_storage
+
+    def ready_content_types(self, vector_storage):
+        # content types whose partial index of vector_storage is valid
+        return [content_type for content_type in self.content_type_indexes
+                if self.index_state(self.content_type_index_name(content_type, vector_storage)) == "valid"]
+
+    def drop_unused_indexes(self, ready_storage):
+        if ready_storage != self.vector_storage:
+            logging.info(f"{self.vector_index_name()} is not valid yet, indexes of other storages are kept")
+            return
+        for vector_storage in ["full", "halfvec", "binary"]:
+            if vector_storage == self.vector_storage:
+                continue
+            # partial indexes go with the full one, each only when the vector_storage one is valid
+            unused = [self.vector_index_name(vector_storage)] + [
+                self.content_type_index_name(content_type, vector_storage) for content_type in self.content_type_indexes
+                if self.index_state(self.content_type_index_name(content_type)) == "valid"]
+            for index_name in unused:
+                if self.index_state(index_name):
+                    self.run_ddl(f"DROP INDEX CONCURRENTLY IF EXISTS bedrock_integration.{index_name}")
+
+    def hnsw_index_expression(self, vector_storage=None):
+        # quantized storages index an expression of the embedding column, existing rows are not rewritten
+        vector_storage = vector_storage or self.vector_storage
+        dimension = self.embedding_dimension
+        if vector_storage == "halfvec":
+            return f"((embedding::halfvec({dimension})) halfvec_cosine_ops)"
+        if vector_storage == "binary":
+            return f"((binary_quantize(embedding)::bit({dimension})) bit_hamming_ops)"
+        return "(embedding vector_cosine_ops)"
+
+    def content_type_index_name(self, content_type, vector_storage=None):
+        vector_storage = vector_storage or self.vector_storage
+        storage_suffix = "" if vector_storage == "full" else f"_{vector_storage}"
+        return f"{self.table_name}_embedding_{re.sub(r'[^a-zA-Z0-9_]', '_', content_type)}{storage_suffix}_idx"
+
+    def content_type_indexes_definitions(self):
+        # Partial HNSW graphs: a content_type = 'image' search walks only image vectors.
+        # The retrieval query builder emits exactly this predicate so the planner can use them.
+        definitions = {}
+        for content_type in self.content_type_indexes:
+            quoted = content_type.replace("'", "''")
+            definitions[self.content_type_index_name(content_type)] = (
+                f"USING hnsw {self.hnsw_index_expression()} WHERE content_type = '{quoted}'"
+            )
+        return definitions
+
+    def text_search_index_definitions(self):
+        # GIN index on the full-text expression of the hybrid (lexical + vector) search, the same
+        # text as TEXT_SEARCH_VECTOR in the retrieval service. Unlike a stored generated column
+        # it is built concurrently and does not rewrite the table.
+        return {f"{self.table_name}_chunks_fts_idx": "USING gin (to_tsvector('english', coalesce(chunks, '')))"}
+
+    def filter_indexes_definitions(self):
+        # B-tree indexes for the exact-scan plan of selective (single video) queries,
+        # "date" serves the max(date) ingestion watermark of the answer cache
+        return {f"{self.table_name}_{column}_idx": f'("{column}")' for column in ["source", "content_type", "date"]}
+
+    def create_search_function(self):
+        # Runs a query with per-request HNSW settings in a single Data API call:
+        # set_config(..., true) only lasts for the statement's transaction.
+        sql = """CREATE OR REPLACE FUNCTION bedrock_integration.tuned_search(query text, ef_search integer, iterative_scan text)
+RETURNS SETOF json AS $$
+BEGIN
+    PERFORM set_config('hnsw.ef_search', ef_search::text, true);
+    PERFORM set_config('hnsw.iterative_scan', iterative_scan, true);
+    RETURN QUERY EXECUTE format('SELECT row_to_json(t) FROM (%s) t', query);
+END
+$$ LANGUAGE plpgsql"""
+        return self.run_sql(sql)
 
     
     def grant_privileges(self):
@@ -118,4 +305,3 @@ class PGSetup():
         print(f"SQL executed: {sql}")
         return response
     
-
@@ -1,13 +1,15 @@
 import os
 import sys
 from step_function_utils import send_task_success, send_task_failure
-from video_processor import ffmpeg_check, extract_frames
+from video_processor import ffmpeg_check, extract_frames, create_thumbnail
 from utils import download_file, parse_location, upload_file
 from get_image_embeddings import get_images_embeddings
 from similarity import cosine_similarity_list, filter_relevant_frames
 
 tmp_path                    = "./tmp"
 difference_threshold        = 0.9
+thumbnail_width             = int(os.environ.get("THUMBNAIL_WIDTH", "384"))
+thumbnail_quality           = int(os.environ.get("THUMBNAIL_QUALITY", "5"))
 
 if __name__ == "__main__":
 
@@ -55,6 +57,11 @@ if __name__ == "__main__":
 
             print(f"{origen_file} => {destination_key}")
             upload_file(bucket, destination_key, origen_file)
+
+            # Compact rendition used as LLM context by the retrieval API
+            thumbnail_file = f"{output_dir}/thumbnail/sec_{str(sf+1).zfill(5)}.jpg"
+            if create_thumbnail(origen_file, thumbnail_file, width=thumbnail_width, quality=thumbnail_quality):
+                upload_file(bucket, f"{prefix}/{file}/selected_frames_thumbnail/{real_frame}.jpg", thumbnail_file)
             selected_frames_real.append(real_frame)
 
 
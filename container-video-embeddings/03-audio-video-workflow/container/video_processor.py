@@ -61,5 +61,18 @@ def extract_frames(file_location, output_dir, every=1):
     return sorted(images_files, key=extract_sec_number)
 
 
-
-
+def create_thumbnail(image_file, thumbnail_file, width=384, quality=5):
+    """Write a compact rendition of a keyframe for LLM context (JPEG, ffmpeg -q:v 2..31, lower is better)."""
+    os.makedirs(os.path.dirname(thumbnail_file), exist_ok=True)
+    command = [
+        'ffmpeg',
+        '-i', image_file,
+        '-vf', f'scale={width}:-1',
+        '-q:v', str(quality),
+        '-y',
+        thumbnail_file
+    ]
+    return_code, stdout, stderr = run_ffmpeg_command(command)
+    if return_code != 0:
+        print ("thumbnail code:",return_code, "stderr:", stderr)
+    return return_code == 0
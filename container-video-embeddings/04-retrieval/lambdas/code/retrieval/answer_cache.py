@@ -0,0 +1,142 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# Semantic cache of retrieve_generate answers: "memory", "sqlite" or "" (disabled)
+answer_cache_store = os.environ.get("ANSWER_CACHE_STORE", "")
+answer_cache_path = os.environ.get("ANSWER_CACHE_PATH", "/tmp/answer_cache.sqlite3")
+answer_cache_threshold = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))
+answer_cache_ttl_seconds = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", "3600"))
+answer_cache_max_entries = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+
+class InMemoryAnswerStore:
+    """Entries grouped by namespace, oldest first. Lives for the warm container."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.namespaces = {}
+        self.lock = threading.Lock()
+
+    def entries(self, namespace):
+        with self.lock:
+            return list(self.namespaces.get(namespace, []))
+
+    def put(self, namespace, entry):
+        with self.lock:
+            entries = self.namespaces.setdefault(namespace, [])
+            entries.append(entry)
+            del entries[:-self.max_entries]
+
+    def remove(self, namespace, created):
+        with self.lock:
+            entries = self.namespaces.get(namespace, [])
+            entries[:] = [e for e in entries if e["created"] != created]
+
+
+class SQLiteAnswerStore:
+    """Same interface backed by a SQLite file, /tmp keeps it across warm invocations
+    and the file can be pointed at shared storage (EFS)."""
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS answers (namespace TEXT, created REAL, entry TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS answers_namespace_idx ON answers (namespace, created)")
+        self.connection.commit()
+
+    def entries(self, namespace):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT entry FROM answers WHERE namespace = ? ORDER BY created", (namespace,)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def put(self, namespace, entry):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO answers (namespace, created, entry) VALUES (?, ?, ?)",
+                (namespace, entry["created"], json.dumps(entry)),
+            )
+            self.connection.execute(
+                "DELETE FROM answers WHERE namespace = ? AND created NOT IN "
+                "(SELECT created FROM answers WHERE namespace = ? ORDER BY created DESC LIMIT ?)",
+                (namespace, namespace, self.max_entries),
+            )
+            self.connection.commit()
+
+    def remove(self, namespace, created):
+        with self.lock:
+            self.connection.execute("DELETE FROM answers WHERE namespace = ? AND created = ?", (namespace, created))
+            self.connection.commit()
+
+
+def normalize(vector):
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def cosine(a, b):
+    return sum(x * y for x, y in zip(a, b))
+
+
+def cache_namespace(**parts):
+    """Answers are only shared between requests with the same model, filters and generation options"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class AnswerCache:
+    """Returns a stored answer when a previous query in the same namespace is at least `threshold`
+    cosine-similar and no rows were ingested for its filter since (same watermark)."""
+
+    def __init__(self, store, threshold, ttl_seconds):
+        self.store = store
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, namespace, vector, watermark):
+        vector = normalize(vector)
+        now = time.time()
+        best, best_similarity = None, -1.0
+        for entry in self.store.entries(namespace):
+            if now - entry["created"] > self.ttl_seconds or entry["watermark"] != watermark:
+                self.store.remove(namespace, entry["created"])
+                continue
+            similarity = cosine(vector, entry["vector"])
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+
+        if best is None or best_similarity < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(best, similarity=best_similarity)
+
+    def put(self, namespace, vector, watermark, query, response, docs, context=None):
+        entry = dict(vector=normalize(vector), watermark=watermark, query=query,
+                     response=response, docs=docs, context=context, created=time.time())
+        self.store.put(namespace, entry)
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+
+def create_answer_cache(store=answer_cache_store):
+    if not store:
+        return None
+    if store == "memory":
+        backend = InMemoryAnswerStore(answer_cache_max_entries)
+    elif store == "sqlite":
+        backend = SQLiteAnswerStore(answer_cache_path, answer_cache_max_entries)
+    else:
+        raise ValueError(f"ANSWER_CACHE_STORE must be memory, sqlite or empty, got {store}")
+    return AnswerCache(backend, answer_cache_threshold, answer_cache_ttl_seconds)
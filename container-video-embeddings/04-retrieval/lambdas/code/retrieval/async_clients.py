@@ -0,0 +1,40 @@
+import asyncio
+import contextlib
+import functools
+import weakref
+
+# aiobotocore clients belong to the event loop that created them: one per loop and service
+loop_clients = weakref.WeakKeyDictionary()
+
+
+@functools.cache
+def aiobotocore_session_factory():
+    """aiobotocore's get_session, None when it is not installed. Imported by the first
+    async call (aiohttp is heavy), the Lambda handlers never make one."""
+    try:
+        from aiobotocore.session import get_session
+    except ImportError:
+        # async callers fall back to the boto3 clients in worker threads
+        return None
+    return get_session
+
+
+async def get_async_client(service_name):
+    """aiobotocore client for the running loop, None when aiobotocore is not installed"""
+    get_session = aiobotocore_session_factory()
+    if get_session is None:
+        return None
+    loop = asyncio.get_running_loop()
+    state = loop_clients.setdefault(loop, {"lock": asyncio.Lock(), "stack": contextlib.AsyncExitStack(), "clients": {}})
+    async with state["lock"]:
+        if service_name not in state["clients"]:
+            client = get_session().create_client(service_name)
+            state["clients"][service_name] = await state["stack"].enter_async_context(client)
+    return state["clients"][service_name]
+
+
+async def aclose_async_clients():
+    """Close the clients of the running loop (and their HTTP sessions), call it before the loop shuts down"""
+    state = loop_clients.pop(asyncio.get_running_loop(), None)
+    if state:
+        await state["stack"].aclose()
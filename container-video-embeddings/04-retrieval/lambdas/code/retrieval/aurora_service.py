@@ -1,17 +1,85 @@
 
+import asyncio
 import boto3
+import json
+import os
+import time
 from typing import List
+from botocore.exceptions import ClientError
+
+from async_clients import get_async_client, aclose_async_clients
+
 ssm = boto3.client("ssm")
 
+# Columns returned by default. The 1024-float embedding is ~20 KB of JSON per row
+# through the Data API, so it is only returned when explicitly requested.
+DEFAULT_COLUMNS = ["id", "chunks", "time", "metadata", "date", "source", "sourceurl", "topic", "content_type", "language"]
+ALL_COLUMNS = DEFAULT_COLUMNS + ["embedding"]
+FILTER_KEYS = ["source", "content_type"]
+# Full-text expression of the hybrid search, the same text as the table creator's GIN
+# expression index so the planner uses it
+TEXT_SEARCH_VECTOR = "to_tsvector('english', coalesce(chunks, ''))"
+
+# HNSW index storage chosen in the table creator: "full", "halfvec" or "binary". Quantized
+# indexes produce rerank_factor * k candidates that are re-ranked with the full vectors.
+# The defaults are starting points, their recall was not measured: use benchmark_vector_storage.py
+vector_storage = os.environ.get("VECTOR_STORAGE", "full")
+rerank_factor = int(os.environ.get("RERANK_FACTOR", "10" if vector_storage == "binary" else "4"))
+embedding_dimension = int(os.environ.get("DEFAULT_EMBEDDING_DIMENSION", "1024"))
+# rows a Data API response can carry with their embedding (~20 KB of JSON each, responses are limited to 1 MB)
+data_api_vector_rows = int(os.environ.get("DATA_API_VECTOR_ROWS", "40"))
+
+# content types with a partial HNSW index (created by the table creator)
+content_type_indexes = [c for c in os.environ.get("CONTENT_TYPE_INDEXES", "text,image").split(",") if c]
+
+# Recall/latency profiles for the HNSW index scan. iterative_scan (pgvector >= 0.8) keeps
+# walking the graph until enough rows pass the WHERE clause of a filtered query.
+SEARCH_PROFILES = {
+    "fast": dict(ef_search=40, iterative_scan="off"),
+    "balanced": dict(ef_search=100, iterative_scan="relaxed_order"),
+    "accurate": dict(ef_search=300, iterative_scan="strict_order"),
+}
+DEFAULT_UNFILTERED_PROFILE = "fast"
+DEFAULT_FILTERED_PROFILE = "balanced"
+
+# Filtered queries estimated to touch at most this many rows are answered with an exact
+# scan (B-tree on source/content_type + sort) instead of the HNSW index
+exact_scan_max_rows = int(os.environ.get("EXACT_SCAN_MAX_ROWS", "5000"))
+row_estimate_ttl_seconds = int(os.environ.get("ROW_ESTIMATE_TTL_SECONDS", "300"))
+
+
+def resolve_search_settings(profile=None, filtered=False):
+    """profile: a SEARCH_PROFILES name, a dict with ef_search / iterative_scan, or None
+    to pick the default for filtered or unfiltered queries."""
+    if profile is None:
+        profile = DEFAULT_FILTERED_PROFILE if filtered else DEFAULT_UNFILTERED_PROFILE
+    if isinstance(profile, dict):
+        settings = dict(SEARCH_PROFILES[DEFAULT_FILTERED_PROFILE if filtered else DEFAULT_UNFILTERED_PROFILE])
+        settings.update({k: v for k, v in profile.items() if k in ("ef_search", "iterative_scan")})
+        settings["profile"] = "custom"
+    elif profile in SEARCH_PROFILES:
+        settings = dict(SEARCH_PROFILES[profile], profile=profile)
+    else:
+        raise ValueError(f"search_profile must be one of {list(SEARCH_PROFILES)} or a dict")
+    if settings["iterative_scan"] not in ("off", "relaxed_order", "strict_order"):
+        raise ValueError("iterative_scan must be off, relaxed_order or strict_order")
+    settings["ef_search"] = int(settings["ef_search"])
+    return settings
+
 
 class AuroraPostgres:
+    max_vector_rows = data_api_vector_rows
+
     def __init__(self, cluster_arn, database_name, credentials_arn):
         self.cluster_arn = cluster_arn
         self.credentials_arn = credentials_arn
         self.database_name = database_name
         self.client = boto3.client("rds-data")
+        # planner row estimates per WHERE clause, reused while fresh
+        self.row_estimates = {}
 
-    def execute_statement(self, sql):
+    def execute_statement(self, sql, params=None):
+        """params: unused, the Data API queries carry their values inline (see bind_vector)"""
         response = self.client.execute_statement(
             resourceArn=self.cluster_arn,
             secretArn=self.credentials_arn,
@@ -22,6 +90,58 @@ class AuroraPostgres:
         del response["ResponseMetadata"]
         return response
 
+    def bind_vector(self, name, vector, params):
+        """SQL expression of a query vector. The Data API gets an inline literal,
+        pooled backends replace it with a bound parameter stored in params."""
+        return f"'{vector}'::vector"
+
+    def bind_text(self, name, text, params):
+        escaped = text.replace("'", "''")
+        return f"'{escaped}'"
+
+    async def aclose(self):
+        """Close the aiobotocore clients of the running loop, call it before the loop shuts down"""
+        await aclose_async_clients()
+
+    async def aexecute_statement(self, sql, params=None):
+        """execute_statement on aiobotocore, or on the boto3 client in a worker thread without it"""
+        client = await get_async_client("rds-data")
+        if client is None:
+            return await asyncio.to_thread(self.execute_statement, sql, params)
+        response = await client.execute_statement(
+            resourceArn=self.cluster_arn,
+            secretArn=self.credentials_arn,
+            sql=sql,
+            database=self.database_name,
+            formatRecordsAs="JSON",
+        )
+        del response["ResponseMetadata"]
+        return response
+
+    def execute_tuned(self, sql, search_settings=None, params=None):
+        """Run a search with per-request hnsw.ef_search / hnsw.iterative_scan, applied by
+        bedrock_integration.tuned_search within the statement's own transaction."""
+        if not search_settings or search_settings.get("plan") == "exact":
+            return self.execute_statement(sql)
+        try:
+            response = self.execute_statement(build_tuned_sql(sql, search_settings))
+        except ClientError as e:
+            if not is_database_error(e): raise
+            print(f"tuned_search not available, running with server defaults: {e}")
+            return self.execute_statement(sql)
+        return unwrap_tuned_response(response)
+
+    async def aexecute_tuned(self, sql, search_settings=None, params=None):
+        if not search_settings or search_settings.get("plan") == "exact":
+            return await self.aexecute_statement(sql)
+        try:
+            response = await self.aexecute_statement(build_tuned_sql(sql, search_settings))
+        except ClientError as e:
+            if not is_database_error(e): raise
+            print(f"tuned_search not available, running with server defaults: {e}")
+            return await self.aexecute_statement(sql)
+        return unwrap_tuned_response(response)
+
     def insert(self, rows):
         for row in rows:
             sql = f"\
@@ -30,26 +150,264 @@ class AuroraPostgres:
                     '{row['source']}','{row['sourceurl']}','{row['topic']}','{row['content_type']}', '{row['language']}')"
             self.execute_statement(sql)
 
-    def similarity_search(self, vector, how="cosine", k=5, filter:List=[None]):
+    def estimate_rows(self, filter):
+        """Rows matching the filter according to the planner statistics (EXPLAIN, nothing is scanned)"""
+        where = build_where(filter)
+        cached = self.row_estimates.get(where)
+        if cached and time.time() - cached[1] < row_estimate_ttl_seconds:
+            return cached[0]
+        response = self.execute_statement(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM bedrock_integration.knowledge_bases{where}")
+        record = json.loads(response.get("formattedRecords"))[0]
+        plan = list(record.values())[0]
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        rows = int(plan[0]["Plan"]["Plan Rows"])
+        self.row_estimates[where] = (rows, time.time())
+        return rows
 
+    def ingestion_watermark(self, filter):
+        """Latest ingestion date of the rows matching the filter, changes when new rows are added"""
+        where = build_where(filter)
+        response = self.execute_statement(f'SELECT max("date") AS watermark FROM bedrock_integration.knowledge_bases{where}')
+        return json.loads(response.get("formattedRecords"))[0].get("watermark")
 
+    def choose_plan(self, filter):
+        """"exact" for selective filters (e.g. a single video), "ann" for everything else"""
+        if not build_where(filter):
+            return dict(plan="ann", estimated_rows=None)
+        try:
+            rows = self.estimate_rows(filter)
+        except Exception as e:
+            print(f"Row estimate failed, using ANN: {e}")
+            return dict(plan="ann", estimated_rows=None)
+        return dict(plan="exact" if rows <= exact_scan_max_rows else "ann", estimated_rows=rows)
+
+    def similarity_sql(self, vector, how="cosine", k=5, filter:List=[None], query_text=None, hybrid=False, candidates=None, rrf_k=60,
+                       columns=None, include_embedding=False, offset=0, search_settings=None):
+        """(sql, params) of a similarity search, shared by the sync and async paths"""
+        params = {}
+        if hybrid and query_text:
+            sql = self.hybrid_sql(vector, query_text, k=k, filter=filter, candidates=candidates, rrf_k=rrf_k,
+                                  select=build_select(columns, include_embedding, alias="kb"), offset=offset,
+                                  search_settings=search_settings, params=params)
+            return sql, params
+
+        select = build_select(columns, include_embedding)
+        source = build_from(filter, exact=is_exact(search_settings))
+        v = self.bind_vector("query_vector", vector, params)
         if how == "l2":
             method = "<->"
-            sql = f"SELECT *, embedding {method} '{vector}' AS distance FROM bedrock_integration.knowledge_bases ORDER BY distance LIMIT {k}"
+            sql = f"SELECT {select}, embedding {method} {v} AS distance FROM {source} ORDER BY distance LIMIT {k} OFFSET {offset}"
 
         if how == "cosine":
             method = "<=>"
-            sql = f"SELECT *, 1- (embedding {method} '{vector}') AS similarity FROM bedrock_integration.knowledge_bases ORDER BY similarity desc LIMIT {k}"
-            
-        if len(filter):
-            where = f" WHERE {filter[0]['key']} = '{filter[0]['value']}'"
-            for f in filter[1:]:
-                where += f" AND {f['key']} = '{f['value']}'"
-            sql = sql.replace("ORDER BY", f"{where} ORDER BY")
+            if use_quantized(search_settings):
+                source = build_candidates(v, filter, (k + offset) * rerank_factor)
+            # order by the distance operator itself so the HNSW index can be used
+            sql = f"SELECT {select}, 1- (embedding {method} {v}) AS similarity FROM {source} ORDER BY embedding {method} {v} LIMIT {k} OFFSET {offset}"
+        return sql, params
+
+    def similarity_search(self, vector, how="cosine", k=5, filter:List=[None], query_text=None, hybrid=False, candidates=None, rrf_k=60,
+                          columns=None, include_embedding=False, offset=0, search_settings=None):
+        """columns: projection (defaults to DEFAULT_COLUMNS), include_embedding: also return the vectors,
+        offset: rows to skip, used by the cursor pagination of the retrieval API,
+        search_settings: HNSW settings from resolve_search_settings."""
+        start = time.perf_counter()
+        sql, params = self.similarity_sql(vector, how, k, filter, query_text, hybrid, candidates, rrf_k,
+                                          columns, include_embedding, offset, search_settings)
         #print (f"SQL:{sql}")
-        response = self.execute_statement(sql)
+        response = self.execute_tuned(sql, search_settings, params)
+
+        print(f"similarity_search: {round((time.perf_counter() - start) * 1000)} ms, "
+              f"{len(response.get('formattedRecords', ''))} bytes, k={k}, offset={offset}, embedding={include_embedding}, settings={search_settings}")
+        return response
+
+    async def asimilarity_search(self, vector, how="cosine", k=5, filter:List=[None], query_text=None, hybrid=False, candidates=None, rrf_k=60,
+                                 columns=None, include_embedding=False, offset=0, search_settings=None):
+        """similarity_search without blocking the event loop"""
+        start = time.perf_counter()
+        sql, params = self.similarity_sql(vector, how, k, filter, query_text, hybrid, candidates, rrf_k,
+                                          columns, include_embedding, offset, search_settings)
+        response = await self.aexecute_tuned(sql, search_settings, params)
+        print(f"asimilarity_search: {round((time.perf_counter() - start) * 1000)} ms, "
+              f"{len(response.get('formattedRecords', ''))} bytes, k={k}, offset={offset}, settings={search_settings}")
+        return response
+
+    def batch_similarity_search(self, vectors, ks, how="cosine", filter:List=[None], columns=None, include_embedding=False, search_settings=None):
+        """kNN for several query vectors in one statement (LATERAL join per vector).
+        Rows carry query_index, the position of their vector in `vectors`."""
+        start = time.perf_counter()
+        select = build_select(columns, include_embedding)
+        source = build_from(filter, exact=is_exact(search_settings))
+        method = "<->" if how == "l2" else "<=>"
+        score = "embedding <-> q.v AS distance" if how == "l2" else "1 - (embedding <=> q.v) AS similarity"
+        if how == "cosine" and use_quantized(search_settings):
+            source = build_candidates("q.v", filter, f"q.k * {rerank_factor}")
+        params = {}
+        values = ", ".join(f"({i}, {int(k)}, {self.bind_vector(f'query_vector_{i}', vector, params)})"
+                           for i, (vector, k) in enumerate(zip(vectors, ks)))
+
+        sql = f"""WITH q (query_index, k, v) AS (VALUES {values})
+        SELECT q.query_index, r.* FROM q CROSS JOIN LATERAL (
+            SELECT {select}, {score} FROM {source}
+            ORDER BY embedding {method} q.v LIMIT q.k
+        ) r
+        ORDER BY q.query_index"""
+
+        response = self.execute_tuned(sql, search_settings, params)
+        print(f"batch_similarity_search: {round((time.perf_counter() - start) * 1000)} ms, "
+              f"{len(response.get('formattedRecords', ''))} bytes, queries={len(vectors)}")
         return response
 
+    def hybrid_search(self, vector, query_text, k=5, filter:List=[None], candidates=None, rrf_k=60, select="kb.*", offset=0, search_settings=None):
+        """Full-text and cosine top-N in one statement, fused with reciprocal rank fusion:
+        score = 1/(rrf_k + vector_rank) + 1/(rrf_k + text_rank)
+        """
+        params = {}
+        sql = self.hybrid_sql(vector, query_text, k=k, filter=filter, candidates=candidates, rrf_k=rrf_k, select=select,
+                              offset=offset, search_settings=search_settings, params=params)
+        return self.execute_tuned(sql, search_settings, params)
+
+    def hybrid_sql(self, vector, query_text, k=5, filter:List=[None], candidates=None, rrf_k=60, select="kb.*", offset=0,
+                   search_settings=None, params=None):
+        """SQL of hybrid_search, bound values are added to params"""
+        params = {} if params is None else params
+        n = candidates if candidates else max((k + offset) * 4, 20)
+        where = build_where(filter)
+        v = self.bind_vector("query_vector", vector, params)
+        source = build_from(filter, exact=is_exact(search_settings))
+        if use_quantized(search_settings):
+            source = build_candidates(v, filter, n * rerank_factor)
+        text_where = f"{where} AND {TEXT_SEARCH_VECTOR} @@ q" if where else f" WHERE {TEXT_SEARCH_VECTOR} @@ q"
+        query_text = self.bind_text("query_text", query_text, params)
+
+        sql = f"""WITH vector_search AS (
+            SELECT id, RANK() OVER (ORDER BY distance) AS rank FROM (
+                SELECT id, embedding <=> {v} AS distance FROM {source}
+                ORDER BY distance LIMIT {n}) v
+        ), text_search AS (
+            SELECT id, RANK() OVER (ORDER BY text_rank DESC) AS rank FROM (
+                SELECT id, ts_rank_cd({TEXT_SEARCH_VECTOR}, q) AS text_rank
+                FROM bedrock_integration.knowledge_bases, websearch_to_tsquery('english', {query_text}) q{text_where}
+                ORDER BY text_rank DESC LIMIT {n}) t
+        ), fused AS (
+            SELECT COALESCE(v.id, t.id) AS id,
+                COALESCE(1.0 / ({rrf_k} + v.rank), 0) + COALESCE(1.0 / ({rrf_k} + t.rank), 0) AS rrf_score
+            FROM vector_search v FULL OUTER JOIN text_search t ON v.id = t.id
+        )
+        SELECT {select}, 1 - (kb.embedding <=> {v}) AS similarity, fused.rrf_score
+        FROM fused JOIN bedrock_integration.knowledge_bases kb ON kb.id = fused.id
+        ORDER BY fused.rrf_score DESC LIMIT {k} OFFSET {offset}"""
+        return sql
+
+
+def build_tuned_sql(sql, search_settings):
+    escaped_sql = sql.replace("'", "''")
+    return (f"SELECT bedrock_integration.tuned_search('{escaped_sql}', "
+            f"{int(search_settings['ef_search'])}, '{search_settings['iterative_scan']}') AS row")
+
+
+def unwrap_tuned_response(response):
+    # row_to_json nests json columns, keep them as strings like the plain Data API rows
+    rows = []
+    for record in json.loads(response.get("formattedRecords", "[]")):
+        row = json.loads(record["row"]) if isinstance(record["row"], str) else record["row"]
+        rows.append({k: json.dumps(v) if isinstance(v, (dict, list)) else v for k, v in row.items()})
+    response["formattedRecords"] = json.dumps(sort_rows(rows))
+    return response
+
+
+def is_database_error(error):
+    return error.response.get("Error", {}).get("Code") == "DatabaseErrorException"
+
+
+def sort_rows(rows):
+    """relaxed_order scans can return rows slightly out of order, restore it per query"""
+    def key(row):
+        if row.get("rrf_score") is not None: score = -row["rrf_score"]
+        elif row.get("distance") is not None: score = row["distance"]
+        else: score = -(row.get("similarity") or 0)
+        return (row.get("query_index", 0), score)
+    return sorted(rows, key=key)
+
+
+def select_columns(columns=None, include_embedding=False):
+    """Columns a search returns: the requested ones (DEFAULT_COLUMNS by default) plus those needed to build documents"""
+    columns = list(columns) if columns else list(DEFAULT_COLUMNS)
+    unknown = [c for c in columns if c not in ALL_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}, valid columns are {ALL_COLUMNS}")
+    if include_embedding and "embedding" not in columns:
+        columns.append("embedding")
+    # id, content_type, metadata and sourceurl are needed to build the documents
+    for required in ["id", "content_type", "metadata", "sourceurl"]:
+        if required not in columns:
+            columns.append(required)
+    return columns
+
+
+def build_select(columns=None, include_embedding=False, alias=""):
+    columns = select_columns(columns, include_embedding)
+    prefix = f"{alias}." if alias else ""
+    return ", ".join(f'{prefix}"{c}"' for c in columns)
+
+
+def is_exact(search_settings):
+    return bool(search_settings) and search_settings.get("plan") == "exact"
+
+
+def use_quantized(search_settings):
+    return vector_storage != "full" and not is_exact(search_settings)
+
+
+def quantized_distance(vector_sql):
+    """Distance on the quantized expression index, matching the table creator's index definition"""
+    if vector_storage == "halfvec":
+        return f"embedding::halfvec({embedding_dimension}) <=> ({vector_sql})::halfvec({embedding_dimension})"
+    return f"binary_quantize(embedding)::bit({embedding_dimension}) <~> binary_quantize({vector_sql})"
+
+
+def build_candidates(vector_sql, filter, n):
+    """First stage of the quantized search: n candidates from the halfvec/binary HNSW index,
+    the outer query re-ranks them with the full precision vectors in the same statement."""
+    where = build_where(filter)
+    return (f"(SELECT * FROM bedrock_integration.knowledge_bases{where} "
+            f"ORDER BY {quantized_distance(vector_sql)} LIMIT {n}) AS candidates")
+
+
+def build_from(filter, exact=False):
+    """FROM clause with the filter applied. For the exact plan the filtered rows are read
+    through the B-tree indexes inside an OFFSET 0 subquery, which keeps the planner from
+    pushing the ORDER BY into the HNSW index, and then sorted exactly."""
+    where = build_where(filter)
+    if exact and where:
+        return f"(SELECT * FROM bedrock_integration.knowledge_bases{where} OFFSET 0) AS exact_scan"
+    return f"bedrock_integration.knowledge_bases{where}"
+
+
+def build_where(filter):
+    """WHERE clause for the filter. content_type goes first and is emitted exactly as
+    content_type = '<type>' (lower case), the predicate of the partial HNSW indexes."""
+    filter = [f for f in (filter or []) if f]
+    if not len(filter):
+        return ""
+    unknown = [f['key'] for f in filter if f['key'] not in FILTER_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown filter keys {unknown}, valid keys are {FILTER_KEYS}")
+    filter = sorted(filter, key=lambda f: f['key'] != "content_type")
+    predicates = []
+    for f in filter:
+        value = str(f['value'])
+        if f['key'] == "content_type":
+            value = value.strip().lower()
+        predicates.append(f"{f['key']} = '{value.replace(chr(39), chr(39) * 2)}'")
+    return " WHERE " + " AND ".join(predicates)
+
+
+def is_content_type_only(filter):
+    """True when the filter only restricts content_type, which a partial HNSW index answers without post-filtering"""
+    keys = {f['key'] for f in (filter or []) if f}
+    return keys == {"content_type"}
+
 
 def get_ssm_parameter(name):
     response = ssm.get_parameter(Name=name, WithDecryption=True)
@@ -1,6 +1,9 @@
 from typing import List, Dict
 from botocore.config import Config
+from botocore.exceptions import ClientError
 import boto3
+import os
+import time
 
 DEFAULT_MODEL_ID = "us.anthropic.claude-3-7-sonnet-20250219-v1:0"
 #DEFAULT_MODEL_ID = "us.anthropic.claude-3-5-haiku-20241022-v1:0"
@@ -9,9 +12,33 @@ config = Config(
    retries = {
       'max_attempts': 10,
       'mode': 'adaptive'
-   }
+   },
+   max_pool_connections=int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "10")),
 )
 
+# Converse prompt caching: a cache point closes the static system prompt so later
+# requests with the same prefix read it from the cache instead of processing it again
+prompt_caching = os.environ.get("PROMPT_CACHING", "true").lower() == "true"
+
+CACHE_POINT = {"cachePoint": {"type": "default"}}
+
+# Models only cache a prefix of at least this many tokens (1,024 for Claude 3.7 Sonnet and
+# Amazon Nova, 2,048 for Claude 3.5 Haiku), shorter system prompts are sent without a cache point
+prompt_cache_min_tokens = int(os.environ.get("PROMPT_CACHE_MIN_TOKENS", "1024"))
+
+# bedrock-runtime clients, one per model and container, reused by every ThinkingLLM
+bedrock_clients = {}
+
+# models that rejected cache points, called without them from then on
+no_cache_point_models = set()
+
+
+def get_bedrock_client(model_id=None):
+    key = model_id or DEFAULT_MODEL_ID
+    if key not in bedrock_clients:
+        bedrock_clients[key] = boto3.client(service_name="bedrock-runtime", config=config)
+    return bedrock_clients[key]
+
 
 class ThinkingLLM:
     def __init__(
@@ -19,7 +46,8 @@ class ThinkingLLM:
         model_id = None,
         budget_tokens = 0,
         max_tokens = 1024,
-        system_prompt = None
+        system_prompt = None,
+        prompt_caching = prompt_caching
     ):
 
         self.model_id = model_id if model_id else DEFAULT_MODEL_ID
@@ -28,20 +56,20 @@ class ThinkingLLM:
         self.thinking_enabled = True if budget_tokens else False
         self.conversation: List[Dict] = []
         self.system_prompt = system_prompt
+        self.prompt_caching = prompt_caching
         self.reasoning_config = {"thinking": {"type": "enabled", "budget_tokens": self.budget_tokens}}
+        self.ttft_ms = None
+        self.usage = {}
 
-        # Initialize Bedrock client
-        self.client = boto3.client(service_name="bedrock-runtime", config=config)
+        # Reuse the container's Bedrock client for this model
+        self.client = get_bedrock_client(self.model_id)
 
-    def answer(self, content) -> str:
-        """Get completion from Claude model based on conversation history.
-
-        Returns:
-            str: Model completion text
-        """
-
-        # Invoke model
+    def use_cache_point(self):
+        # ~4 characters per token
+        return (self.prompt_caching and bool(self.system_prompt) and len(self.system_prompt) // 4 >= prompt_cache_min_tokens
+                and self.model_id not in no_cache_point_models)
 
+    def build_request(self, content) -> Dict:
         kwargs = dict(
             modelId=self.model_id,
             inferenceConfig=dict(maxTokens=self.max_tokens),
@@ -58,11 +86,63 @@ class ThinkingLLM:
             kwargs["additionalModelRequestFields"]=self.reasoning_config
         if self.system_prompt:
             kwargs["system"] = [{"text": self.system_prompt}]
+            if self.use_cache_point():
+                kwargs["system"].append(CACHE_POINT)
+        return kwargs
+
+    def call(self, operation, content):
+        """converse / converse_stream, retried once without the cache point
+        when the model does not support prompt caching"""
+        kwargs = self.build_request(content)
+        try:
+            return getattr(self.client, operation)(**kwargs)
+        except ClientError as e:
+            error = e.response.get("Error", {})
+            if error.get("Code") != "ValidationException" or "cach" not in error.get("Message", "").lower() or not self.use_cache_point():
+                raise
+            print(f"Prompt caching not available for {self.model_id}, calling without cache point: {e}")
+            no_cache_point_models.add(self.model_id)
+            return getattr(self.client, operation)(**self.build_request(content))
 
+    def record_usage(self, usage, start):
+        """Token usage including cacheReadInputTokens / cacheWriteInputTokens when the prefix is cached"""
+        self.usage = usage or {}
+        print(f"Usage: {round((time.perf_counter() - start) * 1000)} ms model={self.model_id} usage={self.usage}")
 
+    def answer(self, content) -> str:
+        """Get completion from Claude model based on conversation history.
 
-        response = self.client.converse(**kwargs)
+        Returns:
+            str: Model completion text
+        """
+
+        # Invoke model
+        start = time.perf_counter()
+        response = self.call("converse", content)
+        self.record_usage(response.get("usage"), start)
         # answer = response["output"]["message"]["content"][1]["text"]
         # reasoning = response["output"]["message"]["content"][0]["reasoningContent"]["reasoningText"]["text"]
         return response.get("output",{}).get("message",{}).get("content", [])
-        
+
+    def answer_stream(self, content):
+        """Stream the completion with converse_stream.
+
+        Yields:
+            str: Answer text deltas as the model generates them
+        """
+        start = time.perf_counter()
+        self.ttft_ms = None
+        self.usage = {}
+        response = self.call("converse_stream", content)
+
+        for event in response.get("stream", []):
+            if "contentBlockDelta" in event:
+                text = event["contentBlockDelta"].get("delta", {}).get("text")
+                if not text:
+                    continue
+                if self.ttft_ms is None:
+                    self.ttft_ms = round((time.perf_counter() - start) * 1000)
+                    print(f"TTFT: {self.ttft_ms} ms model={self.model_id}")
+                yield text
+            elif "metadata" in event:
+                self.record_usage(event["metadata"].get("usage", {}), start)
@@ -0,0 +1,105 @@
+import math
+import os
+import re
+
+# Defaults of the retrieve_generate context budget, each can be overridden per request
+context_token_budget = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "8000"))
+context_similarity_floor = float(os.environ.get("CONTEXT_SIMILARITY_FLOOR", "0"))
+context_max_chunk_chars = int(os.environ.get("CONTEXT_MAX_CHUNK_CHARS", "2000"))
+
+# Estimated input tokens per keyframe: a 1280x720 frame is ~1,200 tokens
+# (width * height / 750), its 384 px thumbnail ~110
+image_tokens_full = int(os.environ.get("IMAGE_TOKENS_FULL", "1200"))
+image_tokens_thumbnail = int(os.environ.get("IMAGE_TOKENS_THUMBNAIL", "110"))
+
+CHARS_PER_TOKEN = 4
+
+WORD = re.compile(r"\w+")
+
+
+def text_tokens(text):
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def image_tokens(image_file, rendition=None):
+    # a rendition other than the frame itself is its thumbnail, an unplanned frame is charged in full
+    return image_tokens_thumbnail if rendition and rendition != image_file else image_tokens_full
+
+
+def best_span(text, query, max_chars):
+    """The max_chars window of text centered on the densest run of query terms, cut at word boundaries"""
+    if len(text) <= max_chars:
+        return text
+    terms = {w.lower() for w in WORD.findall(query or "") if len(w) > 2}
+    hits = [m.start() for m in WORD.finditer(text) if m.group().lower() in terms]
+    best_start = 0
+    if hits:
+        # window centered on each hit, keep the one covering most hits
+        best_count = -1
+        for hit in hits:
+            start = min(max(0, hit - max_chars // 2), len(text) - max_chars)
+            count = sum(1 for h in hits if start <= h < start + max_chars)
+            if count > best_count:
+                best_start, best_count = start, count
+    end = best_start + max_chars
+    # drop the partial words at both ends
+    if best_start > 0 and " " in text[best_start:end]:
+        best_start = text.index(" ", best_start) + 1
+    if end < len(text) and " " in text[best_start:end]:
+        end = text.rindex(" ", best_start, end)
+    prefix = "... " if best_start > 0 else ""
+    suffix = " ..." if end < len(text) else ""
+    return f"{prefix}{text[best_start:end]}{suffix}"
+
+
+def budget_context(docs, query, token_budget=None, similarity_floor=None, max_chunk_chars=None, image_renditions=None):
+    """Docs to send to the LLM, in rank order:
+    - docs with a similarity below similarity_floor are dropped
+    - text chunks longer than max_chunk_chars are cut to their best-matching span
+    - keyframes are charged for the rendition image_renditions ({s3_uri: rendition_uri}) plans
+      to send, it is kept in their "rendition" metadata for the generation
+    - docs are packed greedily while their estimated tokens fit token_budget
+    Returns (included_docs, report)."""
+    token_budget = context_token_budget if token_budget is None else int(token_budget)
+    similarity_floor = context_similarity_floor if similarity_floor is None else float(similarity_floor)
+    max_chunk_chars = context_max_chunk_chars if max_chunk_chars is None else int(max_chunk_chars)
+
+    included, entries = [], []
+    used_tokens = 0
+    for rank, doc in enumerate(docs):
+        content_type = doc.metadata.get("content_type")
+        similarity = doc.metadata.get("similarity")
+        entry = dict(rank=rank, id=doc.id, content_type=content_type, similarity=similarity)
+        entries.append(entry)
+
+        if similarity is not None and similarity < similarity_floor:
+            entry.update(included=False, reason="below_similarity_floor")
+            continue
+
+        if content_type == "image":
+            source = doc.metadata.get("source")
+            rendition = (image_renditions or {}).get(source)
+            tokens = image_tokens(source, rendition)
+            if rendition:
+                doc = doc.model_copy(update=dict(metadata=dict(doc.metadata, rendition=rendition)))
+                entry["rendition"] = "full" if rendition == source else "thumbnail"
+        else:
+            text = doc.page_content or ""
+            if len(text) > max_chunk_chars:
+                text = best_span(text, query, max_chunk_chars)
+                doc = doc.model_copy(update=dict(page_content=text, metadata=dict(doc.metadata, truncated=True)))
+                entry["truncated"] = True
+            tokens = text_tokens(text)
+        entry["tokens"] = tokens
+
+        if used_tokens + tokens > token_budget:
+            entry.update(included=False, reason="over_budget")
+            continue
+        used_tokens += tokens
+        entry["included"] = True
+        included.append(doc)
+
+    report = dict(token_budget=token_budget, estimated_tokens=used_tokens, similarity_floor=similarity_floor,
+                  included=len(included), dropped=len(docs) - len(included), docs=entries)
+    print(f"Context budget: {len(included)}/{len(docs)} docs, ~{used_tokens}/{token_budget} tokens")
+    return included, report
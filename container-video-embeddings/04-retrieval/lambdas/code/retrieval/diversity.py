@@ -0,0 +1,121 @@
+import json
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    # without numpy only the time window de-duplication is applied
+    np = None
+
+# Defaults of the post-retrieval diversity stage, each can be overridden per request
+diversity_fetch_factor = int(os.environ.get("DIVERSITY_FETCH_FACTOR", "4"))
+mmr_lambda = float(os.environ.get("MMR_LAMBDA", "0.7"))
+dedup_time_window = int(os.environ.get("DEDUP_TIME_WINDOW_SECONDS", "5"))
+
+# columns the diversity stage reads from each candidate row
+DIVERSITY_COLUMNS = ["source", "time", "content_type"]
+
+
+def resolve_diversity(value, k, max_vector_rows=None):
+    """Diversity settings for a request: None (disabled), True (defaults) or a dict with
+    fetch_k, mmr_lambda and time_window overrides.
+    max_vector_rows: candidates one response can carry with their vectors, fetch_k is capped to it.
+    When even k does not fit, candidates come without vectors and only the time window rule applies."""
+    if not value:
+        return None
+    overrides = value if isinstance(value, dict) else {}
+    unknown = [key for key in overrides if key not in ("fetch_k", "mmr_lambda", "time_window")]
+    if unknown:
+        raise ValueError(f"Unknown diversity settings {unknown}, valid settings are fetch_k, mmr_lambda, time_window")
+    settings = dict(fetch_k=k * diversity_fetch_factor, mmr_lambda=mmr_lambda, time_window=dedup_time_window)
+    settings.update(overrides)
+    settings["fetch_k"] = max(int(settings["fetch_k"]), k)
+    settings["vectors"] = True
+    if max_vector_rows and settings["fetch_k"] > max_vector_rows:
+        if k < max_vector_rows:
+            print(f"Diversity: fetch_k {settings['fetch_k']} capped to {max_vector_rows} candidates with vectors")
+            settings["fetch_k"] = max_vector_rows
+        else:
+            print(f"Diversity: k {k} candidates with vectors exceed {max_vector_rows} rows, time window only")
+            settings["vectors"] = False
+    return settings
+
+
+def same_segment(row, other, time_window):
+    """Same video, same content type and within time_window seconds of each other"""
+    if row.get("source") != other.get("source") or row.get("content_type") != other.get("content_type"):
+        return False
+    if row.get("time") is None or other.get("time") is None:
+        return False
+    return abs(int(row.get("time")) - int(other.get("time"))) <= time_window
+
+
+def suppression_mask(rows, time_window):
+    """suppress[i, j] is True when rows i and j are near-duplicates in time"""
+    groups = {}
+    group_ids = np.array([groups.setdefault((row.get("source"), row.get("content_type")), len(groups)) for row in rows])
+    times = np.array([row.get("time") if row.get("time") is not None else np.nan for row in rows], dtype=float)
+    # NaN (no time) never compares as close
+    close = np.abs(times[:, None] - times[None, :]) <= time_window
+    return (group_ids[:, None] == group_ids[None, :]) & close
+
+
+def parse_vectors(rows):
+    # the Data API returns vectors as text, parsing is most of the cost of this stage
+    return np.array([json.loads(row["embedding"]) if isinstance(row["embedding"], str) else row["embedding"] for row in rows],
+                    dtype=np.float32)
+
+
+def mmr_select(rows, vectors, query_vector, k, mmr_lambda, time_window):
+    # new arrays: a float32 query vector of the caller would otherwise be normalized in place
+    vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) + 1e-12)
+
+    relevance = vectors @ query
+    pairwise = vectors @ vectors.T
+    suppress = suppression_mask(rows, time_window)
+
+    n = len(rows)
+    max_similarity = np.full(n, -np.inf)
+    available = np.ones(n, dtype=bool)
+    suppressed = np.zeros(n, dtype=bool)
+    selected = []
+    while len(selected) < k and available.any():
+        redundancy = np.where(np.isfinite(max_similarity), max_similarity, 0.0)
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        # near-duplicates only fill the remaining slots once everything else is taken
+        candidates = available & ~suppressed if (available & ~suppressed).any() else available
+        best = int(np.argmax(np.where(candidates, scores, -np.inf)))
+        selected.append(best)
+        available[best] = False
+        suppressed |= suppress[best]
+        max_similarity = np.maximum(max_similarity, pairwise[best])
+    return [rows[i] for i in selected]
+
+
+def dedup_select(rows, k, time_window):
+    """Rank order with the time window rule, used when numpy is not available"""
+    kept, skipped = [], []
+    for row in rows:
+        (skipped if any(same_segment(row, other, time_window) for other in kept) else kept).append(row)
+    return (kept + skipped)[:k]
+
+
+def diversify(rows, query_vector, k, mmr_lambda=mmr_lambda, time_window=dedup_time_window, **kwargs):
+    """k rows out of the ranked candidates: MMR over the candidate vectors plus suppression of
+    rows from the same video and content type within time_window seconds of a selected row."""
+    if len(rows) <= 1:
+        return rows[:k]
+    start = time.perf_counter()
+    parse_ms = 0.0
+    if np is not None and all(row.get("embedding") for row in rows):
+        vectors = parse_vectors(rows)
+        parse_ms = (time.perf_counter() - start) * 1000
+        selected = mmr_select(rows, vectors, query_vector, k, mmr_lambda, time_window)
+    else:
+        selected = dedup_select(rows, k, time_window)
+    select_ms = (time.perf_counter() - start) * 1000 - parse_ms
+    print(f"Diversity: {len(selected)} of {len(rows)} candidates, parse {parse_ms:.1f} ms, select {select_ms:.1f} ms")
+    return selected
@@ -1,7 +1,11 @@
+import asyncio
 import boto3
 import base64
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+from async_clients import get_async_client
 
 
 bedrock_runtime = boto3.client(service_name="bedrock-runtime")
@@ -42,4 +46,34 @@ def get_embeddings(content, model_id=default_model_id, embedding_dimension=int(d
     if isinstance(content, bytes):
         return get_image_embeddings(content, model_id, embedding_dimension)
     elif isinstance(content, str):
-        return get_text_embeddings(content, model_id, embedding_dimension)
\ No newline at end of file
+        return get_text_embeddings(content, model_id, embedding_dimension)
+
+
+def get_embeddings_batch(contents, model_id=default_model_id, embedding_dimension=int(default_embedding_dimension), max_workers=8):
+    """Embed several queries concurrently, keeping the input order"""
+    if not contents:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(contents)))) as executor:
+        return list(executor.map(lambda c: get_embeddings(c, model_id, embedding_dimension), contents))
+
+
+def embedding_body(content, embedding_dimension):
+    if isinstance(content, bytes):
+        return json.dumps({"inputImage": base64.b64encode(content).decode('utf8'), "embeddingConfig": {"outputEmbeddingLength": embedding_dimension}})
+    return json.dumps({"inputText": content, "embeddingConfig": {"outputEmbeddingLength": embedding_dimension}})
+
+
+async def aget_embeddings(content, model_id=default_model_id, embedding_dimension=int(default_embedding_dimension)):
+    """Async get_embeddings on aiobotocore, or on the boto3 client in a worker thread without it"""
+    client = await get_async_client("bedrock-runtime")
+    if client is None:
+        return await asyncio.to_thread(get_embeddings, content, model_id, embedding_dimension)
+    response = await client.invoke_model(
+        body=embedding_body(content, embedding_dimension),
+        modelId=model_id,
+        accept="application/json",
+        contentType="application/json",
+    )
+    async with response["body"] as stream:
+        response_body = json.loads(await stream.read())
+    return response_body.get("embedding")
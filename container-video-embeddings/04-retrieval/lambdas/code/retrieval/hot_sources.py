@@ -0,0 +1,296 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from botocore.exceptions import ClientError
+
+try:
+    import numpy as np
+except ImportError:
+    # the local mirror needs numpy, without it every query goes to Aurora
+    np = None
+
+from aurora_service import ALL_COLUMNS, build_where, select_columns
+from utils import s3
+
+# In-memory mirror of frequently queried videos, 0 disables it
+hot_sources_max_bytes = int(os.environ.get("HOT_SOURCES_MAX_BYTES", "0"))
+# queries of a video before its rows are loaded
+hot_source_min_queries = int(os.environ.get("HOT_SOURCE_MIN_QUERIES", "3"))
+# videos with more rows stay in Aurora
+hot_source_max_rows = int(os.environ.get("HOT_SOURCE_MAX_ROWS", "20000"))
+# seconds between watermark checks of a loaded video
+hot_source_refresh_seconds = int(os.environ.get("HOT_SOURCE_REFRESH_SECONDS", "30"))
+# rows per load query, each row carries its embedding as ~20 KB of JSON (Data API responses are limited to 1 MB)
+hot_source_page_rows = int(os.environ.get("HOT_SOURCE_PAGE_ROWS", "40"))
+# S3 location of the video snapshots shared by the containers, empty loads every copy from Aurora
+hot_source_snapshot_bucket = os.environ.get("HOT_SOURCE_SNAPSHOT_BUCKET", "")
+hot_source_snapshot_prefix = os.environ.get("HOT_SOURCE_SNAPSHOT_PREFIX", "hot-sources/")
+
+ROW_COLUMNS = [c for c in ALL_COLUMNS if c != "embedding"]
+
+
+class HotSource:
+    """Rows of one video with their normalized vectors"""
+
+    def __init__(self, rows, vectors, watermark):
+        self.rows = rows
+        self.vectors = vectors
+        self.norms = np.linalg.norm(vectors, axis=1)
+        self.unit_vectors = vectors / (self.norms[:, None] + 1e-12)
+        self.content_types = np.array([row.get("content_type") for row in rows])
+        self.ids = {row["id"] for row in rows}
+        self.watermark = watermark
+        self.checked = time.time()
+        self.nbytes = self.vectors.nbytes * 2 + len(json.dumps(rows))
+
+
+class HotSources:
+    """Answers source filtered queries from memory for the videos queried most often.
+
+    A video is loaded after hot_source_min_queries queries and searched exactly (the plan Aurora
+    uses for a single video as well), from its S3 snapshot when there is one and from Aurora
+    otherwise. Every hot_source_refresh_seconds its max(date) and row count are compared with
+    the copy: new rows are appended, a count mismatch (deleted rows) reloads it. Least recently
+    used videos are evicted above max_bytes.
+
+    Loads and refreshes run outside the lock: while a video loads its queries go to Aurora,
+    while it refreshes they are answered from the current copy."""
+
+    def __init__(self, aurora, max_bytes=hot_sources_max_bytes):
+        self.aurora = aurora
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.sources = OrderedDict()
+        self.query_counts = Counter()
+        self.too_large = set()
+        # videos being loaded or refreshed by a thread
+        self.loading = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, vector, how="cosine", k=5, filter=None, query_text=None, hybrid=False,
+               columns=None, include_embedding=False, offset=0, search_settings=None, **kwargs):
+        """similarity_search response for the query, None when Aurora has to answer it"""
+        source_id, content_type = self.split_filter(filter)
+        if source_id is None or (hybrid and query_text) or how not in ("cosine", "l2"):
+            return None
+        source = self.get_source(source_id)
+        if source is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        start = time.perf_counter()
+        query = np.asarray(vector, dtype=np.float32)
+        if how == "cosine":
+            scores = source.unit_vectors @ (query / (np.linalg.norm(query) + 1e-12))
+            order_scores = -scores
+        else:
+            scores = np.linalg.norm(source.vectors - query, axis=1)
+            order_scores = scores
+        if content_type is not None:
+            order_scores = np.where(source.content_types == content_type, order_scores, np.inf)
+        n = min(k + offset, int(np.isfinite(order_scores).sum()))
+        top = np.argpartition(order_scores, n - 1)[:n] if 0 < n < len(order_scores) else np.arange(n)
+        top = top[np.argsort(order_scores[top])][offset:]
+
+        output_columns = select_columns(columns, include_embedding)
+        score_column = "similarity" if how == "cosine" else "distance"
+        rows = []
+        for i in top:
+            row = {c: source.rows[i].get(c) for c in output_columns if c != "embedding"}
+            if "embedding" in output_columns:
+                row["embedding"] = json.dumps(source.vectors[i].tolist())
+            row[score_column] = float(scores[i])
+            rows.append(row)
+        records = json.dumps(rows)
+        print(f"hot source search: {round((time.perf_counter() - start) * 1000, 1)} ms, {len(rows)} of {len(source.rows)} rows, "
+              f"source={source_id}, k={k}, offset={offset}, {self.stats()}")
+        return {"formattedRecords": records}
+
+    def split_filter(self, filter):
+        """(source, content_type) of a source filter, (None, None) for any other filter"""
+        filter = [f for f in (filter or []) if f]
+        values = {f["key"]: str(f["value"]) for f in filter}
+        if "source" not in values or len(values) != len(filter):
+            return None, None
+        content_type = values.get("content_type")
+        return values["source"], content_type.strip().lower() if content_type is not None else None
+
+    def get_source(self, source_id):
+        with self.lock:
+            source = self.sources.get(source_id)
+            if source is None:
+                self.count_query(source_id)
+                if (self.query_counts[source_id] < hot_source_min_queries or source_id in self.too_large
+                        or source_id in self.loading):
+                    return None
+            else:
+                self.sources.move_to_end(source_id)
+                if time.time() - source.checked <= hot_source_refresh_seconds or source_id in self.loading:
+                    return source
+            self.loading.add(source_id)
+        try:
+            return self.refresh(source_id, source) if source is not None else self.load(source_id)
+        finally:
+            with self.lock:
+                self.loading.discard(source_id)
+
+    def count_query(self, source_id):
+        # bounded, counts restart once too many videos were seen
+        if len(self.query_counts) > 10000:
+            self.query_counts.clear()
+        self.query_counts[source_id] += 1
+
+    def source_state(self, source_id):
+        where = build_where([dict(key="source", value=source_id)])
+        response = self.aurora.execute_statement(
+            f'SELECT max("date") AS watermark, count(*) AS row_count FROM bedrock_integration.knowledge_bases{where}'
+        )
+        record = json.loads(response.get("formattedRecords"))[0]
+        return record.get("watermark"), int(record.get("row_count") or 0)
+
+    def fetch_rows(self, source_id, since=None):
+        """Rows of the video (date >= since when given), paged by id"""
+        rows, last_id = [], None
+        columns = ", ".join(f'"{c}"' for c in ROW_COLUMNS + ["embedding"])
+        while True:
+            params = {}
+            predicates = [build_where([dict(key="source", value=source_id)])]
+            if since is not None:
+                predicates.append(f'"date" >= {self.aurora.bind_text("since", since, params)}')
+            if last_id is not None:
+                predicates.append(f"id > {self.aurora.bind_text('last_id', last_id, params)}::uuid")
+            sql = (f"SELECT {columns} FROM bedrock_integration.knowledge_bases{' AND '.join(predicates)} "
+                   f"ORDER BY id LIMIT {hot_source_page_rows}")
+            page = json.loads(self.aurora.execute_statement(sql, params).get("formattedRecords"))
+            rows.extend(page)
+            if len(page) < hot_source_page_rows:
+                return rows
+            last_id = page[-1]["id"]
+
+    def build_source(self, rows, watermark):
+        vectors = np.array([json.loads(row.pop("embedding")) if isinstance(row["embedding"], str) else row.pop("embedding")
+                            for row in rows], dtype=np.float32).reshape(len(rows), -1)
+        return HotSource(rows, vectors, watermark)
+
+    def load(self, source_id):
+        start = time.perf_counter()
+        watermark, row_count = self.source_state(source_id)
+        if not row_count or row_count > hot_source_max_rows:
+            if row_count:
+                with self.lock:
+                    self.too_large.add(source_id)
+            return None
+        source, origin = self.read_snapshot(source_id), "snapshot"
+        if source is not None and (source.watermark != watermark or len(source.rows) != row_count):
+            source, origin = self.catch_up(source_id, source, watermark, row_count), "snapshot and aurora"
+        if source is None:
+            source, origin = self.build_source(self.fetch_rows(source_id), watermark), "aurora"
+        if source.nbytes > self.max_bytes:
+            with self.lock:
+                self.too_large.add(source_id)
+            return None
+        self.store(source_id, source)
+        if origin != "snapshot":
+            self.write_snapshot(source_id, source)
+        print(f"hot source loaded from {origin}: {source_id}, {len(source.rows)} rows, {source.nbytes} bytes, "
+              f"{round((time.perf_counter() - start) * 1000)} ms")
+        return source
+
+    def refresh(self, source_id, source):
+        watermark, row_count = self.source_state(source_id)
+        if watermark == source.watermark and row_count == len(source.rows):
+            source.checked = time.time()
+            return source
+        refreshed = self.catch_up(source_id, source, watermark, row_count)
+        if refreshed is None:
+            # rows were deleted or replaced, start over
+            self.evict(source_id)
+            return self.load(source_id)
+        self.store(source_id, refreshed)
+        self.write_snapshot(source_id, refreshed)
+        print(f"hot source refreshed: {source_id}, +{len(refreshed.rows) - len(source.rows)} rows")
+        return refreshed
+
+    def catch_up(self, source_id, source, watermark, row_count):
+        """source with the rows added since its watermark, None when rows were deleted or replaced"""
+        new_rows = [row for row in self.fetch_rows(source_id, since=source.watermark) if row["id"] not in source.ids]
+        if len(source.rows) + len(new_rows) != row_count:
+            return None
+        if not new_rows:
+            return HotSource(source.rows, source.vectors, watermark)
+        added = self.build_source(new_rows, watermark)
+        return HotSource(source.rows + added.rows, np.concatenate([source.vectors, added.vectors]), watermark)
+
+    def snapshot_key(self, source_id):
+        return f"{hot_source_snapshot_prefix}{hashlib.sha256(source_id.encode()).hexdigest()}.npz"
+
+    def read_snapshot(self, source_id):
+        """Copy of the video saved by any container, None without one. It can be older than Aurora."""
+        if not hot_source_snapshot_bucket:
+            return None
+        try:
+            body = s3.get_object(Bucket=hot_source_snapshot_bucket, Key=self.snapshot_key(source_id))["Body"].read()
+            with np.load(io.BytesIO(body), allow_pickle=False) as snapshot:
+                state = json.loads(snapshot["state"].tobytes())
+                vectors = snapshot["vectors"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                print(f"hot source snapshot of {source_id} not read: {e}")
+            return None
+        except ValueError as e:
+            print(f"hot source snapshot of {source_id} not read: {e}")
+            return None
+        if state.get("source") != source_id or len(state["rows"]) != len(vectors):
+            return None
+        return HotSource(state["rows"], vectors, state["watermark"])
+
+    def write_snapshot(self, source_id, source):
+        if not hot_source_snapshot_bucket:
+            return
+        buffer = io.BytesIO()
+        state = dict(source=source_id, watermark=source.watermark, rows=source.rows)
+        np.savez(buffer, vectors=source.vectors, state=np.frombuffer(json.dumps(state).encode(), dtype=np.uint8))
+        try:
+            s3.put_object(Bucket=hot_source_snapshot_bucket, Key=self.snapshot_key(source_id), Body=buffer.getvalue())
+        except ClientError as e:
+            print(f"hot source snapshot of {source_id} not written: {e}")
+
+    def store(self, source_id, source):
+        with self.lock:
+            self.remove(source_id)
+            self.sources[source_id] = source
+            self.current_bytes += source.nbytes
+            while self.current_bytes > self.max_bytes and len(self.sources) > 1:
+                evicted_id = next(iter(self.sources))
+                self.remove(evicted_id)
+                print(f"hot source evicted: {evicted_id}")
+
+    def evict(self, source_id):
+        with self.lock:
+            self.remove(source_id)
+
+    def remove(self, source_id):
+        source = self.sources.pop(source_id, None)
+        if source is not None:
+            self.current_bytes -= source.nbytes
+
+    def stats(self):
+        return dict(sources=len(self.sources), bytes=self.current_bytes, max_bytes=self.max_bytes,
+                    hits=self.hits, misses=self.misses)
+
+
+def create_hot_sources(aurora, max_bytes=hot_sources_max_bytes):
+    if not max_bytes:
+        return None
+    if np is None:
+        print("HOT_SOURCES_MAX_BYTES is set but numpy is not installed, hot sources disabled")
+        return None
+    return HotSources(aurora, max_bytes)
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+
+class ImageCache:
+    """Byte-bounded LRU of image bytes keyed by S3 uri.
+    Lives at module level so it survives across warm invocations.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def size(self, key):
+        # length of a cached value, without counting a hit or refreshing its position
+        with self.lock:
+            value = self.items.get(key)
+            return None if value is None else len(value)
+
+    def put(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.items:
+                self.current_bytes -= len(self.items.pop(key))
+            self.items[key] = value
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.current_bytes -= len(evicted)
+
+    def stats(self):
+        return dict(
+            items=len(self.items),
+            bytes=self.current_bytes,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses,
+        )
@@ -1,61 +1,281 @@
+import time
+init_start = time.perf_counter()
+
 import json
 import os
-from multimodal_retriever import CustomMultimodalRetriever
-from aurora_service import AuroraPostgres
-from utils import build_response
-from parse_retrieved_docs import parse_docs_for_context, text_content_block
+import base64
+from aurora_service import AuroraPostgres, resolve_search_settings, is_content_type_only, content_type_indexes, vector_storage, rerank_factor
+from utils import build_response, emit_metrics
+from parse_retrieved_docs import parse_docs_for_context, plan_renditions, text_content_block, DEFAULT_IMAGE_RESOLUTION
 from bedrock_llm import ThinkingLLM
+from prompts import GENERATE_INSTRUCTIONS
+# embeddings, answer_cache, context_budget, hot_sources, diversity and langchain (multimodal_retriever)
+# are imported by the code paths that use them, optional features cost nothing when they are off
+
+# Cold start phases, reported once as metrics by the first invocation
+init_phases = {"ImportsMs": (time.perf_counter() - init_start) * 1000}
+cold_start = True
 
 # Get Data from environment variables, never share secrets!
 cluster_arn = os.environ.get("CLUSTER_ARN")
 credentials_arn = os.environ.get("SECRET_ARN")
 database_name = os.environ.get("DATABASE_NAME")
 
+# "data_api" (default) or "psycopg": pooled direct connections to DB_HOST (cluster or RDS Proxy endpoint)
+db_backend = os.environ.get("DB_BACKEND", "data_api")
+
 # Initialize Aurora PostgreSQL client
-aurora = AuroraPostgres(cluster_arn, database_name, credentials_arn)
+phase_start = time.perf_counter()
+if db_backend == "psycopg":
+    from pg_backend import PooledPostgres
+    aurora = PooledPostgres(database_name, credentials_arn)
+else:
+    aurora = AuroraPostgres(cluster_arn, database_name, credentials_arn)
+init_phases["ClientsMs"] = (time.perf_counter() - phase_start) * 1000
+
+# Verify Aurora Cluster conectivity (constant time, does not depend on the table size):
+phase_start = time.perf_counter()
+aurora.execute_statement("select 1")
+init_phases["ConnectivityProbeMs"] = (time.perf_counter() - phase_start) * 1000
+
+# In-memory copies of frequently queried videos (HOT_SOURCES_MAX_BYTES), None when disabled
+hot_sources = None
+if int(os.environ.get("HOT_SOURCES_MAX_BYTES", "0")):
+    from hot_sources import create_hot_sources
+    hot_sources = create_hot_sources(aurora)
 
-# Verify Aurora Cluster conectivity:
-aurora.execute_statement("select count(*) from bedrock_integration.knowledge_bases")
+# Semantic cache of retrieve_generate answers (ANSWER_CACHE_STORE), None when disabled
+answer_cache = None
+if os.environ.get("ANSWER_CACHE_STORE"):
+    from answer_cache import create_answer_cache
+    answer_cache = create_answer_cache()
 
+# Retrievers are reused across warm invocations, keyed by their settings
+retrievers = {}
 
-def retrieve(event):
+
+def get_retriever(how="cosine", k=5, hybrid=False):
+    key = (how, k, hybrid)
+    if key not in retrievers:
+        # langchain is only imported when the first retrieval needs it
+        phase_start = time.perf_counter()
+        from multimodal_retriever import CustomMultimodalRetriever
+        if "LangchainImportMs" not in init_phases:
+            init_phases["LangchainImportMs"] = (time.perf_counter() - phase_start) * 1000
+        retrievers[key] = CustomMultimodalRetriever(aurora_cluster=aurora, how=how, k=k, hybrid=hybrid, hot_sources=hot_sources)
+    return retrievers[key]
+
+
+def retrieve(event, settings=None, search_vector=None):
     # Extract information from the event
-    video_id = event.get("video_id")
-    content_type = event.get("content_type")
     query = event.get("query", "hola")
     how = event.get("how", "cosine")
     k = event.get("k", 5)
-    
+    hybrid = event.get("hybrid", False)
+    filter = event_filter(event)
+
+    retriever = get_retriever(how=how, k=k, hybrid=hybrid)
+    docs  = retriever.invoke(
+        input=query, filter=filter,
+        columns=event.get("columns"),
+        include_embedding=event.get("include_embedding", False),
+        offset=decode_cursor(event.get("cursor")),
+        search_settings=settings if settings else search_settings(event, filter),
+        diversity=event_diversity(event),
+        search_vector=search_vector,
+    )
+    return docs
+
+
+def event_filter(event):
+    video_id = event.get("video_id")
+    content_type = event.get("content_type")
+
     filter = []
     if video_id: filter.append(dict(key="source", value=video_id))
-    if content_type: filter.append(dict(key="content_type", value=event.get("content_type")))
+    if content_type: filter.append(dict(key="content_type", value=content_type))
+    return filter
 
-    retriever = CustomMultimodalRetriever(aurora_cluster=aurora, how=how, k=k)
-    docs  = retriever.invoke(input=query, filter=filter)
-    return docs
 
+def event_diversity(event):
+    if not event.get("diversity"):
+        return None
+    # numpy is only imported by diversified requests
+    from diversity import resolve_diversity
+    return resolve_diversity(event.get("diversity"), event.get("k", 5), max_vector_rows=aurora.max_vector_rows)
 
-def retrieve_generate(event):
-    model_id = event.get("model_id", "us.amazon.nova-pro-v1:0")
-    query = event.get("query", "hola")
-    docs  = retrieve(event)
-    parsed_docs = parse_docs_for_context(docs)
-    llm = ThinkingLLM(model_id=model_id)
 
-    user_message = f"""Answer the user's questions based on the below context. 
-If the context doesn't contain any relevant information to the question, don't make something up and just say "I don't know". 
-BTW, IF YOU MAKE SOMETHING UP BY YOUR OWN YOU WILL BE FIRED. 
-For each statement in your response provide a [document_number] where n is the document number that provides the response. Dont include the actual content, just the [document_number].
+def requested_rows(event):
+    """Largest k of the request (per query for batches, fetch_k when diversified) plus the rows skipped by the cursor"""
+    k = event.get("k", 5)
+    ks = [q.get("k", k) for q in event.get("queries", []) if isinstance(q, dict)]
+    diversity = event_diversity(event) if not event.get("queries") else None
+    if diversity: ks.append(diversity["fetch_k"])
+    rows = max([k, *ks]) + decode_cursor(event.get("cursor"))
+    # hybrid search ranks a wider vector top-N before fusion
+    return max(rows * 4, 20) if event.get("hybrid") else rows
+
+
+def event_content_type(event):
+    return str(event.get("content_type", "")).strip().lower()
+
+
+def search_settings(event, filter):
+    """HNSW settings for this request: the requested search_profile or the filtered/unfiltered default,
+    plus the exact/ANN plan chosen from the filter selectivity (plan="ann"/"exact" in the event forces it)"""
+    # a content_type filter alone is served by its partial HNSW index, no post-filtering involved
+    filtered = bool(filter) and not (is_content_type_only(filter) and event_content_type(event) in content_type_indexes)
+    settings = resolve_search_settings(event.get("search_profile"), filtered=filtered)
+    if event.get("plan") in ("ann", "exact"):
+        settings.update(plan=event.get("plan"), estimated_rows=None)
+    else:
+        settings.update(aurora.choose_plan(filter))
+    if settings["plan"] == "ann":
+        settings["vector_storage"] = vector_storage
+        # an HNSW scan returns at most ef_search rows, keep it above the candidates this request needs
+        needed = requested_rows(event) * (rerank_factor if vector_storage != "full" else 1)
+        settings["ef_search"] = max(settings["ef_search"], needed)
+    print(f"Search plan: {settings}")
+    return settings
+
+
+# single query options the batch SQL (one LATERAL kNN per query vector) does not implement
+UNSUPPORTED_BATCH_OPTIONS = ("hybrid", "diversity", "cursor")
+
+
+def unsupported_batch_options(event):
+    return [option for option in UNSUPPORTED_BATCH_OPTIONS if event.get(option)]
+
+
+def retrieve_batch(event, settings=None):
+    """Several queries sharing one filter set. Each item of `queries` is a string
+    or {"query": ..., "k": ...}; results are grouped per query in the same order."""
+    how = event.get("how", "cosine")
+    k = event.get("k", 5)
+    filter = event_filter(event)
+
+    items = [q if isinstance(q, dict) else dict(query=q) for q in event.get("queries", [])]
+    queries = [item.get("query", "") for item in items]
+    ks = [item.get("k", k) for item in items]
+
+    retriever = get_retriever(how=how, k=k)
+    grouped_docs = retriever.batch_get_relevant_documents(
+        queries, ks=ks, filter=filter,
+        columns=event.get("columns"),
+        include_embedding=event.get("include_embedding", False),
+        search_settings=settings if settings else search_settings(event, filter),
+    )
+    return [dict(query=query, docs=docs) for query, docs in zip(queries, grouped_docs)]
 
-<question>
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    return int(json.loads(base64.urlsafe_b64decode(cursor.encode())).get("offset", 0))
+
+
+def next_cursor(event, docs):
+    """Opaque cursor for the next page, None when this page was not full"""
+    k = event.get("k", 5)
+    if len(docs) < k:
+        return None
+    offset = decode_cursor(event.get("cursor")) + k
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
+
+def build_generate_content(event, docs):
+    query = event.get("query", "hola")
+    parsed_docs = parse_docs_for_context(
+        docs,
+        image_resolution=event.get("image_resolution", DEFAULT_IMAGE_RESOLUTION),
+        image_bytes_budget=event.get("image_bytes_budget"),
+    )
+
+    user_message = f"""<question>
 {query}
 </question>
 
-<docuemnts>
+<documents>
 """
-    llm_response = llm.answer([text_content_block(user_message), *parsed_docs, text_content_block("</documents>")])
+    return [text_content_block(user_message), *parsed_docs, text_content_block("</documents>")]
+
+
+def select_context(event, docs):
+    """Docs that fit the request's context budget, and the report of what was included"""
+    from context_budget import budget_context
+    # renditions are chosen before budgeting, so each keyframe is charged for what is sent
+    image_files = [doc.metadata.get("source") for doc in docs if doc.metadata.get("content_type") == "image"]
+    image_renditions = plan_renditions(
+        image_files, event.get("image_resolution", DEFAULT_IMAGE_RESOLUTION), event.get("image_bytes_budget")
+    ) if image_files else {}
+    return budget_context(
+        docs, event.get("query", "hola"),
+        token_budget=event.get("context_budget"),
+        similarity_floor=event.get("similarity_floor"),
+        max_chunk_chars=event.get("max_chunk_chars"),
+        image_renditions=image_renditions,
+    )
+
+
+def get_llm(model_id):
+    return ThinkingLLM(model_id=model_id, system_prompt=GENERATE_INSTRUCTIONS)
+
+
+def answer_namespace(event, model_id):
+    """Everything besides the question that shapes the answer"""
+    from answer_cache import cache_namespace
+    return cache_namespace(
+        model_id=model_id, filter=event_filter(event), how=event.get("how", "cosine"), k=event.get("k", 5),
+        hybrid=event.get("hybrid", False), diversity=event.get("diversity"), columns=event.get("columns"),
+        image_resolution=event.get("image_resolution", DEFAULT_IMAGE_RESOLUTION), image_bytes_budget=event.get("image_bytes_budget"),
+        context_budget=event.get("context_budget"), similarity_floor=event.get("similarity_floor"),
+        max_chunk_chars=event.get("max_chunk_chars"),
+    )
+
+
+def retrieve_generate(event):
+    model_id = event.get("model_id", "us.amazon.nova-pro-v1:0")
+    query = event.get("query", "hola")
+
+    search_vector, namespace, watermark = None, None, None
+    if answer_cache is not None and event.get("use_cache", True) and not event.get("cursor"):
+        from embeddings import get_embeddings
+        search_vector = get_embeddings(query)
+        namespace = answer_namespace(event, model_id)
+        watermark = aurora.ingestion_watermark(event_filter(event))
+        cached = answer_cache.lookup(namespace, search_vector, watermark)
+        print(f"Answer cache: {'hit' if cached else 'miss'} {answer_cache.stats()}")
+        if cached:
+            from langchain_core.documents import Document
+            return {"docs": [Document(**doc) for doc in cached["docs"]], "response": cached["response"],
+                    "cache": dict(hit=True, similarity=round(cached["similarity"], 4), query=cached["query"]),
+                    "context": cached.get("context")}
+
+    docs, context = select_context(event, retrieve(event, search_vector=search_vector))
+    llm = get_llm(model_id)
+
+    llm_response = llm.answer(build_generate_content(event, docs))
+    response_text = llm_response[0].get("text")
+
+    if namespace:
+        answer_cache.put(namespace, search_vector, watermark, query, response_text,
+                         [json.loads(doc.model_dump_json()) for doc in docs], context=context)
+    return {"docs":docs, "response":response_text, "cache": dict(hit=False) if namespace else None, "usage": llm.usage,
+            "context": context}
+
+
+def retrieve_generate_stream(event):
+    """Yields newline-delimited JSON messages: the retrieved docs first,
+    then the answer as incremental chunks and a final message with timings."""
+    model_id = event.get("model_id", "us.amazon.nova-pro-v1:0")
+    docs, context = select_context(event, retrieve(event))
+    yield json.dumps({"type": "docs", "docs": [json.loads(doc.model_dump_json()) for doc in docs], "context": context}) + "\n"
+
+    llm = get_llm(model_id)
+    for text in llm.answer_stream(build_generate_content(event, docs)):
+        yield json.dumps({"type": "chunk", "text": text}) + "\n"
 
-    return {"docs":docs, "response":llm_response[0].get("text")}
+    yield json.dumps({"type": "done", "ttft_ms": llm.ttft_ms, "usage": llm.usage}) + "\n"
 
 
 def process_event(api_event):
@@ -67,7 +287,23 @@ def process_event(api_event):
     return body
 
 
+def report_cold_start():
+    global cold_start
+    if not cold_start:
+        return
+    cold_start = False
+    init_phases["InitTotalMs"] = sum(init_phases.values())
+    emit_metrics("VideoRetrieval", {k: round(v, 1) for k, v in init_phases.items()}, unit="Milliseconds")
+
+
 def lambda_handler(api_event, context):
+    try:
+        return handle_request(api_event)
+    finally:
+        report_cold_start()
+
+
+def handle_request(api_event):
 
     print("Received event:", json.dumps(api_event))
     
@@ -78,9 +314,23 @@ def lambda_handler(api_event, context):
     method = event.get("method", "retrieve")
 
     try:
-        if method == "retrieve":
-            docs = retrieve(event)
-            docs_json = json.dumps({"docs": [json.loads(doc.model_dump_json()) for doc in docs] })
+        if method == "retrieve" and event.get("queries"):
+            unsupported = unsupported_batch_options(event)
+            if unsupported:
+                return build_response(400, json.dumps({"message": f"{', '.join(unsupported)} not supported with queries, "
+                                                       "send one request per query"}))
+            settings = search_settings(event, event_filter(event))
+            results = retrieve_batch(event, settings)
+            results_json = json.dumps({"results": [
+                {"query": r["query"], "docs": [json.loads(doc.model_dump_json()) for doc in r["docs"]]} for r in results
+            ], "search_settings": settings})
+            return build_response(200, results_json)
+
+        elif method == "retrieve":
+            settings = search_settings(event, event_filter(event))
+            docs = retrieve(event, settings)
+            docs_json = json.dumps({"docs": [json.loads(doc.model_dump_json()) for doc in docs], "next_cursor": next_cursor(event, docs),
+                                    "search_settings": settings})
             
             # Return the response
             response = build_response(200, docs_json)
@@ -93,12 +343,21 @@ def lambda_handler(api_event, context):
             llm_response = response_and_docs.get("response")
             docs = response_and_docs.get("docs")
             docs_json = json.dumps({"docs": [json.loads(doc.model_dump_json()) for doc in docs] })
-            response_json = json.dumps({"response": llm_response, "docs": docs_json})
+            response_json = json.dumps({"response": llm_response, "docs": docs_json, "cache": response_and_docs.get("cache"),
+                                        "usage": response_and_docs.get("usage"), "context": response_and_docs.get("context")})
 
             # Return the response
             response = build_response(200, response_json)
             print (response)
             return response
+
+        elif method == "retrieve_generate_stream":
+            # API Gateway and the Python runtime buffer the whole answer, the stream is
+            # served by the retrieval_stream function URL (stream_server.py)
+            return build_response(400, json.dumps({"message": "retrieve_generate_stream is served by the streaming "
+                                                   "function URL (SSM /videopgvector/retrieval_stream_url), "
+                                                   "use retrieve_generate on this API"}))
+
         else:
             return build_response(400, json.dumps({"message": "Invalid method"}))
 
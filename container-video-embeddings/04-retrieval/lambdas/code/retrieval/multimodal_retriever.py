@@ -1,10 +1,11 @@
+import asyncio
 import json
-from typing import List, Dict
-from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from typing import Any, List, Dict
+from langchain_core.callbacks import CallbackManagerForRetrieverRun, AsyncCallbackManagerForRetrieverRun
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
 
-from embeddings import get_embeddings
+from embeddings import get_embeddings, get_embeddings_batch, aget_embeddings
 from aurora_service import AuroraPostgres
 
 
@@ -19,20 +20,96 @@ class CustomMultimodalRetriever(BaseRetriever):
     """Number of top results to return"""
     how: str
     """How to calculate the similarity between the query and the documents."""
+    hybrid: bool = False
+    """Fuse full-text and vector rankings (text queries only)."""
+    hot_sources: Any = None
+    """HotSources mirror answering queries filtered on a frequently queried video, None to always query Aurora."""
 
     def _get_relevant_documents(
         self,
         query: str,
-        *, run_manager: CallbackManagerForRetrieverRun,  filter: Dict = None
+        *, run_manager: CallbackManagerForRetrieverRun,  filter: Dict = None,
+        columns: List[str] = None, include_embedding: bool = False, offset: int = 0,
+        search_settings: Dict = None, diversity: Dict = None, search_vector: List[float] = None
     ) -> List[Document]:
-        """Sync implementations for retriever."""
-        search_vector = get_embeddings(query)
-        result = self.aurora_cluster.similarity_search(
-            search_vector, how=self.how, k=self.k, filter=filter
+        """Sync implementations for retriever.
+        diversity: settings from resolve_diversity, fetches fetch_k candidates with their vectors
+        and keeps k of them with MMR and same-video time window de-duplication.
+        search_vector: the query embedding when the caller already computed it."""
+        if search_vector is None:
+            search_vector = get_embeddings(query)
+        search_kwargs = self.search_kwargs(query, filter, columns, include_embedding, offset, search_settings, diversity)
+        result = self.hot_sources.search(search_vector, **search_kwargs) if self.hot_sources else None
+        if result is None:
+            result = self.aurora_cluster.similarity_search(search_vector, **search_kwargs)
+        print (f"Query:{query} how={self.how}, k={search_kwargs['k']}, hybrid={self.hybrid}, filter = {filter}")
+        return self.select_documents(result, search_vector, include_embedding, diversity)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *, run_manager: AsyncCallbackManagerForRetrieverRun,  filter: Dict = None,
+        columns: List[str] = None, include_embedding: bool = False, offset: int = 0,
+        search_settings: Dict = None, diversity: Dict = None, search_vector: List[float] = None
+    ) -> List[Document]:
+        """Async implementation: the embedding and the SQL are awaited, so many retrievals
+        can share one event loop. Same options as _get_relevant_documents."""
+        if search_vector is None:
+            search_vector = await aget_embeddings(query)
+        search_kwargs = self.search_kwargs(query, filter, columns, include_embedding, offset, search_settings, diversity)
+        # loading or refreshing a hot video runs blocking queries, keep them off the loop
+        result = await asyncio.to_thread(self.hot_sources.search, search_vector, **search_kwargs) if self.hot_sources else None
+        if result is None:
+            result = await self.aurora_cluster.asimilarity_search(search_vector, **search_kwargs)
+        print (f"Async query:{query} how={self.how}, k={search_kwargs['k']}, hybrid={self.hybrid}, filter = {filter}")
+        return self.select_documents(result, search_vector, include_embedding, diversity)
+
+    def search_kwargs(self, query, filter, columns, include_embedding, offset, search_settings, diversity):
+        k = self.k
+        fetch_columns = columns
+        if diversity:
+            # diversity (and numpy) is only imported by diversified requests
+            from diversity import DIVERSITY_COLUMNS
+            k = diversity["fetch_k"]
+            if columns:
+                fetch_columns = list(columns) + [c for c in DIVERSITY_COLUMNS if c not in columns]
+        return dict(
+            how=self.how, k=k, filter=filter,
+            query_text=query if isinstance(query, str) else None, hybrid=self.hybrid,
+            columns=fetch_columns, include_embedding=include_embedding or bool(diversity and diversity["vectors"]), offset=offset,
+            search_settings=search_settings
         )
-        print (f"Query:{query} how={self.how}, k={self.k}, filter = {filter}")
+
+    def select_documents(self, result, search_vector, include_embedding, diversity):
         rows = json.loads(result.get("formattedRecords"))
+        if diversity:
+            from diversity import diversify
+            rows = diversify(rows, search_vector, self.k, **diversity)
+            if not include_embedding:
+                for row in rows:
+                    row.pop("embedding", None)
+        return self.rows_to_documents(rows)
+
+    def batch_get_relevant_documents(
+        self, queries: List[str], ks: List[int] = None, filter: Dict = None,
+        columns: List[str] = None, include_embedding: bool = False, search_settings: Dict = None
+    ) -> List[List[Document]]:
+        """Top k documents for each query: concurrent embeddings and a single SQL statement."""
+        ks = ks if ks else [self.k] * len(queries)
+        search_vectors = get_embeddings_batch(queries)
+        result = self.aurora_cluster.batch_similarity_search(
+            search_vectors, ks, how=self.how, filter=filter,
+            columns=columns, include_embedding=include_embedding, search_settings=search_settings
+        )
+        print (f"Queries:{len(queries)} how={self.how}, ks={ks}, filter = {filter}")
+        rows = json.loads(result.get("formattedRecords"))
+
+        grouped = [[] for _ in queries]
+        for row in rows:
+            grouped[row.get("query_index")].append(row)
+        return [self.rows_to_documents(query_rows) for query_rows in grouped]
 
+    def rows_to_documents(self, rows) -> List[Document]:
         matching_documents = []
 
         for row in rows:
@@ -43,10 +120,12 @@ class CustomMultimodalRetriever(BaseRetriever):
 
             if self.how == "cosine": metadata.update(similarity=row.get("similarity"))
             elif self.how == "l2":metadata.update(distance=row.get("distance"))
+            if row.get("rrf_score") is not None: metadata.update(similarity=row.get("similarity"), rrf_score=row.get("rrf_score"))
+            if row.get("embedding"): metadata.update(embedding=json.loads(row.get("embedding")))
 
             if row.get("content_type") == "text":
                 matching_documents.append(
-                    Document(page_content=row.get("chunks"), **document_kwargs)
+                    Document(page_content=row.get("chunks") or "", **document_kwargs)
                 )
             if row.get("content_type") == "image":
                 matching_documents.append(
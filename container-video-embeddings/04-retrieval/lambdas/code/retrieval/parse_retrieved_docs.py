@@ -1,24 +1,143 @@
-from utils import read_image_from_s3
+import os
+from concurrent.futures import ThreadPoolExecutor
+from utils import read_image_from_s3, image_size_from_s3
+from image_cache import ImageCache
 
-def image_content_block(image_file):
-    print (image_file)
-    image_bytes = read_image_from_s3(image_file)
+# Frame bytes are kept between warm invocations, bounded by IMAGE_CACHE_MAX_BYTES
+image_cache_max_bytes = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+image_fetch_workers = int(os.environ.get("IMAGE_FETCH_WORKERS", "10"))
+
+# Total image bytes sent to the LLM when image_resolution is "auto"
+context_image_bytes_budget = int(os.environ.get("CONTEXT_IMAGE_BYTES_BUDGET", str(1024 * 1024)))
+
+# "thumbnail" (default) sends the compact renditions, "full" the original keyframes and "auto"
+# the original keyframes in rank order while they fit the byte budget, thumbnails afterwards
+IMAGE_RESOLUTIONS = ["thumbnail", "full", "auto"]
+DEFAULT_IMAGE_RESOLUTION = "thumbnail"
+
+image_cache = ImageCache(image_cache_max_bytes)
+
+
+def thumbnail_location(image_file):
+    """Compact rendition written next to each keyframe by the video workflow"""
+    return image_file.replace("/selected_frames/", "/selected_frames_thumbnail/")
+
+
+def get_image_bytes(image_file):
+    image_bytes = image_cache.get(image_file)
+    if image_bytes is None:
+        image_bytes = read_image_from_s3(image_file)
+        image_cache.put(image_file, image_bytes)
+    return image_bytes
+
+
+def get_optional_image_bytes(image_file):
+    # frames ingested before renditions existed have no thumbnail
+    try:
+        return get_image_bytes(image_file)
+    except Exception as e:
+        print(f"Image not available {image_file}: {str(e)}")
+        return None
+
+
+def get_image_size(image_file):
+    # size without downloading: from the cache, or a HEAD request. None when the rendition does not exist
+    size = image_cache.size(image_file)
+    if size is not None:
+        return size
+    try:
+        return image_size_from_s3(image_file)
+    except Exception as e:
+        print(f"Image not available {image_file}: {str(e)}")
+        return None
+
+
+def fetch_images(image_files, fetch=get_image_bytes):
+    """Download the distinct images concurrently, returns {s3_uri: bytes}"""
+    unique_files = list(dict.fromkeys(image_files))
+    if not unique_files:
+        return {}
+    workers = max(1, min(image_fetch_workers, len(unique_files)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        images = dict(zip(unique_files, executor.map(fetch, unique_files)))
+    print(f"Image cache: {image_cache.stats()}")
+    return images
+
+
+def plan_renditions(image_files, image_resolution=DEFAULT_IMAGE_RESOLUTION, image_bytes_budget=None):
+    """Returns {s3_uri: rendition_uri} for each keyframe, without downloading any.
+    "auto" sizes both renditions of each frame (HEAD requests, none for cached frames)
+    and keeps full resolution in rank order while it fits the byte budget.
+    """
+    if image_resolution not in IMAGE_RESOLUTIONS:
+        raise ValueError(f"image_resolution must be one of {IMAGE_RESOLUTIONS}")
+    image_files = list(dict.fromkeys(image_files))
+    if image_resolution == "full":
+        return {f: f for f in image_files}
+    thumbnails = {f: thumbnail_location(f) for f in image_files}
+    if image_resolution == "thumbnail":
+        return thumbnails
+
+    budget = context_image_bytes_budget if image_bytes_budget is None else int(image_bytes_budget)
+    sizes = fetch_images(image_files + list(thumbnails.values()), fetch=get_image_size)
+    planned = {}
+    used_bytes = 0
+    for image_file in image_files:
+        full_size, thumbnail_size = sizes.get(image_file), sizes.get(thumbnails[image_file])
+        if full_size is not None and used_bytes + full_size <= budget:
+            planned[image_file] = image_file
+        elif thumbnail_size is not None:
+            planned[image_file] = thumbnails[image_file]
+        else:
+            planned[image_file] = image_file
+        used_bytes += sizes.get(planned[image_file]) or 0
+    return planned
+
+
+def select_renditions(image_files, image_resolution=DEFAULT_IMAGE_RESOLUTION, image_bytes_budget=None, renditions=None):
+    """Returns {s3_uri: (rendition_uri, bytes)} for each keyframe, only the planned rendition
+    (renditions, or plan_renditions when not given) is downloaded"""
+    planned = renditions if renditions is not None else plan_renditions(image_files, image_resolution, image_bytes_budget)
+    images = fetch_images(list(planned.values()), fetch=get_optional_image_bytes)
+
+    selected = {}
+    for image_file, rendition in planned.items():
+        image_bytes = images.get(rendition)
+        if image_bytes is None:
+            # no thumbnail (frames ingested before renditions existed): the original frame
+            rendition, image_bytes = image_file, get_image_bytes(image_file)
+        selected[image_file] = (rendition, image_bytes)
+    used_bytes = sum(len(image_bytes) for _, image_bytes in selected.values())
+    print(f"Context images: {len(selected)} files, {used_bytes} bytes ({image_resolution})")
+    return selected
+
+
+def image_content_block(image_file, image_bytes=None):
+    if image_bytes is None:
+        image_bytes = get_image_bytes(image_file)
     extension = image_file.split('.')[-1]
     print (f"Including Image :{image_file}")
     if extension == 'jpg':
         extension = 'jpeg'
-    
+
     block = { "image": { "format": extension, "source": { "bytes": image_bytes}}}
     return block
 
 def text_content_block(text):
     return { "text": text }
 
-def parse_docs_for_context(docs):
+def parse_docs_for_context(docs, image_resolution=DEFAULT_IMAGE_RESOLUTION, image_bytes_budget=None):
+    image_files = [doc.metadata.get("source") for doc in docs if doc.metadata.get('content_type') == "image"]
+    # renditions planned (and budgeted) by budget_context, planned here for docs that were not budgeted
+    renditions = {doc.metadata.get("source"): doc.metadata.get("rendition") for doc in docs if doc.metadata.get('content_type') == "image"}
+    renditions = renditions if all(renditions.values()) else None
+    images = select_renditions(image_files, image_resolution, image_bytes_budget, renditions) if image_files else {}
+
     blocks = []
     for doc in docs:
         if doc.metadata.get('content_type') == "image":
-            blocks.append(image_content_block(doc.metadata.get("source")))
+            rendition, image_bytes = images.get(doc.metadata.get("source"))
+            blocks.append(image_content_block(rendition, image_bytes))
         else:
             blocks.append(text_content_block(doc.page_content))
-    return blocks
\ No newline at end of file
+    return blocks
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+import decimal
+import datetime
+import weakref
+
+import boto3
+import numpy as np
+import psycopg
+from psycopg.rows import dict_row
+from psycopg_pool import ConnectionPool, AsyncConnectionPool
+from pgvector.psycopg import register_vector, register_vector_async
+
+from aurora_service import AuroraPostgres, sort_rows
+
+# Direct connection settings, DB_HOST is the cluster writer/reader endpoint or an RDS Proxy endpoint
+db_host = os.environ.get("DB_HOST")
+db_port = int(os.environ.get("DB_PORT", "5432"))
+db_sslmode = os.environ.get("DB_SSLMODE", "require")
+db_pool_min_size = int(os.environ.get("DB_POOL_MIN_SIZE", "1"))
+db_pool_max_size = int(os.environ.get("DB_POOL_MAX_SIZE", "4"))
+# executions of the same SQL text before it is prepared server side, empty disables
+# prepared statements (RDS Proxy pins the connection of a session that prepares)
+db_prepare_threshold = os.environ.get("DB_PREPARE_THRESHOLD", "2")
+
+secretsmanager = boto3.client("secretsmanager")
+
+# placeholder written by bind_vector/bind_text, turned into %(name)s once the SQL is built
+PARAM_MARK = re.compile(r"\x00(\w+)\x00")
+
+# transaction scoped, the pooled connection keeps the server defaults
+SET_SEARCH_SETTINGS = "SELECT set_config('hnsw.ef_search', %s, true), set_config('hnsw.iterative_scan', %s, true)"
+
+
+class SearchSettingsUnavailable(Exception):
+    """The server rejected the HNSW settings, e.g. hnsw.iterative_scan before pgvector 0.8"""
+
+
+def get_credentials(secret_arn):
+    secret = json.loads(secretsmanager.get_secret_value(SecretId=secret_arn)["SecretString"])
+    return secret.get("username"), secret.get("password")
+
+
+def to_placeholders(sql, params):
+    if not params:
+        return sql
+    # literal % in the SQL must not be read as a placeholder
+    return PARAM_MARK.sub(r"%(\1)s", sql.replace("%", "%%"))
+
+
+def search_settings_params(search_settings):
+    return (str(int(search_settings["ef_search"])), search_settings["iterative_scan"])
+
+
+def to_data_api_value(value):
+    """Values as the Data API JSON records carry them: json and vector columns as text"""
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, np.ndarray):
+        return json.dumps(value.tolist())
+    if hasattr(value, "to_list"):
+        # pgvector Vector / HalfVector from the binary loaders
+        return json.dumps(value.to_list())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+class PooledPostgres(AuroraPostgres):
+    """AuroraPostgres over a psycopg connection pool instead of the RDS Data API.
+    Query vectors are sent as binary pgvector parameters, so the SQL text of a search
+    only depends on its shape (k, filter, columns) and is prepared after a few runs."""
+    # no response size limit
+    max_vector_rows = None
+
+    def __init__(self, database_name, credentials_arn, host=db_host, port=db_port):
+        if not host:
+            raise ValueError("DB_HOST is required for the psycopg backend")
+        self.database_name = database_name
+        self.credentials_arn = credentials_arn
+        self.row_estimates = {}
+        user, password = get_credentials(credentials_arn)
+        self.conninfo = f"host={host} port={port} dbname={database_name} sslmode={db_sslmode}"
+        self.connection_kwargs = dict(user=user, password=password, autocommit=True,
+                                      prepare_threshold=int(db_prepare_threshold) if db_prepare_threshold else None)
+        self.pool = ConnectionPool(
+            conninfo=self.conninfo,
+            kwargs=self.connection_kwargs,
+            min_size=db_pool_min_size,
+            max_size=db_pool_max_size,
+            configure=register_vector,
+            open=True,
+        )
+        # async pools are opened on first use, one per event loop
+        self.async_pools = weakref.WeakKeyDictionary()
+
+    def bind_vector(self, name, vector, params):
+        params[name] = np.asarray(vector, dtype=np.float32)
+        return f"\x00{name}\x00::vector"
+
+    def bind_text(self, name, text, params):
+        params[name] = text
+        return f"\x00{name}\x00"
+
+    async def get_async_pool(self):
+        loop = asyncio.get_running_loop()
+        state = self.async_pools.setdefault(loop, {"lock": asyncio.Lock(), "pool": None})
+        async with state["lock"]:
+            if state["pool"] is None:
+                pool = AsyncConnectionPool(
+                    conninfo=self.conninfo,
+                    kwargs=self.connection_kwargs,
+                    min_size=db_pool_min_size,
+                    max_size=db_pool_max_size,
+                    configure=register_vector_async,
+                    open=False,
+                )
+                await pool.open()
+                state["pool"] = pool
+        return state["pool"]
+
+    async def aclose(self):
+        """Close the async pool and the aiobotocore clients of the running loop, call it before the loop shuts down"""
+        state = self.async_pools.pop(asyncio.get_running_loop(), None)
+        if state and state["pool"] is not None:
+            await state["pool"].close()
+        # the Bedrock embedding client is opened on the same loop
+        await super().aclose()
+
+    def run(self, sql, params=None, search_settings=None):
+        sql = to_placeholders(sql, params)
+        with self.pool.connection() as connection:
+            with connection.transaction():
+                with connection.cursor(row_factory=dict_row, binary=True) as cursor:
+                    if search_settings:
+                        try:
+                            cursor.execute(SET_SEARCH_SETTINGS, search_settings_params(search_settings))
+                        except psycopg.Error as e:
+                            raise SearchSettingsUnavailable(str(e)) from e
+                    cursor.execute(sql, params or None)
+                    rows = cursor.fetchall() if cursor.description else []
+        return [{k: to_data_api_value(v) for k, v in row.items()} for row in rows]
+
+    async def arun(self, sql, params=None, search_settings=None):
+        sql = to_placeholders(sql, params)
+        pool = await self.get_async_pool()
+        async with pool.connection() as connection:
+            async with connection.transaction():
+                async with connection.cursor(row_factory=dict_row, binary=True) as cursor:
+                    if search_settings:
+                        try:
+                            await cursor.execute(SET_SEARCH_SETTINGS, search_settings_params(search_settings))
+                        except psycopg.Error as e:
+                            raise SearchSettingsUnavailable(str(e)) from e
+                    await cursor.execute(sql, params or None)
+                    rows = await cursor.fetchall() if cursor.description else []
+        return [{k: to_data_api_value(v) for k, v in row.items()} for row in rows]
+
+    def execute_statement(self, sql, params=None):
+        return {"formattedRecords": json.dumps(self.run(sql, params))}
+
+    async def aexecute_statement(self, sql, params=None):
+        return {"formattedRecords": json.dumps(await self.arun(sql, params))}
+
+    def execute_tuned(self, sql, search_settings=None, params=None):
+        if not search_settings or search_settings.get("plan") == "exact":
+            return self.execute_statement(sql, params)
+        start = time.perf_counter()
+        try:
+            rows = self.run(sql, params, search_settings)
+        except SearchSettingsUnavailable as e:
+            # same fallback as AuroraPostgres.execute_tuned when tuned_search fails
+            print(f"search settings not available, running with server defaults: {e}")
+            rows = self.run(sql, params)
+        print(f"psycopg query: {round((time.perf_counter() - start) * 1000)} ms, {len(rows)} rows")
+        return {"formattedRecords": json.dumps(sort_rows(rows))}
+
+    async def aexecute_tuned(self, sql, search_settings=None, params=None):
+        if not search_settings or search_settings.get("plan") == "exact":
+            return await self.aexecute_statement(sql, params)
+        try:
+            rows = await self.arun(sql, params, search_settings)
+        except SearchSettingsUnavailable as e:
+            print(f"search settings not available, running with server defaults: {e}")
+            rows = await self.arun(sql, params)
+        return {"formattedRecords": json.dumps(sort_rows(rows))}
@@ -0,0 +1,3 @@
+#!/bin/bash
+# Entry point of the retrieval_stream function, started by the Lambda Web Adapter (AWS_LAMBDA_EXEC_WRAPPER=/opt/bootstrap)
+exec python3 -u stream_server.py
@@ -0,0 +1,68 @@
+"""
+HTTP server of the retrieval_stream function. It runs behind the Lambda Web Adapter,
+with AWS_LWA_INVOKE_MODE=response_stream and a function URL in RESPONSE_STREAM invoke
+mode, so every NDJSON message of retrieve_generate_stream reaches the client as soon
+as it is written instead of with the whole answer.
+
+POST / with the body of a retrieve_generate request to POST /retrieve.
+"""
+import json
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# the same module (and warm clients, caches and cold start metrics) as the API Gateway function
+from lambda_function import retrieve_generate_stream, report_cold_start
+
+port = int(os.environ.get("PORT", "8080"))
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    # chunked transfer encoding needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # readiness check of the web adapter
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            event = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            body = json.dumps({"message": f"Error: invalid JSON body: {e}"}).encode()
+            self.send_response(400)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        print("Processed event body:", json.dumps(event))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson;charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for message in retrieve_generate_stream(event):
+                self.write_chunk(message)
+        except Exception as e:
+            # the 200 status is already sent, the error is the last message of the stream
+            print(f"Error processing results: {str(e)}")
+            self.write_chunk(json.dumps({"type": "error", "message": f"Error: {str(e)}"}) + "\n")
+        finally:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            report_cold_start()
+
+    def write_chunk(self, message):
+        data = message.encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+if __name__ == "__main__":
+    print(f"retrieval stream server listening on {port}")
+    HTTPServer(("127.0.0.1", port), StreamHandler).serve_forever()
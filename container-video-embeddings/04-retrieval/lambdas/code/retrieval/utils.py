@@ -1,6 +1,6 @@
 import json, decimal
 import boto3
-import os, re
+import os, re, time
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 from urllib.parse import unquote
@@ -77,6 +77,11 @@ def read_image_from_s3(s3_key):
     image_data = response['Body'].read()
     return image_data
 
+def image_size_from_s3(s3_key):
+    parts = s3_key.split('s3://')[-1].split('/', 1)
+    response = s3.head_object(Bucket=parts[0], Key=parts[1])
+    return response['ContentLength']
+
 def get_config_param(parameter_name):
     response = ssm.get_parameter(Name=parameter_name)
     parameter = response.get('Parameter')
@@ -218,6 +223,24 @@ def build_update_expression(to_update):
 
 
 
+def emit_metrics(namespace, metrics, unit="Milliseconds", dimensions=None):
+    """Print metrics in CloudWatch Embedded Metric Format, CloudWatch Logs turns them into metrics"""
+    dimensions = dimensions if dimensions else {"FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")}
+    payload = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": namespace,
+                "Dimensions": [list(dimensions.keys())],
+                "Metrics": [{"Name": name, "Unit": unit} for name in metrics],
+            }],
+        },
+        **dimensions,
+        **metrics,
+    }
+    print(json.dumps(payload))
+
+
 def success_response(object_result):
     object_result["message"] = "OK"
     object_result["code"] = "SUCCESS"
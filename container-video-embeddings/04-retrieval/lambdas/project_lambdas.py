@@ -1,5 +1,6 @@
 from aws_cdk import (
     Duration,
+    Stack,
     aws_iam as iam,
     aws_lambda,
     Size,
@@ -7,6 +8,7 @@ from aws_cdk import (
     aws_events_targets as targets,
     aws_lambda_event_sources as lambda_event_sources,
     aws_s3 as s3,
+    aws_ec2 as ec2,
 )
 
 from constructs import Construct
@@ -19,11 +21,16 @@ BASE_LAMBDA_CONFIG = dict(
     tracing=aws_lambda.Tracing.ACTIVE,
 )
 
-from layers import LangchainCore
+from layers import LangchainCore, Psycopg
+
+# Lambda Web Adapter (https://github.com/awslabs/aws-lambda-web-adapter), runs stream_server.py
+# and forwards its chunked response through a RESPONSE_STREAM function URL
+WEB_ADAPTER_LAYER = "arn:aws:lambda:{region}:753240598075:layer:LambdaAdapterLayerArm64:25"
 
 
 class Lambdas(Construct):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+    def __init__(self, scope: Construct, construct_id: str, vpc: ec2.IVpc = None, security_groups=None, **kwargs) -> None:
+        """vpc / security_groups: attach the functions to the cluster VPC for direct connections (DB_BACKEND=psycopg)"""
         super().__init__(scope, construct_id, **kwargs)
 
         # ======================================================================
@@ -31,23 +38,60 @@ class Lambdas(Construct):
         # ======================================================================
 
         lc_layer = LangchainCore(self, "LangchainCore")
+        layers = [lc_layer.layer]
+
+        # private subnets with egress: Bedrock, S3 and Secrets Manager are still reached through the NAT
+        vpc_config = {}
+        if vpc:
+            layers.append(Psycopg(self, "Psycopg").layer)
+            vpc_config = dict(vpc=vpc, security_groups=security_groups,
+                              vpc_subnets=ec2.SubnetSelection(subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS))
 
         self.retrieval = aws_lambda.Function(
             self,
             "retrieval",
             handler="lambda_function.lambda_handler",
-            layers=[lc_layer.layer],
+            layers=layers,
             code=aws_lambda.Code.from_asset("./lambdas/code/retrieval"),
+            **vpc_config,
             **BASE_LAMBDA_CONFIG
         )
 
-        self.retrieval.add_to_role_policy(
-            iam.PolicyStatement(actions=["bedrock:*"], resources=["*"])
+        # ======================================================================
+        # Lambda  retriveal stream (retrieve_generate_stream over a function URL)
+        # ======================================================================
+
+        web_adapter = aws_lambda.LayerVersion.from_layer_version_arn(
+            self, "WebAdapter", WEB_ADAPTER_LAYER.format(region=Stack.of(self).region)
         )
-        
-        self.retrieval.add_to_role_policy(
-            iam.PolicyStatement(actions=["s3:*"], resources=["*"])
+
+        self.retrieval_stream = aws_lambda.Function(
+            self,
+            "retrieval_stream",
+            handler="run.sh",
+            layers=[*layers, web_adapter],
+            code=aws_lambda.Code.from_asset("./lambdas/code/retrieval"),
+            environment={
+                "AWS_LAMBDA_EXEC_WRAPPER": "/opt/bootstrap",
+                "AWS_LWA_INVOKE_MODE": "response_stream",
+                "PORT": "8080",
+            },
+            **vpc_config,
+            **BASE_LAMBDA_CONFIG
         )
-        self.retrieval.add_to_role_policy(
-            iam.PolicyStatement(actions=["dynamodb:*"], resources=["*"])
+
+        self.retrieval_stream_url = self.retrieval_stream.add_function_url(
+            auth_type=aws_lambda.FunctionUrlAuthType.AWS_IAM,
+            invoke_mode=aws_lambda.InvokeMode.RESPONSE_STREAM,
         )
+
+        for fn in [self.retrieval, self.retrieval_stream]:
+            fn.add_to_role_policy(
+                iam.PolicyStatement(actions=["bedrock:*"], resources=["*"])
+            )
+            fn.add_to_role_policy(
+                iam.PolicyStatement(actions=["s3:*"], resources=["*"])
+            )
+            fn.add_to_role_policy(
+                iam.PolicyStatement(actions=["dynamodb:*"], resources=["*"])
+            )
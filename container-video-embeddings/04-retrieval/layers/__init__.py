@@ -1 +1 @@
-from layers.project_layers import LangchainCore
\ No newline at end of file
+from layers.project_layers import LangchainCore, Psycopg
\ No newline at end of file
@@ -26,3 +26,19 @@ class LangchainCore(Construct):
             description="Langchain Core",
         )
         self.layer = langchain_core
+
+
+class Psycopg(Construct):
+    """psycopg[binary], psycopg-pool, pgvector and numpy for DB_BACKEND=psycopg, built for ARM64 (see README)"""
+
+    def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
+        super().__init__(scope, construct_id, **kwargs)
+
+        self.layer = _lambda.LayerVersion(
+            self,
+            "Psycopg",
+            code=_lambda.Code.from_asset("./layers/psycopg.zip"),
+            compatible_runtimes=[_lambda.Runtime.PYTHON_3_13],
+            compatible_architectures=[_lambda.Architecture.ARM_64],
+            description="psycopg, psycopg-pool, pgvector and numpy",
+        )
@@ -3,9 +3,11 @@ import boto3
 from aws_cdk import (
     # Duration,
     Stack,
+    CfnOutput,
     # aws_sqs as sqs,
     aws_ssm as ssm,
     aws_iam as iam,
+    aws_ec2 as ec2,
 )
 from constructs import Construct
 from apis import WebhookApi
@@ -22,23 +24,55 @@ class RetrievalStack(Stack):
         cluster_arn         = ssm_client.get_parameter(Name="/videopgvector/cluster_arn")["Parameter"]["Value"]
         secret_arn          = ssm_client.get_parameter(Name="/videopgvector/secret_arn")["Parameter"]["Value"]
         video_table_name          = ssm_client.get_parameter(Name="/videopgvector/video_table_name")["Parameter"]["Value"]
-
-        Fn                  = Lambdas(self, "Fn")
-
-        Fn.retrieval.add_environment(key="CLUSTER_ARN", value=cluster_arn)
-        Fn.retrieval.add_environment(key="SECRET_ARN", value=secret_arn)
-        Fn.retrieval.add_environment(key="DATABASE_NAME", value=video_table_name)
-
-        Fn.retrieval.add_to_role_policy(
-            iam.PolicyStatement(
-                actions=["rds-data:ExecuteStatement"], resources=[cluster_arn]
+        # index the 02 stack has built and validated, "full" for stacks deployed before it was published
+        try:
+            vector_storage  = ssm_client.get_parameter(Name="/videopgvector/vector_storage")["Parameter"]["Value"]
+        except ssm_client.exceptions.ParameterNotFound:
+            vector_storage  = "full"
+        try:
+            content_type_indexes = ssm_client.get_parameter(Name="/videopgvector/content_type_indexes")["Parameter"]["Value"]
+        except ssm_client.exceptions.ParameterNotFound:
+            content_type_indexes = "text,image"
+        if content_type_indexes == "none":
+            content_type_indexes = ""
+
+        # cdk deploy -c db_backend=psycopg: pooled direct connections from the cluster VPC instead of the Data API
+        db_backend          = self.node.try_get_context("db_backend") or "data_api"
+        if db_backend not in ("data_api", "psycopg"):
+            raise ValueError("db_backend must be data_api or psycopg")
+
+        if db_backend == "psycopg":
+            vpc_id          = ssm_client.get_parameter(Name="/videopgvector/ecs-vpc-id")["Parameter"]["Value"]
+            db_host         = ssm_client.get_parameter(Name="/videopgvector/cluster_endpoint")["Parameter"]["Value"]
+            db_client_sg    = ssm_client.get_parameter(Name="/videopgvector/db_client_security_group_id")["Parameter"]["Value"]
+            vpc             = ec2.Vpc.from_lookup(self, "VPC", vpc_id=vpc_id)
+            # the cluster allows port 5432 from this group (AuroraDatabaseCluster in 02-aurora-pg-vector)
+            security_groups = [ec2.SecurityGroup.from_security_group_id(self, "DbClientSG", db_client_sg)]
+            Fn              = Lambdas(self, "Fn", vpc=vpc, security_groups=security_groups)
+        else:
+            Fn              = Lambdas(self, "Fn")
+
+        for fn in [Fn.retrieval, Fn.retrieval_stream]:
+            fn.add_environment(key="CLUSTER_ARN", value=cluster_arn)
+            fn.add_environment(key="SECRET_ARN", value=secret_arn)
+            fn.add_environment(key="DATABASE_NAME", value=video_table_name)
+            fn.add_environment(key="VECTOR_STORAGE", value=vector_storage)
+            fn.add_environment(key="CONTENT_TYPE_INDEXES", value=content_type_indexes)
+            fn.add_environment(key="DB_BACKEND", value=db_backend)
+            if db_backend == "psycopg":
+                fn.add_environment(key="DB_HOST", value=db_host)
+
+            fn.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["rds-data:ExecuteStatement"], resources=[cluster_arn]
+                )
             )
-        )
-        Fn.retrieval.add_to_role_policy(
-            iam.PolicyStatement(
-                actions=["secretsmanager:GetSecretValue"], resources=[secret_arn]
+            # bedrock_user credentials, read by both backends
+            fn.add_to_role_policy(
+                iam.PolicyStatement(
+                    actions=["secretsmanager:GetSecretValue"], resources=[secret_arn]
+                )
             )
-        )
 
         
 
@@ -55,6 +89,15 @@ class RetrievalStack(Stack):
             string_value=Api.retrieve_api_url,
         )
 
+        ssm.StringParameter(
+            self,
+            "retrieval-stream-url",
+            parameter_name="/videopgvector/retrieval_stream_url",
+            string_value=Fn.retrieval_stream_url.url,
+        )
+
+        CfnOutput(self, "RetrievalStreamUrl", value=Fn.retrieval_stream_url.url)
+
         ssm.StringParameter( self, "lambda_retreval", 
                             parameter_name=f"/videopgvector/lambda_retreval_name", 
                             string_value=Fn.retrieval.function_name
@@ -0,0 +1,80 @@
+"""
+Latency of the retrieval queries through the RDS Data API and through the pooled psycopg backend.
+
+Runs the same similarity searches (stored embeddings as queries) with both AuroraPostgres
+implementations of the retrieval Lambda and prints p50/p90 and the mean formattedRecords size
+per backend, k and include_embedding (the default projection leaves the embedding out).
+The psycopg backend needs network access to the cluster or RDS Proxy endpoint (run it from
+the VPC, e.g. Cloud9 or a bastion) and psycopg[binary], psycopg-pool and pgvector installed.
+
+python benchmark_db_backend.py --host <cluster or proxy endpoint> --queries 50
+python benchmark_db_backend.py --backends psycopg --host localhost --sslmode disable   # local Postgres + pgvector
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import boto3
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas", "code", "retrieval"))
+
+ssm = boto3.client("ssm")
+
+
+def get_parameter(name):
+    return ssm.get_parameter(Name=name)["Parameter"]["Value"]
+
+
+def create_backend(name, args):
+    if name == "data_api":
+        from aurora_service import AuroraPostgres
+        return AuroraPostgres(get_parameter("/videopgvector/cluster_arn"), args.database, get_parameter("/videopgvector/secret_arn"))
+    os.environ["DB_SSLMODE"] = args.sslmode
+    import pg_backend
+    if args.user:
+        pg_backend.get_credentials = lambda secret_arn: (args.user, args.password)
+    secret_arn = None if args.user else get_parameter("/videopgvector/secret_arn")
+    return pg_backend.PooledPostgres(args.database, secret_arn, host=args.host, port=args.port)
+
+
+def run(args):
+    backends = {name: create_backend(name, args) for name in args.backends}
+    first = next(iter(backends.values()))
+    rows = json.loads(first.execute_statement(
+        f"SELECT embedding FROM bedrock_integration.knowledge_bases ORDER BY random() LIMIT {args.queries}"
+    )["formattedRecords"])
+    vectors = [json.loads(row["embedding"]) for row in rows]
+    print(f"{len(vectors)} query vectors")
+
+    print(f"{'backend':>10} {'k':>4} {'embedding':>9} {'p50 ms':>8} {'p90 ms':>8} {'bytes':>8}")
+    for name, backend in backends.items():
+        backend.execute_statement("select 1")  # connection/pool warm up
+        for k in [5, 10, 50]:
+            for include_embedding in (False, True):
+                latencies, sizes = [], []
+                for vector in vectors:
+                    start = time.perf_counter()
+                    response = backend.similarity_search(vector, k=k, include_embedding=include_embedding)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    sizes.append(len(response["formattedRecords"]))
+                latencies.sort()
+                p90 = latencies[int(0.9 * (len(latencies) - 1))]
+                print(f"{name:>10} {k:>4} {str(include_embedding):>9} {statistics.median(latencies):>8.1f} {p90:>8.1f} "
+                      f"{round(statistics.mean(sizes)):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["data_api", "psycopg"], choices=["data_api", "psycopg"])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--database", default="kbdata")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--sslmode", default="require")
+    parser.add_argument("--user", help="local database user instead of the bedrock_user secret")
+    parser.add_argument("--password", default="")
+    run(parser.parse_args())
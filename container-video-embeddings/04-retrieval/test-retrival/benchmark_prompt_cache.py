@@ -0,0 +1,81 @@
+"""
+Effect of Converse prompt caching on retrieve_generate: cache reads and time to first token.
+
+Streams the same questions with the retrieve_generate system prompt (prompts.GENERATE_INSTRUCTIONS)
+with and without the cache point, and prints per model the p50 TTFT, the input tokens and the
+cacheReadInputTokens / cacheWriteInputTokens reported by Bedrock. The first cached request
+writes the prefix, the following ones (within the 5 minute cache TTL) read it.
+
+python benchmark_prompt_cache.py --models us.amazon.nova-pro-v1:0 us.anthropic.claude-3-7-sonnet-20250219-v1:0
+python benchmark_prompt_cache.py --documents retrieve_response.json   # "docs" of a POST /retrieve response
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lambdas", "code", "retrieval"))
+
+from bedrock_llm import ThinkingLLM
+from prompts import GENERATE_INSTRUCTIONS
+
+QUESTIONS = [
+    "What is the video about?",
+    "Who is speaking?",
+    "What products are shown?",
+    "Is there any discount mentioned?",
+    "What happens at the end?",
+]
+
+SAMPLE_DOCUMENTS = [
+    "...welcome everyone, today we are launching the new model, it gets about twenty percent more range...",
+    "...and for the launch week the price drops to 50% for the first thousand customers...",
+]
+
+
+def load_documents(path):
+    if not path:
+        return SAMPLE_DOCUMENTS
+    with open(path) as f:
+        docs = json.load(f)
+    docs = docs.get("docs", docs) if isinstance(docs, dict) else docs
+    return [doc["page_content"] for doc in docs if doc.get("page_content")]
+
+
+def ask(model_id, prompt_caching, question, documents):
+    llm = ThinkingLLM(model_id=model_id, system_prompt=GENERATE_INSTRUCTIONS, prompt_caching=prompt_caching)
+    content = [{"text": f"<question>\n{question}\n</question>\n\n<documents>\n"},
+               *[{"text": text} for text in documents], {"text": "</documents>"}]
+    for _ in llm.answer_stream(content):
+        pass
+    return llm.ttft_ms, llm.usage
+
+
+def run(args):
+    documents = load_documents(args.documents)
+    print(f"system prompt: {len(GENERATE_INSTRUCTIONS)} characters, {len(documents)} documents")
+    print(f"{'model':>48} {'cache':>6} {'p50 ttft':>9} {'input':>6} {'read':>6} {'write':>6}")
+    for model_id in args.models:
+        for prompt_caching in (False, True):
+            ttfts, usages = [], []
+            for _ in range(args.rounds):
+                for question in QUESTIONS:
+                    ttft, usage = ask(model_id, prompt_caching, question, documents)
+                    ttfts.append(ttft)
+                    usages.append(usage)
+            # the first cached request only writes the prefix
+            measured = usages[1:] if prompt_caching else usages
+            print(f"{model_id:>48} {str(prompt_caching):>6} {statistics.median(ttfts[1:] if prompt_caching else ttfts):>9} "
+                  f"{round(statistics.mean(u.get('inputTokens', 0) for u in measured)):>6} "
+                  f"{round(statistics.mean(u.get('cacheReadInputTokens', 0) for u in measured)):>6} "
+                  f"{sum(u.get('cacheWriteInputTokens', 0) for u in usages):>6}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", default=["us.amazon.nova-pro-v1:0"])
+    parser.add_argument("--documents", help="JSON file with the docs of a retrieve response")
+    parser.add_argument("--rounds", type=int, default=2)
+    run(parser.parse_args())
@@ -0,0 +1,96 @@
+"""
+Recall and latency of the quantized two-stage search against exact search.
+
+Samples stored embeddings as queries and, for k = 5, 10 and 50, compares:
+- exact:   full precision scan and sort (ground truth)
+- full:    HNSW on vector(1024)
+- halfvec: HNSW on embedding::halfvec(1024), re-ranked with the full vectors
+- binary:  HNSW on binary_quantize(embedding), re-ranked with the full vectors
+
+Each mode needs its index (see vector_storage in 02-aurora-pg-vector), a mode without
+its index falls back to a sequential scan and only its recall is meaningful.
+
+python benchmark_vector_storage.py --queries 50
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import boto3
+
+ssm = boto3.client("ssm")
+rds_data = boto3.client("rds-data")
+
+TABLE = "bedrock_integration.knowledge_bases"
+DIMENSION = 1024
+
+
+def get_parameter(name):
+    return ssm.get_parameter(Name=name)["Parameter"]["Value"]
+
+
+def execute(sql, cluster_arn, secret_arn, database):
+    response = rds_data.execute_statement(
+        resourceArn=cluster_arn, secretArn=secret_arn, sql=sql, database=database, formatRecordsAs="JSON"
+    )
+    return json.loads(response.get("formattedRecords", "[]"))
+
+
+def search_sql(mode, vector, k, rerank_factor):
+    v = f"'{vector}'::vector"
+    if mode == "exact":
+        return f"SELECT id FROM (SELECT * FROM {TABLE} OFFSET 0) t ORDER BY embedding <=> {v} LIMIT {k}"
+    if mode == "full":
+        return f"SELECT id FROM {TABLE} ORDER BY embedding <=> {v} LIMIT {k}"
+    if mode == "halfvec":
+        order = f"embedding::halfvec({DIMENSION}) <=> ({v})::halfvec({DIMENSION})"
+    else:
+        order = f"binary_quantize(embedding)::bit({DIMENSION}) <~> binary_quantize({v})"
+    return (f"SELECT id FROM (SELECT id, embedding FROM {TABLE} ORDER BY {order} LIMIT {k * rerank_factor}) c "
+            f"ORDER BY embedding <=> {v} LIMIT {k}")
+
+
+def tuned(sql, ef_search):
+    escaped = sql.replace("'", "''")
+    return f"SELECT bedrock_integration.tuned_search('{escaped}', {ef_search}, 'off') AS row"
+
+
+def run(args):
+    cluster_arn = get_parameter("/videopgvector/cluster_arn")
+    secret_arn = get_parameter("/videopgvector/secret_arn")
+    database = get_parameter("/videopgvector/video_table_name")
+
+    rows = execute(f"SELECT embedding FROM {TABLE} ORDER BY random() LIMIT {args.queries}", cluster_arn, secret_arn, database)
+    vectors = [row["embedding"] for row in rows]
+    print(f"{len(vectors)} query vectors")
+
+    print(f"{'k':>4} {'mode':>8} {'recall':>8} {'p50 ms':>8} {'p90 ms':>8}")
+    for k in [5, 10, 50]:
+        factor = {"halfvec": args.halfvec_factor, "binary": args.binary_factor}
+        truth = [
+            {r["id"] for r in execute(search_sql("exact", v, k, 1), cluster_arn, secret_arn, database)}
+            for v in vectors
+        ]
+        for mode in ["exact", "full", "halfvec", "binary"]:
+            recalls, latencies = [], []
+            ef_search = max(40, k * factor.get(mode, 1))
+            for vector, expected in zip(vectors, truth):
+                sql = tuned(search_sql(mode, vector, k, factor.get(mode, 1)), ef_search)
+                start = time.perf_counter()
+                result = execute(sql, cluster_arn, secret_arn, database)
+                latencies.append((time.perf_counter() - start) * 1000)
+                found = {json.loads(r["row"])["id"] for r in result}
+                recalls.append(len(found & expected) / max(1, len(expected)))
+            latencies.sort()
+            p90 = latencies[int(0.9 * (len(latencies) - 1))]
+            print(f"{k:>4} {mode:>8} {statistics.mean(recalls):>8.3f} {statistics.median(latencies):>8.1f} {p90:>8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--halfvec-factor", type=int, default=4)
+    parser.add_argument("--binary-factor", type=int, default=10)
+    run(parser.parse_args())
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "retrieval"))
+
+import diversity  # noqa: E402
+
+
+def make_rows(times):
+    return [dict(id=str(i), source="video.mp4", content_type="text", time=t) for i, t in enumerate(times)]
+
+
+def test_mmr_select_leaves_the_inputs_unchanged():
+    vectors = np.array([[3.0, 0.0], [2.9, 0.1], [0.0, 2.0]], dtype=np.float32)
+    query = np.array([4.0, 0.0], dtype=np.float32)
+    vectors_before, query_before = vectors.copy(), query.copy()
+    selected = diversity.mmr_select(make_rows([0, 100, 200]), vectors, query, k=2, mmr_lambda=0.3, time_window=0)
+    np.testing.assert_array_equal(vectors, vectors_before)
+    np.testing.assert_array_equal(query, query_before)
+    # the near-duplicate of the best row loses to the different one
+    assert [row["id"] for row in selected] == ["0", "2"]
+
+
+def test_mmr_select_suppresses_rows_close_in_time():
+    vectors = np.array([[1.0, 0.0], [0.9, 0.1], [0.8, 0.2]], dtype=np.float32)
+    selected = diversity.mmr_select(make_rows([10, 12, 60]), vectors, [1.0, 0.0], k=2, mmr_lambda=1.0, time_window=5)
+    assert [row["id"] for row in selected] == ["0", "2"]
@@ -0,0 +1,118 @@
+import io
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from botocore.exceptions import ClientError
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "retrieval"))
+
+import hot_sources  # noqa: E402
+
+SOURCE = "s3://bucket/video.mp4"
+OTHER = "s3://bucket/other.mp4"
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = Body
+
+
+class FakeHotSources(hot_sources.HotSources):
+    """Rows of each video in memory instead of Aurora, loads of a video wait on its gate"""
+
+    def __init__(self, rows, max_bytes=10 ** 8):
+        super().__init__(aurora=None, max_bytes=max_bytes)
+        self.rows = rows
+        self.gates = {}
+        self.fetches = []
+
+    def source_state(self, source_id):
+        rows = self.rows.get(source_id, [])
+        return max((row["date"] for row in rows), default=None), len(rows)
+
+    def fetch_rows(self, source_id, since=None):
+        if source_id in self.gates:
+            self.gates[source_id].wait(5)
+        self.fetches.append((source_id, since))
+        return [dict(row) for row in self.rows[source_id] if since is None or row["date"] >= since]
+
+
+def make_rows(source, n, date="2025-01-01", seed=0):
+    rng = np.random.default_rng(seed)
+    return [dict(id=f"{source}-{seed}-{i}", chunks=f"chunk {i}", time=i, source=source, content_type="text",
+                 date=date, embedding=rng.normal(size=8).tolist()) for i in range(n)]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(hot_sources, "hot_source_min_queries", 1)
+    monkeypatch.setattr(hot_sources, "hot_source_refresh_seconds", 0)
+    monkeypatch.setattr(hot_sources, "hot_source_snapshot_bucket", "")
+
+
+def search(cache, source, vector=None, k=3):
+    vector = np.ones(8) if vector is None else vector
+    return cache.search(vector, k=k, filter=[dict(key="source", value=source)])
+
+
+def test_load_of_one_video_does_not_block_the_others():
+    cache = FakeHotSources({SOURCE: make_rows(SOURCE, 5), OTHER: make_rows(OTHER, 5)})
+    assert search(cache, OTHER) is not None
+    cache.gates[SOURCE] = threading.Event()
+    loader = threading.Thread(target=search, args=(cache, SOURCE))
+    loader.start()
+    while SOURCE not in cache.loading:
+        pass
+
+    # the loaded video is answered and refreshed, the one being loaded goes to Aurora
+    assert search(cache, OTHER) is not None
+    assert search(cache, SOURCE) is None
+    cache.gates[SOURCE].set()
+    loader.join()
+    assert search(cache, SOURCE) is not None
+    assert [source for source, since in cache.fetches if since is None] == [OTHER, SOURCE]
+
+
+def test_refresh_appends_new_rows():
+    rows = {SOURCE: make_rows(SOURCE, 4)}
+    cache = FakeHotSources(rows)
+    search(cache, SOURCE)
+    rows[SOURCE] = rows[SOURCE] + make_rows(SOURCE, 2, date="2025-02-01", seed=1)
+    assert len(json.loads(search(cache, SOURCE, k=10)["formattedRecords"])) == 6
+    assert cache.fetches[-1] == (SOURCE, "2025-01-01")
+
+
+def test_snapshot_is_shared_between_containers(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(hot_sources, "s3", s3)
+    monkeypatch.setattr(hot_sources, "hot_source_snapshot_bucket", "bucket")
+    rows = {SOURCE: make_rows(SOURCE, 4)}
+    first = FakeHotSources(rows)
+    expected = search(first, SOURCE)
+    assert len(s3.objects) == 1
+
+    # another container reads the snapshot instead of every row
+    second = FakeHotSources(rows)
+    assert search(second, SOURCE) == expected
+    assert second.fetches == []
+
+    # a snapshot behind Aurora only fetches the new rows
+    rows[SOURCE] = rows[SOURCE] + make_rows(SOURCE, 2, date="2025-02-01", seed=1)
+    third = FakeHotSources(rows)
+    assert len(json.loads(search(third, SOURCE, k=10)["formattedRecords"])) == 6
+    assert third.fetches == [(SOURCE, "2025-01-01")]
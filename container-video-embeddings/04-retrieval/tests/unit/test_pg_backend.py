@@ -0,0 +1,188 @@
+"""
+PooledPostgres against a real Postgres with pgvector. Skipped unless PG_TEST_DSN is set, e.g.
+
+    PG_TEST_DSN="host=localhost dbname=kbtest user=postgres password=..." pytest tests/unit/test_pg_backend.py
+
+The rows of the test (source pytest-pg-backend-*.mp4) are added to
+bedrock_integration.knowledge_bases and deleted afterwards, the table and its
+indexes are created when the database does not have them yet.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import uuid
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+pytest.importorskip("psycopg_pool")
+pytest.importorskip("pgvector")
+
+DSN = os.environ.get("PG_TEST_DSN")
+pytestmark = pytest.mark.skipif(not DSN, reason="PG_TEST_DSN is not set")
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "retrieval"))
+
+import pg_backend  # noqa: E402
+from aurora_service import TEXT_SEARCH_VECTOR, resolve_search_settings  # noqa: E402
+
+DIMENSION = 1024
+SOURCES = [f"pytest-pg-backend-{i}.mp4" for i in range(3)]
+ROWS = 60
+KEYWORD = "zebrafrog"
+# the vector cast loads pgvector in the session, which registers the hnsw.* settings
+EF_SEARCH = "SELECT '[1]'::vector AS loaded, current_setting('hnsw.ef_search') AS ef_search"
+
+CREATE_TABLE = f"""
+CREATE TABLE IF NOT EXISTS bedrock_integration.knowledge_bases (id uuid PRIMARY KEY, embedding vector({DIMENSION}),
+    chunks text, time integer, metadata json, "date" text, source text, sourceurl text, topic text,
+    content_type text, language varchar(10))"""
+
+
+def random_vector(rng):
+    return [rng.gauss(0, 1) for _ in range(DIMENSION)]
+
+
+@pytest.fixture(scope="module")
+def corpus():
+    """Test rows by id: embedding and chunks. The chunk of row 7 is the only one with KEYWORD."""
+    rng = random.Random(0)
+    rows = {}
+    with psycopg.connect(DSN, autocommit=True) as connection:
+        connection.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        connection.execute("CREATE SCHEMA IF NOT EXISTS bedrock_integration")
+        created = connection.execute("SELECT to_regclass('bedrock_integration.knowledge_bases') IS NULL").fetchone()[0]
+        connection.execute(CREATE_TABLE)
+        if created:
+            connection.execute("CREATE INDEX ON bedrock_integration.knowledge_bases USING hnsw (embedding vector_cosine_ops)")
+            connection.execute(f"CREATE INDEX ON bedrock_integration.knowledge_bases USING gin ({TEXT_SEARCH_VECTOR})")
+            connection.execute("CREATE INDEX ON bedrock_integration.knowledge_bases (source)")
+        with connection.cursor() as cursor:
+            for i in range(ROWS):
+                id_, vector = str(uuid.uuid4()), random_vector(rng)
+                chunks = f"chunk {i} about a {KEYWORD}" if i == 7 else f"chunk {i} about a video"
+                rows[id_] = dict(embedding=vector, chunks=chunks)
+                cursor.execute(
+                    "INSERT INTO bedrock_integration.knowledge_bases VALUES (%s, %s::vector, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    (id_, str(vector), chunks, i, json.dumps({}), "2025-01-01", SOURCES[i % 3],
+                     f"s3://bucket/{SOURCES[i % 3]}", "", "text", "en"))
+        connection.execute("ANALYZE bedrock_integration.knowledge_bases")
+    yield rows
+    with psycopg.connect(DSN, autocommit=True) as connection:
+        connection.execute("DELETE FROM bedrock_integration.knowledge_bases WHERE source = ANY(%s)", (SOURCES,))
+
+
+@pytest.fixture
+def backend(corpus, monkeypatch):
+    info = psycopg.conninfo.conninfo_to_dict(DSN)
+    monkeypatch.setattr(pg_backend, "get_credentials", lambda arn: (info.get("user"), info.get("password")))
+    monkeypatch.setattr(pg_backend, "db_sslmode", info.get("sslmode", "prefer"))
+    postgres = pg_backend.PooledPostgres(info["dbname"], "arn:secret", host=info.get("host", "localhost"),
+                                         port=int(info.get("port", 5432)))
+    yield postgres
+    postgres.pool.close()
+
+
+def records(response):
+    return json.loads(response["formattedRecords"])
+
+
+def supports_iterative_scan(backend):
+    version = records(backend.execute_statement("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))[0]["extversion"]
+    return tuple(int(p) for p in version.split(".")[:2]) >= (0, 8)
+
+
+def cosine_order(corpus, ids, query):
+    def distance(id_):
+        vector = corpus[id_]["embedding"]
+        dot = sum(a * b for a, b in zip(vector, query))
+        return 1 - dot / (sum(a * a for a in vector) ** 0.5 * sum(b * b for b in query) ** 0.5)
+    return sorted(ids, key=distance)
+
+
+def test_search_settings_are_transaction_scoped(backend, capsys):
+    default = records(backend.execute_statement(EF_SEARCH))[0]["ef_search"]
+    settings = dict(ef_search=123, iterative_scan="relaxed_order", plan="ann")
+    tuned = records(backend.execute_tuned(EF_SEARCH, settings))[0]["ef_search"]
+    # pgvector 0.7 rejects hnsw.iterative_scan (0.8 added it, older versions take it as a
+    # placeholder), the query then runs with the server defaults
+    rejected = "running with server defaults" in capsys.readouterr().out
+    assert not (rejected and supports_iterative_scan(backend))
+    assert tuned == (default if rejected else "123")
+
+    # the pooled connection goes back with the server defaults
+    after = records(backend.execute_statement(EF_SEARCH))[0]["ef_search"]
+    assert after == default
+
+
+def test_rejected_settings_fall_back_to_server_defaults(backend, monkeypatch, capsys):
+    monkeypatch.setattr(pg_backend, "SET_SEARCH_SETTINGS", "SELECT %s::int, %s::int")
+    settings = dict(ef_search=100, iterative_scan="relaxed_order", plan="ann")
+    assert records(backend.execute_tuned("SELECT 1 AS one", settings)) == [{"one": 1}]
+    assert records(asyncio.run(aexecute_and_close(backend, "SELECT 1 AS one", settings))) == [{"one": 1}]
+    assert capsys.readouterr().out.count("running with server defaults") == 2
+
+
+async def aexecute_and_close(backend, sql, settings):
+    try:
+        return await backend.aexecute_tuned(sql, settings)
+    finally:
+        await backend.aclose()
+
+
+def test_exact_plan(backend, corpus):
+    filter = [{"key": "source", "value": SOURCES[0]}]
+    plan = backend.choose_plan(filter)
+    assert plan["plan"] == "exact"
+
+    query = random_vector(random.Random(1))
+    settings = dict(resolve_search_settings(filtered=True), **plan)
+    sql, params = backend.similarity_sql(query, k=ROWS, filter=filter, search_settings=settings)
+    explain = "\n".join(row["QUERY PLAN"] for row in backend.run("EXPLAIN " + sql, params))
+    hnsw_indexes = [row["indexname"] for row in backend.run(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = 'bedrock_integration' AND indexdef ILIKE '%USING hnsw%'")]
+    assert not any(name in explain for name in hnsw_indexes)
+
+    # every row of the video, in exact cosine order
+    found = [row["id"] for row in records(backend.similarity_search(query, k=ROWS, filter=filter, search_settings=settings))]
+    expected = [id_ for id_ in corpus if id_ in set(found)]
+    assert len(found) == ROWS // 3
+    assert found == cosine_order(corpus, expected, query)
+
+
+def test_hybrid_search(backend, corpus):
+    keyword_id = next(id_ for id_, row in corpus.items() if KEYWORD in row["chunks"])
+    filter = [{"key": "source", "value": SOURCES[7 % 3]}]
+    # a query vector far from the keyword row: only the text match brings it in
+    query = [-v for v in corpus[keyword_id]["embedding"]]
+    rows = records(backend.similarity_search(query, k=3, filter=filter, query_text=KEYWORD, hybrid=True,
+                                             search_settings=resolve_search_settings(filtered=True)))
+    assert keyword_id in [row["id"] for row in rows]
+    assert all(row["source"] == SOURCES[1] and row["rrf_score"] > 0 for row in rows)
+    assert [row["rrf_score"] for row in rows] == sorted((row["rrf_score"] for row in rows), reverse=True)
+
+
+def test_pool_reuse(backend):
+    filter = [{"key": "source", "value": SOURCES[2]}]
+    query = random_vector(random.Random(2))
+    pids = set()
+    for _ in range(4):
+        backend.similarity_search(query, k=5, filter=filter)
+        pids.add(records(backend.execute_statement("SELECT pg_backend_pid() AS pid"))[0]["pid"])
+    # one pooled connection serves every query, the repeated search is prepared on it
+    assert len(pids) == 1
+    prepared = records(backend.execute_statement("SELECT count(*) AS n FROM pg_prepared_statements"))[0]["n"]
+    assert prepared >= 1
+
+    async def searches():
+        first = await backend.get_async_pool()
+        await backend.asimilarity_search(query, k=5, filter=filter)
+        await backend.asimilarity_search(query, k=5, filter=filter)
+        assert await backend.get_async_pool() is first
+        await backend.aclose()
+        return first
+
+    assert asyncio.run(searches()).closed
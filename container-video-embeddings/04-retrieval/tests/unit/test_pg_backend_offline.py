@@ -0,0 +1,136 @@
+"""
+PooledPostgres without a database: the conversion of psycopg rows to the Data API records the
+rest of the Lambda reads, and the SQL/parameters sent to the pool. Runs without PG_TEST_DSN,
+test_pg_backend.py covers the same backend against a real Postgres.
+"""
+import contextlib
+import datetime
+import decimal
+import json
+import os
+import sys
+import uuid
+
+import pytest
+
+np = pytest.importorskip("numpy")
+psycopg = pytest.importorskip("psycopg")
+pytest.importorskip("psycopg_pool")
+pgvector = pytest.importorskip("pgvector")
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code", "retrieval"))
+
+import pg_backend  # noqa: E402
+
+ROW_ID = uuid.UUID("0c5bd4a6-5d6e-4a4a-9a54-3f1b1c3e6a10")
+
+
+class FakeCursor:
+    def __init__(self, rows, reject_settings=False):
+        self.rows = rows
+        self.reject_settings = reject_settings
+        self.executed = []
+        self.description = None
+
+    def execute(self, sql, params=None):
+        if sql == pg_backend.SET_SEARCH_SETTINGS and self.reject_settings:
+            raise psycopg.errors.UndefinedObject('unrecognized configuration parameter "hnsw.iterative_scan"')
+        self.executed.append((sql, params))
+        self.description = None if sql == pg_backend.SET_SEARCH_SETTINGS else ["columns"]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.fake_cursor = cursor
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+    def cursor(self, row_factory=None, binary=False):
+        return contextlib.nullcontext(self.fake_cursor)
+
+
+class FakePool:
+    def __init__(self, cursor):
+        self.fake_connection = FakeConnection(cursor)
+
+    def connection(self):
+        return contextlib.nullcontext(self.fake_connection)
+
+
+def make_backend(rows, reject_settings=False):
+    backend = pg_backend.PooledPostgres.__new__(pg_backend.PooledPostgres)
+    backend.cursor = FakeCursor(rows, reject_settings)
+    backend.pool = FakePool(backend.cursor)
+    return backend
+
+
+def psycopg_row(**overrides):
+    """A row as psycopg returns it with dict_row and the pgvector loaders"""
+    row = dict(id=ROW_ID, chunks="a chunk", time=12, metadata={"speaker": "A"}, date="2025-01-01",
+               source="video.mp4", similarity=0.75, embedding=np.array([0.5, -1.25], dtype=np.float32))
+    row.update(overrides)
+    return row
+
+
+@pytest.mark.parametrize("value, expected", [
+    ({"speaker": "A"}, '{"speaker": "A"}'),
+    ([1, 2], "[1, 2]"),
+    (np.array([0.5, -1.25], dtype=np.float32), "[0.5, -1.25]"),
+    (pgvector.Vector([0.5, -1.25]), "[0.5, -1.25]"),
+    (pgvector.HalfVector([0.5, -1.25]), "[0.5, -1.25]"),
+    (ROW_ID, str(ROW_ID)),
+    (decimal.Decimal("0.25"), 0.25),
+    (datetime.date(2025, 1, 2), "2025-01-02"),
+    (datetime.datetime(2025, 1, 2, 3, 4, 5), "2025-01-02T03:04:05"),
+    ("text", "text"),
+    (7, 7),
+    (None, None),
+])
+def test_to_data_api_value(value, expected):
+    assert pg_backend.to_data_api_value(value) == expected
+
+
+def test_records_have_the_data_api_shape():
+    backend = make_backend([psycopg_row()])
+    record = json.loads(backend.execute_statement("SELECT 1")["formattedRecords"])[0]
+    # json and vector columns come back as text, like the Data API returns them
+    assert record == dict(id=str(ROW_ID), chunks="a chunk", time=12, metadata='{"speaker": "A"}', date="2025-01-01",
+                          source="video.mp4", similarity=0.75, embedding="[0.5, -1.25]")
+    assert json.loads(record["embedding"]) == [0.5, -1.25]
+
+
+def test_to_placeholders():
+    params = {}
+    backend = make_backend([])
+    sql = f"SELECT chunks FROM t WHERE chunks LIKE '50%' ORDER BY embedding <=> {backend.bind_vector('v', [1, 2], params)}"
+    assert pg_backend.to_placeholders(sql, params) == \
+        "SELECT chunks FROM t WHERE chunks LIKE '50%%' ORDER BY embedding <=> %(v)s::vector"
+    assert params["v"].dtype == np.float32
+    # without parameters psycopg does not read placeholders, % stays as it is
+    assert pg_backend.to_placeholders("SELECT '50%'", {}) == "SELECT '50%'"
+
+
+def test_search_settings_params():
+    assert pg_backend.search_settings_params(dict(ef_search=100.0, iterative_scan="relaxed_order")) == ("100", "relaxed_order")
+
+
+def test_tuned_query_sets_the_search_settings_first():
+    backend = make_backend([psycopg_row(similarity=0.5), psycopg_row(similarity=0.9)])
+    settings = dict(ef_search=80, iterative_scan="relaxed_order", plan="ann")
+    records = json.loads(backend.execute_tuned("SELECT 1", settings)["formattedRecords"])
+    assert backend.cursor.executed == [(pg_backend.SET_SEARCH_SETTINGS, ("80", "relaxed_order")), ("SELECT 1", None)]
+    assert [r["similarity"] for r in records] == [0.9, 0.5]
+
+
+def test_rejected_settings_run_with_server_defaults(capsys):
+    backend = make_backend([psycopg_row()], reject_settings=True)
+    settings = dict(ef_search=80, iterative_scan="relaxed_order", plan="ann")
+    records = json.loads(backend.execute_tuned("SELECT 1", settings)["formattedRecords"])
+    assert backend.cursor.executed == [("SELECT 1", None)]
+    assert len(records) == 1
+    assert "running with server defaults" in capsys.readouterr().out
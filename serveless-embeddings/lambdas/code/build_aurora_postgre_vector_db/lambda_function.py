@@ -23,11 +23,11 @@ from PIL import Image
 import psycopg
 
 from langchain_community.embeddings import BedrockEmbeddings # to create embeddings for the documents.
-from langchain_experimental.text_splitter import SemanticChunker # to split documents into smaller chunks.
 from langchain_postgres import PGVector
 from langchain_postgres.vectorstores import PGVector
 from langchain_community.document_loaders import PyPDFLoader
 
+from semantic_chunking import CachedEmbeddings, semantic_splitter # to split documents into smaller chunks.
 from utils import (download_file,    download_files_in_folder)
 
 tmp_path                    = "/tmp"
@@ -49,7 +49,7 @@ def create_vectorstore(embeddings,collection_name,conn):
 
 def load_and_split_pdf_semantic(file_path, embeddings):
     print(f"loading and splitting pdf: {file_path}")
-    text_splitter = SemanticChunker(embeddings, breakpoint_threshold_amount= 80)
+    text_splitter = semantic_splitter(embeddings, 80)
     print(f"text_splitter")
     loader = PyPDFLoader(file_path)
     print(f"loader")
@@ -161,7 +161,8 @@ def lambda_handler(event, context):
         bedrock_client = boto3.client("bedrock-runtime")
 
 
-    bedrock_embeddings          = BedrockEmbeddings(model_id=embedding_model,client=bedrock_client)
+    # chunks already embedded by the chunker are not sent to Bedrock again
+    bedrock_embeddings          = CachedEmbeddings(BedrockEmbeddings(model_id=embedding_model,client=bedrock_client))
 
     conn = psycopg.connect(
                    conninfo = f"postgresql://{user}:{password}@{host}:{port}/{database}"
@@ -182,6 +183,7 @@ def lambda_handler(event, context):
         docs = load_and_split_pdf_semantic(local_file, bedrock_embeddings)
         # Add documents to the vectorstore
         vectorstore.add_documents(docs)
+        print(f"embeddings: {bedrock_embeddings.stats()}")
         print(f"Vector Database Done:{vectorstore} docs")
 
     elif file_type == "image":
@@ -6,7 +6,9 @@ EVENT
     "bucketName": "YOU-BUCKET",
     "vectorStoreType": "faiss",
     "splitStrategy": "semantic",
-    "embeddingModel": "amazon.titan-embed-image-v1"
+    "embeddingModel": "amazon.titan-embed-image-v1",
+    "indexType": "flat | ivf_flat | ivf_pq | hnsw | sq8",
+    "indexParams": {"nlist": 1024, "nprobe": 32, "m": 64, "nbits": 8, "M": 32, "efConstruction": 128, "efSearch": 64}
   }
 """
 
@@ -20,7 +22,10 @@ from PIL import Image
 import errno
 
 
-from utils import (upload_folder_s3, build_response, download_file,download_files_in_folder)
+from faiss_index import rebuild
+from sqlite_docstore import save_vector_store
+from vector_store_s3 import upload_vector_store
+from utils import (build_response, download_file,download_files_in_folder)
 
 
 bedrock_client              = boto3.client("bedrock-runtime")
@@ -142,13 +147,16 @@ def lambda_handler(event, context):
 
     db                      = db = create_vector_db(bucket_name,vectorStore_type,local_file,embedding_model)
     print(f"Vector Database:{db.index.ntotal} docs")
+    index_report            = rebuild(db, event.get("indexType"), event.get("indexParams"))
 
     db_file                 = f"{tmp_path}/{file_name.split(".")[0]}.vdb"
 
-    db.save_local(db_file)
+    save_vector_store(db, db_file)
+    index_report["bytes"]   = os.path.getsize(os.path.join(db_file, "index.faiss"))
+    print(f"index: {index_report}")
     print(f"vectordb was saved in {db_file}")
 
-    upload_folder_s3(db_file, bucket_name, vector_location)
+    upload_vector_store(db_file, bucket_name, vector_location, overwrite=True)
   
     print(f"vectordb was uploaded in {vector_location}")
         
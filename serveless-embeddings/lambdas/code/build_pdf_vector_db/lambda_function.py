@@ -7,21 +7,31 @@ EVENT
     "vectorStoreType": "faiss",
     "splitStrategy": "semantic",
     "fileType": "application/pdf", 
-    "embeddingModel": "amazon.titan-embed-text-v1"
+    "embeddingModel": "amazon.titan-embed-text-v1",
+    "mode": "overwrite | append | delete",
+    "deleteLocations": ["OTHER-KEY"],
+    "legacyLocations": ["YOU-KEY"],
+    "indexType": "flat | ivf_flat | ivf_pq | hnsw | sq8",
+    "indexParams": {"nlist": 1024, "nprobe": 32, "m": 64, "nbits": 8, "M": 32, "efConstruction": 128, "efSearch": 64}
   }
 """
 
 import json
 import os
+import shutil
+import uuid
 import boto3 
 
 from langchain_community.document_loaders import PyPDFLoader
 
 from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import BedrockEmbeddings
-from langchain_experimental.text_splitter import SemanticChunker
 
-from utils import (upload_folder_s3, build_response, download_file)
+from faiss_index import index_type_of, load_original_vectors, rebuild, to_flat
+from semantic_chunking import CachedEmbeddings, semantic_splitter
+from sqlite_docstore import save_vector_store, load_vector_store, SQLiteDocstore
+from vector_store_s3 import download_vector_store, upload_vector_store
+from utils import (build_response, download_file)
 
 
 bedrock_client              = boto3.client("bedrock-runtime")
@@ -32,7 +42,7 @@ tmp_path                    = "/tmp"
 
 
 def load_and_split_pdf_semantic(file_path, embeddings):
-    text_splitter           = SemanticChunker(embeddings, breakpoint_threshold_amount= 80)
+    text_splitter           = semantic_splitter(embeddings, 80)
     loader                  = PyPDFLoader(file_path)
     docs                    = loader.load_and_split(text_splitter)
     return docs
@@ -48,11 +58,81 @@ def load_and_split_semantic(file_type, file_path, embeddings):
     print(f"docs:{len(clean_docs)}")
     return clean_docs
 
-def create_vector_store(type, docs, embeddings):
+def create_vector_store(type, docs, embeddings, ids=None):
     if (type == "faiss") and docs:
-        return FAISS.from_documents(docs, embeddings)
+        return FAISS.from_documents(docs, embeddings, ids=ids)
     return None
 
+
+def chunk_ids(bucket_name, location, docs):
+    """Stable ids: the same chunk of the same PDF always gets the same id"""
+    return [str(uuid.uuid5(uuid.NAMESPACE_URL, f"s3://{bucket_name}/{location}#{i}")) for i in range(len(docs))]
+
+
+def metadata_ids(db, keys, values):
+    """Ids of the chunks whose first present metadata key (in keys order) has one of values"""
+    if isinstance(db.docstore, SQLiteDocstore):
+        return db.docstore.ids_where_metadata(keys, values)
+    ids = []
+    for id_ in db.index_to_docstore_id.values():
+        metadata = db.docstore.search(id_).metadata
+        if next((metadata[key] for key in keys if key in metadata), None) in values:
+            ids.append(id_)
+    return ids
+
+
+def location_ids(db, locations):
+    """Ids of the chunks of the given PDFs (their S3 keys)"""
+    return metadata_ids(db, ["location"], set(locations))
+
+
+def legacy_ids(db, location):
+    """Ids of the chunks built before the location metadata that may belong to location:
+    they only have the /tmp path PyPDFLoader saw, the same for every PDF with its file name"""
+    return metadata_ids(db, ["location", "source"], {f"{tmp_path}/{location.split('/')[-1]}"})
+
+
+def store_locations(db):
+    if isinstance(db.docstore, SQLiteDocstore):
+        return db.docstore.metadata_values("location")
+    return {db.docstore.search(id_).metadata.get("location") for id_ in db.index_to_docstore_id.values()} - {None}
+
+
+def backfill_locations(db, locations):
+    """Assign legacyLocations to the chunks built before the location metadata, so append and
+    delete can match them. Refused when another PDF of the request or of the store has the
+    same file name: their chunks cannot be told apart. Returns {location: chunks}."""
+    names = [location.split("/")[-1] for location in locations]
+    known = store_locations(db)
+    for location, name in zip(locations, names):
+        others = [other for other in set(locations) | known if other != location and other.split("/")[-1] == name]
+        if others:
+            raise ValueError(f"legacy chunks of {name} cannot be assigned to {location}, {others} have the same file name")
+
+    backfilled = {}
+    for location in locations:
+        ids = legacy_ids(db, location)
+        if isinstance(db.docstore, SQLiteDocstore):
+            db.docstore.update_metadata(ids, {"location": location})
+        else:
+            for id_ in ids:
+                db.docstore.search(id_).metadata["location"] = location
+        backfilled[location] = len(ids)
+    print(f"legacy chunks assigned: {backfilled}")
+    return backfilled
+
+
+def delete_locations(db, locations):
+    ids = location_ids(db, locations)
+    if ids:
+        db.delete(ids)
+    print(f"deleted {len(ids)} chunks of {locations}")
+    legacy = sum(len(legacy_ids(db, location)) for location in locations)
+    if legacy:
+        print(f"{legacy} chunks without location share a file name with {locations}, "
+              "kept: list their PDF in legacyLocations to replace or delete them")
+    return len(ids), legacy
+
 def lambda_handler(event, context):
     print("event:", event)
     location                = event.get("location")
@@ -62,35 +142,85 @@ def lambda_handler(event, context):
     split_strategy          = event.get("splitStrategy")
     embedding_model         = event.get("embeddingModel")
     file_type               = event.get("fileType")
+    # overwrite: new store from this PDF, append: add this PDF to the store (replacing its
+    # previous chunks), delete: remove the chunks of deleteLocations (or location)
+    mode                    = event.get("mode", "overwrite")
+    # PDFs whose chunks were built before the location metadata, assigned before append/delete
+    legacy_locations        = event.get("legacyLocations") or []
+    # flat by default (FAISS_INDEX_TYPE), append/delete keep the type of the store unless given
+    index_type              = event.get("indexType")
+    index_params            = event.get("indexParams")
 
     if split_strategy == "recursive":
         chunk_size              = event.get("chunkSize") if event.get("chunkSize") else 1000
         chunk_overlap           = event.get("chunkOverlap") if event.get("chunkOverlap") else 100
 
-    file_name              = location.split("/")[-1]
-    local_file             = f"{tmp_path}/{file_name}"
-
-    print(f"dowload from s3://{bucket_name}{location} to {local_file}")
-    download_file(bucket_name,location, local_file)
-
-    bedrock_embeddings      = BedrockEmbeddings(model_id=embedding_model,client=bedrock_client)
-
-    if split_strategy  == "semantic":
-        docs = load_and_split_semantic(file_type, local_file, bedrock_embeddings)
-    
-
-    db                      = create_vector_store(vectorStore_type, docs, bedrock_embeddings)
+    if mode not in ("overwrite", "append", "delete"):
+        return build_response(400, json.dumps({"message": f"mode must be overwrite, append or delete, got {mode}"}))
+
+    # chunks already embedded by the chunker are not sent to Bedrock again
+    bedrock_embeddings      = CachedEmbeddings(BedrockEmbeddings(model_id=embedding_model,client=bedrock_client))
+
+    store_name              = vector_location.strip("/").split("/")[-1].split(".")[0]
+    db_file                 = f"{tmp_path}/{store_name}.vdb"
+    shutil.rmtree(db_file, ignore_errors=True)
+
+    db, previous_version = None, None
+    if mode in ("append", "delete"):
+        previous_version = download_vector_store(bucket_name, vector_location, db_file)
+        if previous_version:
+            db = load_vector_store(db_file, bedrock_embeddings)
+        elif mode == "delete":
+            return build_response(404, json.dumps({"message": f"No vector store in s3://{bucket_name}/{vector_location}"}))
+
+    # add and delete run on a flat copy, the index is rebuilt (reusing its training) before saving
+    previous_index          = None
+    if db is not None:
+        try:
+            previous_index = to_flat(db, load_original_vectors(db_file, db.index))
+        except ValueError as e:
+            return build_response(409, json.dumps({"message": str(e)}))
+        if legacy_locations:
+            try:
+                event['backfilled'] = backfill_locations(db, legacy_locations)
+            except ValueError as e:
+                return build_response(409, json.dumps({"message": str(e)}))
+        deleted = (event.get("deleteLocations") or [location]) if mode == "delete" else [location]
+        event['deleted'], event['legacyChunks'] = delete_locations(db, deleted)
+
+    if mode != "delete":
+        file_name              = location.split("/")[-1]
+        local_file             = f"{tmp_path}/{file_name}"
+        print(f"dowload from s3://{bucket_name}{location} to {local_file}")
+        download_file(bucket_name,location, local_file)
+
+        if split_strategy  == "semantic":
+            docs = load_and_split_semantic(file_type, local_file, bedrock_embeddings)
+        for doc in docs:
+            doc.metadata["location"] = location
+        ids = chunk_ids(bucket_name, location, docs)
+
+        # only the chunks of this PDF are embedded, the rest of the store is reused
+        if db is None:
+            db = create_vector_store(vectorStore_type, docs, bedrock_embeddings, ids=ids)
+        else:
+            db.add_documents(docs, ids=ids)
+        event['added'] = len(docs)
+        event['embeddings'] = bedrock_embeddings.stats()
+        print(f"embeddings: {event['embeddings']}")
     print(f"Vector Database:{db.index.ntotal} docs")
 
-    db_file                 = f"{tmp_path}/{file_name.split(".")[0]}.vdb"
-
     event['size'] = db.index.ntotal
 
+    if index_type is None and previous_index is not None:
+        index_type = index_type_of(previous_index)
+    event['index'] = rebuild(db, index_type, index_params, trained=previous_index, folder_path=db_file)
 
-    db.save_local(db_file)
+    save_vector_store(db, db_file)
+    event['index']['bytes'] = os.path.getsize(os.path.join(db_file, "index.faiss"))
     print(f"vectordb was saved in {db_file}")
 
-    upload_folder_s3(db_file, bucket_name, vector_location)
+    upload_vector_store(db_file, bucket_name, vector_location, previous_version, overwrite=mode == "overwrite")
   
     print(f"vectordb was uploaded in {vector_location}")
 
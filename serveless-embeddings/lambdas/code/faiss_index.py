@@ -0,0 +1,229 @@
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+# Index built by the builders when the event has no indexType: flat, ivf_flat, ivf_pq, hnsw or sq8
+faiss_index_type            = os.environ.get("FAISS_INDEX_TYPE", "flat")
+
+INDEX_TYPES                 = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8")
+# types whose reconstruct returns the quantized approximations, not the vectors that were added
+LOSSY_TYPES                 = ("ivf_pq", "sq8")
+# float32 vectors of a lossy index in position order, kept in the store folder for the builders
+ORIGINAL_VECTORS_FILE       = "vectors.npy"
+
+# k-means wants at least this many training vectors per centroid, faiss warns below it
+MIN_POINTS_PER_CENTROID     = 39
+# IVF indexes with fewer lists are no faster than a flat scan, smaller corpora stay flat
+MIN_NLIST                   = 16
+
+RECALL_QUERIES              = 100
+RECALL_K                    = 10
+
+
+def index_config(index_type, ntotal, dim, params=None):
+    """Build parameters of index_type for ntotal vectors, params (the event's indexParams) override them.
+
+    - ivf_flat / ivf_pq: nlist ~ 4 * sqrt(ntotal), at most ntotal / 39, nprobe nlist / 16
+    - ivf_pq: m the largest divisor of dim up to dim / 8 (bytes per vector), nbits 8 (or fewer on small corpora)
+    - hnsw: M 16 (32 above 1M vectors), efConstruction 4 * M, efSearch 64
+    A corpus too small for the requested type gets a flat index."""
+    params = params or {}
+    config = dict(type=index_type)
+    if index_type in ("ivf_flat", "ivf_pq"):
+        nlist = int(params.get("nlist") or min(4 * math.sqrt(ntotal), ntotal // MIN_POINTS_PER_CENTROID))
+        if nlist < MIN_NLIST:
+            print(f"{ntotal} vectors are too few for {index_type}, building a flat index")
+            return dict(type="flat")
+        config.update(nlist=nlist, nprobe=int(params.get("nprobe") or max(1, nlist // 16)))
+        if index_type == "ivf_pq":
+            m = int(params.get("m") or max(d for d in range(1, dim // 8 + 1) if dim % d == 0))
+            # 2 ** nbits PQ centroids are trained on the same sample
+            nbits = int(params.get("nbits") or min(8, max(4, int(math.log2(ntotal // MIN_POINTS_PER_CENTROID)))))
+            config.update(m=m, nbits=nbits)
+        # sample large enough for every centroid, without training on the whole corpus
+        config["training_samples"] = min(ntotal, int(params.get("trainingSamples") or 64 * nlist))
+    elif index_type == "hnsw":
+        m = int(params.get("M") or (32 if ntotal > 1_000_000 else 16))
+        config.update(M=m, efConstruction=int(params.get("efConstruction") or 4 * m),
+                      efSearch=int(params.get("efSearch") or 64))
+    elif index_type == "sq8":
+        config["training_samples"] = min(ntotal, int(params.get("trainingSamples") or 100_000))
+    elif index_type != "flat":
+        raise ValueError(f"indexType must be one of {', '.join(INDEX_TYPES)}, got {index_type}")
+    return config
+
+
+def factory_string(config):
+    if config["type"] == "ivf_flat":
+        return f"IVF{config['nlist']},Flat"
+    if config["type"] == "ivf_pq":
+        return f"IVF{config['nlist']},PQ{config['m']}x{config['nbits']}"
+    if config["type"] == "hnsw":
+        return f"HNSW{config['M']}"
+    if config["type"] == "sq8":
+        return "SQ8"
+    return "Flat"
+
+
+def index_type_of(index):
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def index_vectors(index):
+    """All vectors of an index in position order (the quantized approximations for LOSSY_TYPES)"""
+    if isinstance(index, faiss.IndexIVF) and index.ntotal:
+        index.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def training_sample(vectors, size, seed=1234):
+    if size >= len(vectors):
+        return vectors
+    return vectors[np.random.default_rng(seed).choice(len(vectors), size, replace=False)]
+
+
+def build_index(vectors, index_type=None, params=None, trained=None):
+    """index_type index of vectors, positions match the rows of vectors.
+
+    trained, the previous index of the store, is reused on append/delete when it has the
+    same IVF type and its nlist is still within 2x of the one the corpus calls for: its
+    coarse quantizer and PQ codebooks are kept and only the vectors are added again.
+    Returns (index, report)."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ntotal, dim = vectors.shape
+    index_type = index_type or faiss_index_type
+    config = index_config(index_type, ntotal, dim, params)
+    start = time.perf_counter()
+
+    if (trained is not None and config["type"] in ("ivf_flat", "ivf_pq") and index_type_of(trained) == config["type"]
+            and not (params or {}).get("nlist") and config["nlist"] / 2 <= trained.nlist <= config["nlist"] * 2):
+        index = trained
+        index.reset()
+        config.update(nlist=index.nlist, retrained=False)
+        config.pop("training_samples")
+    else:
+        index = faiss.index_factory(dim, factory_string(config), faiss.METRIC_L2)
+        if config["type"] == "hnsw":
+            index.hnsw.efConstruction = config["efConstruction"]
+        if config["type"] == "ivf_pq":
+            # the factory turns on polysemous training, which only the unused hamming search needs
+            index.do_polysemous_training = False
+        if not index.is_trained:
+            index.train(training_sample(vectors, config["training_samples"]))
+    index.add(vectors)
+
+    # search defaults saved with the index, retrievers override them per request
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = config.get("nprobe", max(1, index.nlist // 16))
+        # MMR reads the candidate vectors back with reconstruct
+        index.make_direct_map()
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.get("efSearch", 64)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    report = dict(config, build_ms=round(build_ms), ntotal=index.ntotal, **search_quality(index, vectors))
+    print(f"faiss index: {report}")
+    return index, report
+
+
+def search_quality(index, vectors, queries=RECALL_QUERIES, k=RECALL_K):
+    """recall@k against an exact search and mean query latency, on stored vectors used as queries"""
+    if index_type_of(index) == "flat" or not len(vectors):
+        return dict(recall=1.0)
+    k = min(k, len(vectors))
+    sample = training_sample(vectors, queries, seed=4321)
+    _, exact = faiss.knn(sample, vectors, k)
+    start = time.perf_counter()
+    _, found = index.search(sample, k)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(sample)
+    recall = np.mean([len(set(e) & set(f)) / k for e, f in zip(exact, found)])
+    return dict(recall=round(float(recall), 4), latency_ms=round(latency_ms, 3))
+
+
+def save_original_vectors(folder_path, index, vectors=None):
+    """Keep the vectors of a lossy index next to it, so the next append/delete rebuilds from
+    them instead of re-quantizing its approximations. Removed when the index is not lossy."""
+    path = os.path.join(folder_path, ORIGINAL_VECTORS_FILE)
+    if index_type_of(index) in LOSSY_TYPES:
+        os.makedirs(folder_path, exist_ok=True)
+        # written aside and renamed, the previous file may still be memory-mapped
+        with open(f"{path}.tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        os.replace(f"{path}.tmp", path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def load_original_vectors(folder_path, index):
+    """Vectors saved by save_original_vectors, None for an index that is not lossy (its
+    reconstruct is exact). ValueError for a lossy index saved without them."""
+    if index_type_of(index) not in LOSSY_TYPES:
+        return None
+    path = os.path.join(folder_path, ORIGINAL_VECTORS_FILE)
+    if not os.path.exists(path):
+        raise ValueError(f"the {index_type_of(index)} index of this store was built without {ORIGINAL_VECTORS_FILE}, "
+                         "its vectors can only be read back quantized: rebuild the store with mode overwrite")
+    vectors = np.load(path, mmap_mode="r")
+    if len(vectors) != index.ntotal:
+        raise ValueError(f"{ORIGINAL_VECTORS_FILE} has {len(vectors)} vectors, the index {index.ntotal}: rebuild the store")
+    return vectors
+
+
+def to_flat(db, original_vectors=None):
+    """Swap the index of a FAISS store for a flat copy, so LangChain's add and delete
+    (which assume positions shift on remove_ids) work whatever the index type.
+    A lossy index is copied from original_vectors (load_original_vectors), never from its codes.
+    Returns the previous index for build_index(trained=...)."""
+    previous = db.index
+    index_type = index_type_of(previous)
+    if index_type != "flat":
+        if original_vectors is None and index_type in LOSSY_TYPES:
+            raise ValueError(f"the original vectors of the {index_type} index are required")
+        flat = faiss.IndexFlatL2(previous.d)
+        flat.add(np.ascontiguousarray(original_vectors if original_vectors is not None else index_vectors(previous),
+                                      dtype=np.float32))
+        db.index = flat
+    return previous
+
+
+def rebuild(db, index_type=None, params=None, trained=None, folder_path=None):
+    """Replace the flat index of a FAISS store by an index_type index of the same vectors.
+    With folder_path (the store folder) the vectors of a lossy index are saved there."""
+    if (index_type or faiss_index_type) == "flat" and index_type_of(db.index) == "flat":
+        if folder_path:
+            save_original_vectors(folder_path, db.index)
+        return dict(type="flat", ntotal=db.index.ntotal)
+    vectors = index_vectors(db.index)
+    index, report = build_index(vectors, index_type, params, trained)
+    db.index = index
+    if folder_path:
+        save_original_vectors(folder_path, index, vectors)
+    return report
+
+
+def search_params(index):
+    """Current search-time parameters of an index"""
+    if isinstance(index, faiss.IndexIVF):
+        return dict(nprobe=index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return dict(efSearch=index.hnsw.efSearch)
+    return {}
+
+
+def set_search_params(index, params):
+    """Apply nprobe / efSearch, parameters the index does not have are ignored"""
+    if isinstance(index, faiss.IndexIVF) and params.get("nprobe"):
+        index.nprobe = min(int(params["nprobe"]), index.nlist)
+    if isinstance(index, faiss.IndexHNSW) and params.get("efSearch"):
+        index.hnsw.efSearch = int(params["efSearch"])
@@ -0,0 +1,149 @@
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+import faiss
+
+from faiss_index import ORIGINAL_VECTORS_FILE, search_params, set_search_params
+from sqlite_docstore import load_vector_store
+from vector_store_s3 import download_vector_store, store_files
+
+tmp_path                    = "/tmp"
+
+# Memory-map index.faiss from /tmp instead of reading it into RAM, only the pages a search touches are loaded
+faiss_mmap                  = os.environ.get("FAISS_MMAP", "true").lower() == "true"
+
+# Loaded stores are kept while they take less than this memory, half the Lambda memory by default.
+# A memory-mapped index.faiss and docstore.sqlite are not counted, their pages are file cache the kernel can reclaim.
+lambda_memory_mb            = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "1024"))
+registry_max_bytes          = int(os.environ.get("FAISS_REGISTRY_MAX_BYTES", str(lambda_memory_mb * 1024 * 1024 // 2)))
+# and while their /tmp copies take less than this, keep it below the function's ephemeral storage
+registry_max_disk_bytes     = int(os.environ.get("FAISS_REGISTRY_MAX_DISK_BYTES", str(400 * 1024 * 1024)))
+# Seconds a loaded store is trusted before its S3 ETags are checked again, 0 checks on every request
+etag_check_seconds          = int(os.environ.get("FAISS_ETAG_CHECK_SECONDS", "60"))
+# Search-time defaults of IVF (nprobe) and HNSW (efSearch) indexes, unset keeps the ones saved by the builder
+default_search_params       = {"nprobe": os.environ.get("FAISS_NPROBE"), "efSearch": os.environ.get("FAISS_EF_SEARCH")}
+
+
+class FaissRegistry:
+    """FAISS stores loaded once per container, keyed by bucket and vectorStoreLocation.
+
+    A store is reused while its S3 version (manifest ETag) is unchanged (checked at most every
+    etag_check_seconds), so warm requests only pay for the query embedding and the search.
+    Least recently used stores are dropped, with their /tmp copy, above max_bytes of memory
+    or max_disk_bytes of /tmp."""
+
+    def __init__(self, max_bytes=registry_max_bytes, max_disk_bytes=registry_max_disk_bytes,
+                 check_seconds=etag_check_seconds, mmap=faiss_mmap):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.check_seconds = check_seconds
+        self.mmap = mmap
+        self.current_bytes = 0
+        self.current_disk_bytes = 0
+        self.stores = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, bucket_name, vector_location, embeddings, search_overrides=None):
+        key = (bucket_name, vector_location)
+        with self.lock:
+            entry = self.stores.get(key)
+            if entry and time.time() - entry["checked"] > self.check_seconds:
+                if store_files(bucket_name, vector_location)[0] == entry["version"]:
+                    entry["checked"] = time.time()
+                else:
+                    print(f"vector store changed in S3: s3://{bucket_name}/{vector_location}")
+                    self.evict(key)
+                    entry = None
+
+            if entry:
+                self.hits += 1
+                self.stores.move_to_end(key)
+            else:
+                self.misses += 1
+                entry = self.load(bucket_name, vector_location, embeddings)
+                self.store(key, entry)
+            print(f"faiss registry: {self.stats()}")
+
+        # the embedding model and the search parameters can differ between requests on the same store
+        entry["db"].embedding_function = embeddings
+        params = dict(entry["search_params"])
+        params.update({k: v for k, v in (search_overrides or {}).items() if v})
+        set_search_params(entry["db"].index, params)
+        return entry["db"]
+
+    def load(self, bucket_name, vector_location, embeddings):
+        start = time.perf_counter()
+        local_path = local_store_path(bucket_name, vector_location)
+        shutil.rmtree(local_path, ignore_errors=True)
+        # the original vectors of a lossy index are only read by the builders
+        version = download_vector_store(bucket_name, vector_location, local_path, skip=(ORIGINAL_VECTORS_FILE,))
+        if version is None:
+            raise ValueError(f"No vector store found in s3://{bucket_name}/{vector_location}")
+        download_ms = (time.perf_counter() - start) * 1000
+
+        db = load_faiss(local_path, embeddings, mmap=self.mmap)
+        params = search_params(db.index)
+        params.update({k: v for k, v in default_search_params.items() if v and k in params})
+        sizes = {f: os.path.getsize(os.path.join(local_path, f)) for f in os.listdir(local_path)}
+        disk_bytes = sum(sizes.values())
+        # docstore.sqlite is read by id, only a pickled index.pkl and an unmapped index are resident
+        nbytes = sizes.get("index.pkl", 0) + (0 if self.mmap else sizes.get("index.faiss", 0))
+        print(f"vector store loaded: s3://{bucket_name}/{vector_location}, {db.index.ntotal} vectors, {disk_bytes} bytes, "
+              f"mmap={self.mmap}, {params}, download {round(download_ms)} ms, load {round((time.perf_counter() - start) * 1000 - download_ms)} ms")
+        return dict(db=db, search_params=params, version=version, nbytes=nbytes, disk_bytes=disk_bytes,
+                    local_path=local_path, checked=time.time())
+
+    def store(self, key, entry):
+        self.stores[key] = entry
+        self.current_bytes += entry["nbytes"]
+        self.current_disk_bytes += entry["disk_bytes"]
+        while (self.current_bytes > self.max_bytes or self.current_disk_bytes > self.max_disk_bytes) and len(self.stores) > 1:
+            evicted = next(iter(self.stores))
+            print(f"vector store evicted: s3://{evicted[0]}/{evicted[1]}")
+            self.evict(evicted)
+
+    def evict(self, key):
+        entry = self.stores.pop(key, None)
+        if entry:
+            self.current_bytes -= entry["nbytes"]
+            self.current_disk_bytes -= entry["disk_bytes"]
+            # an index still mapped by a running search stays readable after the unlink
+            shutil.rmtree(entry["local_path"], ignore_errors=True)
+
+    def stats(self):
+        return dict(stores=len(self.stores), bytes=self.current_bytes, max_bytes=self.max_bytes,
+                    disk_bytes=self.current_disk_bytes, hits=self.hits, misses=self.misses)
+
+
+def mmap_io_flags(index_path):
+    """faiss.read_index flags that map the index file instead of reading it.
+    IVF indexes map their inverted lists (a search only touches the probed lists), flat,
+    SQ and HNSW indexes map their vectors. Both come from the file faiss.write_index
+    (FAISS.save_local) produces, the index only has to stay on local disk (/tmp)."""
+    with open(index_path, "rb") as f:
+        fourcc = f.read(4)
+    if fourcc[:2] in (b"Iw", b"Iv"):
+        return faiss.IO_FLAG_MMAP
+    return faiss.IO_FLAG_MMAP_IFC
+
+
+def load_faiss(local_path, embeddings, mmap=faiss_mmap):
+    io_flags = mmap_io_flags(os.path.join(local_path, "index.faiss")) if mmap else 0
+    return load_vector_store(local_path, embeddings, io_flags=io_flags)
+
+
+def local_store_path(bucket_name, vector_location):
+    return os.path.join(tmp_path, "faiss", bucket_name, vector_location.strip("/"))
+
+
+faiss_registry = FaissRegistry()
+
+
+def get_vector_store(bucket_name, vector_location, embeddings, search_overrides=None):
+    """search_overrides: nprobe / efSearch of this request"""
+    return faiss_registry.get(bucket_name, vector_location, embeddings, search_overrides)
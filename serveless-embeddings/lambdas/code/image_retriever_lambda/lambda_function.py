@@ -2,11 +2,11 @@ import json
 import os
 import boto3 
 
-from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import BedrockEmbeddings
 import base64
 
-from utils import (build_response, download_folder_s3,download_file)
+from utils import (build_response, download_file)
+from faiss_registry import get_vector_store
 bedrock_client              = boto3.client("bedrock-runtime")
 
 tmp_path                    = "/tmp"
@@ -14,10 +14,6 @@ tmp_path                    = "/tmp"
 #calls Bedrock to get a vector from either an image, text, or both
 def get_multimodal_vector(input_image_base64=None, input_text=None):
     
-    session = boto3.Session()
-
-    bedrock = session.client(service_name='bedrock-runtime') #creates a Bedrock client
-    
     request_body = {}
     
     if input_text:
@@ -28,7 +24,7 @@ def get_multimodal_vector(input_image_base64=None, input_text=None):
     
     body = json.dumps(request_body)
     
-    response = bedrock.invoke_model(
+    response = bedrock_client.invoke_model(
     	body=body, 
     	modelId="amazon.titan-embed-image-v1", 
     	accept="application/json", 
@@ -60,6 +56,8 @@ def lambda_handler(event, context):
     query                   = event.get("query")
     embedding_model         = event.get("embeddingModel")
     input_type              = event.get("InputType")
+    # IVF lists / HNSW candidates visited per query, higher is slower with better recall
+    search_overrides        = {"nprobe": event.get("nprobe"), "efSearch": event.get("efSearch")}
 
     query                   = query if query else ""
 
@@ -71,17 +69,10 @@ def lambda_handler(event, context):
     print("InputType:", input_type)
 
 
-    file_name                = vector_location.split('/')[-1]
     bedrock_embeddings      = BedrockEmbeddings(model_id=embedding_model,client=bedrock_client)
 
-
-    local_path = f"{tmp_path}/{file_name}"
-
-    if not os.path.exists(local_path):
-        print("archivo faiss no existe")
-        download_folder_s3(bucket_name, vector_location, local_path)
-
-    db = FAISS.load_local(local_path, bedrock_embeddings, allow_dangerous_deserialization=True)
+    # loaded once per container, reloaded when the store changes in S3
+    db = get_vector_store(bucket_name, vector_location, bedrock_embeddings, search_overrides)
     print("DB Done")
     if input_type == "text":
         search_vector = get_multimodal_vector(input_text=query)
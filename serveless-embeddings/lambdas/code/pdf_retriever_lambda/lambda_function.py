@@ -1,15 +1,12 @@
 import json
-import os
 import boto3 
 
-from langchain_community.vectorstores import FAISS
 from langchain_community.embeddings import BedrockEmbeddings
 
-from utils import (build_response, download_folder_s3)
+from utils import build_response
+from faiss_registry import get_vector_store
 bedrock_client              = boto3.client("bedrock-runtime")
 
-tmp_path                    = "/tmp"
-
 
 def lambda_handler(event, context):
     print (event)
@@ -20,6 +17,8 @@ def lambda_handler(event, context):
     query                   = event.get("query")
     embedding_model         = event.get("embeddingModel")
     num_docs                = event.get("numDocs")
+    # IVF lists / HNSW candidates visited per query, higher is slower with better recall
+    search_overrides        = {"nprobe": event.get("nprobe"), "efSearch": event.get("efSearch")}
 
     query                   = query if query else ""
     num_docs                = num_docs if num_docs else 5
@@ -31,17 +30,10 @@ def lambda_handler(event, context):
     print("numDocs:", num_docs)
 
 
-    file_name                = vector_location.split('/')[-1]
-
     bedrock_embeddings      = BedrockEmbeddings(model_id=embedding_model,client=bedrock_client)
 
-
-    local_path = f"{tmp_path}/{file_name}"
-    if not os.path.exists(local_path):
-        print("archivo faiss no existe")
-        download_folder_s3(bucket_name, vector_location, local_path)
-
-    db                      = FAISS.load_local(local_path, bedrock_embeddings, allow_dangerous_deserialization=True)
+    # loaded once per container, reloaded when the store changes in S3
+    db                      = get_vector_store(bucket_name, vector_location, bedrock_embeddings, search_overrides)
     retriever               = db.as_retriever(search_kwargs = {'k':num_docs}, search_type = "mmr")
     docs                    = retriever.invoke(query)
     print (docs)
@@ -0,0 +1,56 @@
+import os
+
+from langchain_core.embeddings import Embeddings
+from langchain_experimental.text_splitter import SemanticChunker
+
+# Sentences embedded together to find breakpoints, a group is also the smallest chunk
+semantic_group_sentences    = int(os.environ.get("SEMANTIC_GROUP_SENTENCES", "3"))
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings of one build, each distinct text is sent to the model once.
+    Shared by the chunker and the vector store, a chunk whose text was already
+    embedded to find breakpoints (or repeats on another page) is not embedded again."""
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.cache = {}
+        self.embedded = 0
+        self.reused = 0
+
+    def embed_documents(self, texts):
+        missing = list(dict.fromkeys(text for text in texts if text not in self.cache))
+        if missing:
+            self.cache.update(zip(missing, self.embeddings.embed_documents(missing)))
+        self.embedded += len(missing)
+        self.reused += len(texts) - len(missing)
+        return [self.cache[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def stats(self):
+        return dict(embedded=self.embedded, reused=self.reused)
+
+
+class SentenceGroupChunker(SemanticChunker):
+    """SemanticChunker on consecutive groups of group_size sentences instead of a window around every sentence.
+
+    Each group is embedded once, breakpoints fall between groups and a chunk is one or more
+    whole groups, so a single-group chunk has the exact text (and embedding) of its group.
+    SemanticChunker embeds one window per sentence, this embeds one per group."""
+
+    def __init__(self, embeddings, group_size=3, **kwargs):
+        super().__init__(embeddings, buffer_size=0, **kwargs)
+        self.group_size = group_size
+
+    def _get_single_sentences_list(self, text):
+        sentences = super()._get_single_sentences_list(text)
+        return [" ".join(sentences[i:i + self.group_size]) for i in range(0, len(sentences), self.group_size)]
+
+
+def semantic_splitter(embeddings, sentence_percentile=80, group_size=semantic_group_sentences):
+    """SentenceGroupChunker that ends a chunk after the same share of sentences as
+    SemanticChunker(breakpoint_threshold_amount=sentence_percentile), so chunks keep their size"""
+    percentile = max(0, 100 - (100 - sentence_percentile) * group_size)
+    return SentenceGroupChunker(embeddings, group_size=group_size, breakpoint_threshold_amount=percentile)
@@ -0,0 +1,157 @@
+import json
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+# Written next to index.faiss instead of the pickled index.pkl
+DOCSTORE_FILE               = "docstore.sqlite"
+
+
+def connect(path):
+    connection = sqlite3.connect(path, check_same_thread=False)
+    connection.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, page_content TEXT, metadata TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS index_ids (position INTEGER PRIMARY KEY, id TEXT)")
+    return connection
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Documents of a FAISS store in a SQLite file, read by id when a search returns them.
+    Opening it reads nothing, unlike the pickled InMemoryDocstore."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def search(self, search):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT page_content, metadata FROM documents WHERE id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO documents (id, page_content, metadata) VALUES (?, ?, ?)",
+                [(id_, doc.page_content, json.dumps(doc.metadata, default=str)) for id_, doc in texts.items()],
+            )
+            self.connection.commit()
+
+    def ids_where_metadata(self, keys, values):
+        """Ids of the documents whose first present metadata key (in keys order) has one of values"""
+        values = list(values)
+        value = ", ".join("json_extract(metadata, ?)" for _ in keys)
+        # SQLite's COALESCE takes two or more arguments
+        value = f"COALESCE({value})" if len(keys) > 1 else value
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT id FROM documents WHERE {value} IN ({', '.join('?' for _ in values)})",
+                [f"$.{key}" for key in keys] + values,
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def metadata_values(self, key):
+        """Distinct values of a metadata key"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT DISTINCT json_extract(metadata, ?) FROM documents WHERE json_extract(metadata, ?) IS NOT NULL",
+                (f"$.{key}", f"$.{key}"),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def update_metadata(self, ids, values):
+        """Set metadata keys of the given documents"""
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE documents SET metadata = json_patch(metadata, ?) WHERE id = ?",
+                [(json.dumps(values, default=str), id_) for id_ in ids],
+            )
+            self.connection.commit()
+
+    def delete(self, ids):
+        with self.lock:
+            self.connection.executemany("DELETE FROM documents WHERE id = ?", [(id_,) for id_ in ids])
+            self.connection.commit()
+
+
+class SQLiteIndexIds(MutableMapping):
+    """index_to_docstore_id (FAISS position -> docstore id) looked up in the same SQLite file"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def __getitem__(self, position):
+        with self.lock:
+            row = self.connection.execute("SELECT id FROM index_ids WHERE position = ?", (int(position),)).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __setitem__(self, position, id_):
+        self.update({position: id_})
+
+    def __delitem__(self, position):
+        with self.lock:
+            self.connection.execute("DELETE FROM index_ids WHERE position = ?", (int(position),))
+            self.connection.commit()
+
+    def __iter__(self):
+        with self.lock:
+            positions = [row[0] for row in self.connection.execute("SELECT position FROM index_ids ORDER BY position")]
+        return iter(positions)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT count(*) FROM index_ids").fetchone()[0]
+
+    def update(self, other=(), **kwargs):
+        items = dict(other, **kwargs)
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO index_ids (position, id) VALUES (?, ?)",
+                                        [(int(position), id_) for position, id_ in items.items()])
+            self.connection.commit()
+
+
+def save_vector_store(db, folder_path):
+    """Save a FAISS store as index.faiss + docstore.sqlite (no pickle)"""
+    os.makedirs(folder_path, exist_ok=True)
+    # the store may have been loaded from a pickled index.pkl, docstore.sqlite replaces it
+    if os.path.exists(os.path.join(folder_path, "index.pkl")):
+        os.remove(os.path.join(folder_path, "index.pkl"))
+    faiss.write_index(db.index, os.path.join(folder_path, "index.faiss"))
+
+    path = os.path.join(folder_path, DOCSTORE_FILE)
+    tmp_file = f"{path}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    connection = connect(tmp_file)
+    ids = dict(db.index_to_docstore_id)
+    connection.executemany("INSERT INTO index_ids (position, id) VALUES (?, ?)", [(int(p), i) for p, i in ids.items()])
+    rows = []
+    for id_ in ids.values():
+        doc = db.docstore.search(id_)
+        rows.append((id_, doc.page_content, json.dumps(doc.metadata, default=str)))
+    connection.executemany("INSERT INTO documents (id, page_content, metadata) VALUES (?, ?, ?)", rows)
+    connection.commit()
+    connection.close()
+    # replaces a docstore the store may have been opened from
+    os.replace(tmp_file, path)
+
+
+def load_vector_store(folder_path, embeddings, io_flags=0):
+    """FAISS store saved by save_vector_store, stores with a pickled index.pkl are still loaded the old way"""
+    path = os.path.join(folder_path, DOCSTORE_FILE)
+    if not os.path.exists(path):
+        return FAISS.load_local(folder_path, embeddings, allow_dangerous_deserialization=True, io_flags=io_flags)
+    index = faiss.read_index(os.path.join(folder_path, "index.faiss"), io_flags)
+    connection = connect(path)
+    return FAISS(embeddings, index, SQLiteDocstore(connection), SQLiteIndexIds(connection))
@@ -1,9 +1,16 @@
 import json
 import boto3
 import os
-import errno
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
 
-s3                  = boto3.client('s3')
+# Files transferred in parallel by the folder helpers, large files are also split in parallel parts
+s3_transfer_workers = int(os.environ.get("S3_TRANSFER_WORKERS", "16"))
+
+s3                  = boto3.client('s3', config=Config(max_pool_connections=s3_transfer_workers * 2))
+transfer_config     = TransferConfig(max_concurrency=s3_transfer_workers, multipart_chunksize=16 * 1024 * 1024)
 
 
 
@@ -21,17 +28,79 @@ def build_response(status_code, json_content):
 
 
 
-def upload_folder_s3(local_folder, bucket_name, s3_prefix):
-    for subdir, dirs, files in os.walk(local_folder):
-        for file in files:
+class TransferProgress:
+    """Bytes transferred by all the files of one folder transfer. Calls progress(done, total)
+    when given, otherwise prints every 10%. Used as the boto3 Callback of each file."""
+
+    def __init__(self, label, total_bytes, progress=None):
+        self.label = label
+        self.total_bytes = total_bytes
+        self.progress = progress
+        self.done_bytes = 0
+        self.reported = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, bytes_amount):
+        with self.lock:
+            self.done_bytes += bytes_amount
+            done = self.done_bytes
+            if self.progress is None:
+                if self.total_bytes and done * 10 // self.total_bytes > self.reported:
+                    self.reported = done * 10 // self.total_bytes
+                    print(f"{self.label}: {done} of {self.total_bytes} bytes")
+                return
+        self.progress(done, self.total_bytes)
+
+
+def list_objects(bucket, prefix):
+    """Every object under prefix, one list_objects_v2 page (1,000 keys) at a time"""
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        # "folder/" placeholder objects have nothing to download
+        objects.extend(obj for obj in page.get("Contents", []) if not obj["Key"].endswith("/"))
+    return objects
+
+
+def run_transfers(transfer, items, workers=None):
+    """Call transfer(item) for every item on a thread pool, raising the first error"""
+    workers = workers or s3_transfer_workers
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(items) or 1))) as executor:
+        for _ in executor.map(transfer, items):
+            pass
+
+
+def download_objects(bucket, objects, local_path, prefix="", progress=None, workers=None):
+    """Download objects (list_objects entries) to local_path + their key after prefix"""
+    tracker = TransferProgress(f"download s3://{bucket}/{prefix}", sum(obj["Size"] for obj in objects), progress)
+
+    def download(obj):
+        filename = os.path.join(local_path, obj["Key"][len(prefix):].lstrip("/"))
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        s3.download_file(bucket, obj["Key"], filename, Callback=tracker, Config=transfer_config)
+
+    run_transfers(download, objects, workers)
+    print(f"downloaded {len(objects)} files, {tracker.done_bytes} bytes from s3://{bucket}/{prefix}")
+
+
+def upload_folder_s3(local_folder, bucket_name, s3_prefix, progress=None, workers=None):
+    files = []
+    for subdir, dirs, filenames in os.walk(local_folder):
+        for file in filenames:
             full_path = os.path.join(subdir, file)
-            with open(full_path, 'rb') as data:
-                s3.upload_fileobj(data, bucket_name, s3_prefix + full_path[len(local_folder):])
+            files.append((full_path, s3_prefix + full_path[len(local_folder):]))
+    tracker = TransferProgress(f"upload s3://{bucket_name}/{s3_prefix}", sum(os.path.getsize(f) for f, _ in files), progress)
+
+    def upload(item):
+        s3.upload_file(item[0], bucket_name, item[1], Callback=tracker, Config=transfer_config)
+
+    run_transfers(upload, files, workers)
+    print(f"uploaded {len(files)} files, {tracker.done_bytes} bytes to s3://{bucket_name}/{s3_prefix}")
 
 
 def download_file(bucket, key, filename):
     try:
-        s3.download_file(bucket, key, filename)
+        s3.download_file(bucket, key, filename, Config=transfer_config)
         print("File downloaded successfully")
         return True
     except Exception as e:
@@ -41,52 +110,18 @@ def download_file(bucket, key, filename):
 def download_file_from_folder(bucket, key, filename):
     try:
         with open(filename, "wb") as data:
-            s3.download_fileobj(bucket, key, data)
+            s3.download_fileobj(bucket, key, data, Config=transfer_config)
         print("Download file from s3://{}{}".format(bucket,key))
         return True
     except Exception as e:
         print("Error downloading file:", e)
         return False
 
-def download_files_in_folder(bucket, folder,tmp_path):
-    for obj in s3.list_objects(Bucket=bucket, Prefix=folder)['Contents']:
-        print(obj["Key"], len(obj["Key"].split("/")))
-        path = ""
-        len_int = len(obj["Key"].split("/"))-1
-        possition = 0
-        for k in obj["Key"].split("/"):
-            if possition == len_int:
-                break
-            path = path+"/"+k
-            possition += 1
-        path = path.lstrip("/")
-        print(path)
-        try:
-            os.makedirs(tmp_path+path)
-        except OSError as e:
-            if e.errno != errno.EEXIST:
-                raise
-        filename = tmp_path+ path +"/" + obj["Key"].split("/")[-1]
-        download_file_from_folder(bucket, obj['Key'],filename)
-
-def download_folder_s3(bucket_name, s3_prefix, local_folder):
-    s3_objects = s3.list_objects_v2(Bucket=bucket_name, Delimiter='/', Prefix=s3_prefix)
-
-    for subdir in s3_objects['CommonPrefixes']:
-        subfolder = subdir['Prefix'].split(f"{s3_prefix}/")[-1]
-        local_path = os.path.join(local_folder, subfolder)
-        if not os.path.exists(local_path):
-            os.makedirs(local_path)
-
-    s3_objects = s3.list_objects_v2(Bucket=bucket_name, Prefix=s3_prefix)
-
-    for obj in s3_objects['Contents']:
-        file_name = obj['Key'].split('/')[-1]
-        local_file_path = os.path.join(local_folder, file_name)
-        directory = os.path.dirname(local_file_path) 
-        if not os.path.exists(directory):
-            print(directory)
-            os.makedirs(directory)
-        s3.download_file(bucket_name, obj['Key'], local_file_path)
-    
-    print("downloaded file")
+def download_files_in_folder(bucket, folder, tmp_path, progress=None, workers=None):
+    """Download every object under folder to tmp_path/<key>"""
+    download_objects(bucket, list_objects(bucket, folder), tmp_path, progress=progress, workers=workers)
+
+def download_folder_s3(bucket_name, s3_prefix, local_folder, progress=None, workers=None):
+    """Download every object under s3_prefix to local_folder/<key after s3_prefix>"""
+    download_objects(bucket_name, list_objects(bucket_name, s3_prefix), local_folder, prefix=s3_prefix,
+                     progress=progress, workers=workers)
@@ -0,0 +1,101 @@
+import json
+import os
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from utils import s3, upload_folder_s3, run_transfers, transfer_config
+
+# <vectorStoreLocation>/manifest.json names the version folder holding the current files.
+# Stores uploaded before the manifest keep their files directly under vectorStoreLocation.
+MANIFEST_FILE               = "manifest.json"
+
+
+def store_prefix(vector_location):
+    return vector_location.rstrip("/") + "/"
+
+
+def store_files(bucket_name, vector_location):
+    """(version, {file name: key}) of the current store, version is the manifest ETag
+    (or the ETags of the files of a store without manifest). (None, {}) when there is no store."""
+    prefix = store_prefix(vector_location)
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=prefix + MANIFEST_FILE)
+        manifest = json.loads(response["Body"].read())
+        return response["ETag"], {name: f"{prefix}{manifest['version']}/{name}" for name in manifest["files"]}
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+
+    etags = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter="/"):
+        for obj in page.get("Contents", []):
+            etags[obj["Key"][len(prefix):]] = (obj["Key"], obj["ETag"])
+    if "docstore.sqlite" in etags:
+        # the index.pkl of an older build next to a rebuilt store
+        etags.pop("index.pkl", None)
+    if not etags:
+        return None, {}
+    return tuple(sorted(etag for _, etag in etags.values())), {name: key for name, (key, _) in etags.items()}
+
+
+def download_vector_store(bucket_name, vector_location, local_path, skip=()):
+    """Download the current store into local_path, except the files named in skip.
+    Returns its version or None when there is none."""
+    version, files = store_files(bucket_name, vector_location)
+    if not files:
+        return None
+    os.makedirs(local_path, exist_ok=True)
+    run_transfers(lambda item: s3.download_file(bucket_name, item[1], os.path.join(local_path, item[0]), Config=transfer_config),
+                  [(name, key) for name, key in files.items() if name not in skip])
+    return version
+
+
+def upload_vector_store(local_path, bucket_name, vector_location, previous_version=None, overwrite=False):
+    """Upload the files of local_path as a new version and point the manifest at it.
+
+    The manifest is replaced with a conditional PUT, only if it is still previous_version
+    (the version the caller downloaded, None when there was no store), so two concurrent
+    updates cannot silently drop each other's changes; overwrite replaces whatever is current.
+    Readers see the whole old store or the whole new one, never a mix. Files older than the
+    version that was current before are deleted."""
+    prefix = store_prefix(vector_location)
+    if overwrite:
+        previous_version = store_files(bucket_name, vector_location)[0]
+    version = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    upload_folder_s3(local_path, bucket_name, f"{prefix}{version}")
+
+    condition = {"IfMatch": previous_version} if isinstance(previous_version, str) else {"IfNoneMatch": "*"}
+    try:
+        previous_files = store_files(bucket_name, vector_location)[1] if previous_version else {}
+        s3.put_object(Bucket=bucket_name, Key=prefix + MANIFEST_FILE,
+                      Body=json.dumps({"version": version, "files": sorted(os.listdir(local_path))}),
+                      ContentType="application/json", **condition)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+            raise
+        delete_keys(bucket_name, list_keys(bucket_name, f"{prefix}{version}/"))
+        raise RuntimeError(f"s3://{bucket_name}/{vector_location} was updated by another request, retry") from e
+
+    # keep the new files and the ones readers may still be downloading
+    keep = set(previous_files.values()) | {prefix + MANIFEST_FILE}
+    stale = [key for key in list_keys(bucket_name, prefix)
+             if key not in keep and not key.startswith(f"{prefix}{version}/")]
+    delete_keys(bucket_name, stale)
+    print(f"vector store uploaded: s3://{bucket_name}/{prefix}{version}, {len(stale)} stale objects deleted")
+    return version
+
+
+def list_keys(bucket_name, prefix):
+    keys = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def delete_keys(bucket_name, keys):
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket_name, Delete={"Objects": [{"Key": key} for key in keys[i:i + 1000]], "Quiet": True})
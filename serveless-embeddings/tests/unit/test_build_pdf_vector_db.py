@@ -0,0 +1,216 @@
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("faiss")
+pytest.importorskip("langchain_community")
+
+from botocore.exceptions import ClientError
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+CODE = os.path.join(os.path.dirname(__file__), "..", "..", "lambdas", "code")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+sys.path.insert(0, CODE)
+
+import faiss_index  # noqa: E402
+import utils  # noqa: E402
+import vector_store_s3  # noqa: E402
+from sqlite_docstore import load_vector_store  # noqa: E402
+
+BUCKET = "bucket"
+STORE = "collection.vdb"
+
+
+class FakeS3:
+    """The S3 calls of vector_store_s3 and utils over a dict, with conditional PUTs"""
+
+    def __init__(self):
+        self.objects = {}
+
+    def etag(self, key):
+        return f'"{hash(self.objects[key])}"'
+
+    def get_paginator(self, name):
+        return self
+
+    def paginate(self, Bucket, Prefix, Delimiter=None):
+        contents, prefixes = [], set()
+        for key in sorted(self.objects):
+            if not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+                continue
+            contents.append(dict(Key=key, ETag=self.etag(key), Size=len(self.objects[key])))
+        yield {"Contents": contents, "CommonPrefixes": [{"Prefix": p} for p in sorted(prefixes)]}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": self.etag(Key)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None, **kwargs):
+        exists = Key in self.objects
+        if (IfNoneMatch == "*" and exists) or (IfMatch is not None and (not exists or self.etag(Key) != IfMatch)):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.objects[Key] = Body.encode() if isinstance(Body, str) else Body
+
+    def download_file(self, Bucket, Key, Filename, **kwargs):
+        with open(Filename, "wb") as f:
+            f.write(self.objects[Key])
+
+    def upload_file(self, Filename, Bucket, Key, **kwargs):
+        with open(Filename, "rb") as f:
+            self.objects[Key] = f.read()
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+
+
+@pytest.fixture
+def builder(tmp_path, monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(utils, "s3", s3)
+    monkeypatch.setattr(vector_store_s3, "s3", s3)
+    spec = importlib.util.spec_from_file_location(
+        "build_pdf_vector_db", os.path.join(CODE, "build_pdf_vector_db", "lambda_function.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.tmp_path = str(tmp_path)
+    module.BedrockEmbeddings = lambda **kwargs: DeterministicFakeEmbedding(size=16)
+    module.download_file = lambda bucket, key, path: True
+    # "<name>.pdf" splits into chunks "<key> chunk <i>", 3 per PDF
+    module.load_and_split_semantic = lambda file_type, path, embeddings: [
+        Document(page_content=f"{module.current_key} chunk {i}", metadata={"source": path, "page": i}) for i in range(3)]
+    module.s3 = s3
+    return module
+
+
+def run(builder, location=None, **kwargs):
+    builder.current_key = location
+    event = dict(location=location, vectorStoreLocation=STORE, bucketName=BUCKET, vectorStoreType="faiss",
+                 splitStrategy="semantic", fileType="application/pdf", embeddingModel="model", **kwargs)
+    response = builder.lambda_handler(event, None)
+    return response["statusCode"], json.loads(response["body"])
+
+
+def stored_chunks(builder, tmp_path):
+    local = str(tmp_path / "check.vdb")
+    vector_store_s3.download_vector_store(BUCKET, STORE, local)
+    db = load_vector_store(local, DeterministicFakeEmbedding(size=16))
+    return sorted((doc.metadata.get("location", ""), doc.page_content)
+                  for doc in (db.docstore.search(id_) for id_ in db.index_to_docstore_id.values()))
+
+
+def add_legacy_chunks(builder, tmp_path, name, count):
+    """Chunks as built before the location metadata: only the /tmp path of the PDF"""
+    local = str(tmp_path / "legacy.vdb")
+    version = vector_store_s3.download_vector_store(BUCKET, STORE, local)
+    db = load_vector_store(local, DeterministicFakeEmbedding(size=16))
+    db.add_documents([Document(page_content=f"legacy {name} chunk {i}", metadata={"source": f"{tmp_path}/{name}"})
+                      for i in range(count)])
+    builder.save_vector_store(db, local)
+    vector_store_s3.upload_vector_store(local, BUCKET, STORE, version)
+
+
+def test_append_replace_delete(builder, tmp_path):
+    assert run(builder, "docs/a.pdf")[0] == 200
+    status, body = run(builder, "docs/b.pdf", mode="append")
+    assert (status, body["added"], body["size"]) == (200, 3, 6)
+
+    # appending a PDF already in the store replaces its chunks
+    status, body = run(builder, "docs/a.pdf", mode="append")
+    assert (status, body["deleted"], body["size"]) == (200, 3, 6)
+    assert [location for location, _ in stored_chunks(builder, tmp_path)] == ["docs/a.pdf"] * 3 + ["docs/b.pdf"] * 3
+
+    status, body = run(builder, mode="delete", deleteLocations=["docs/b.pdf"])
+    assert (status, body["deleted"], body["size"]) == (200, 3, 3)
+    assert {location for location, _ in stored_chunks(builder, tmp_path)} == {"docs/a.pdf"}
+
+
+def test_legacy_chunks_of_another_pdf_are_kept(builder, tmp_path):
+    run(builder, "docs/a.pdf")
+    add_legacy_chunks(builder, tmp_path, "report.pdf", 2)
+
+    # another PDF with the same file name does not delete the legacy chunks
+    status, body = run(builder, "other/report.pdf", mode="append")
+    assert (status, body["deleted"], body["legacyChunks"], body["size"]) == (200, 0, 2, 8)
+
+    # they cannot be assigned while another key of the store has their file name
+    status, body = run(builder, "old/report.pdf", mode="append", legacyLocations=["old/report.pdf"])
+    assert status == 409
+    assert len(stored_chunks(builder, tmp_path)) == 8
+
+
+def test_legacy_locations_backfill(builder, tmp_path):
+    run(builder, "docs/a.pdf")
+    add_legacy_chunks(builder, tmp_path, "report.pdf", 2)
+
+    status, body = run(builder, "old/report.pdf", mode="append", legacyLocations=["old/report.pdf"])
+    assert (status, body["backfilled"], body["deleted"], body["size"]) == (200, {"old/report.pdf": 2}, 2, 6)
+    assert not any(text.startswith("legacy") for _, text in stored_chunks(builder, tmp_path))
+
+
+def test_stale_manifest_conflict(builder, tmp_path):
+    run(builder, "docs/a.pdf")
+    local = str(tmp_path / "stale.vdb")
+    stale_version = vector_store_s3.download_vector_store(BUCKET, STORE, local)
+    run(builder, "docs/b.pdf", mode="append")
+    objects = dict(builder.s3.objects)
+
+    # an update based on the version before the append is refused and cleans up its upload
+    with pytest.raises(RuntimeError, match="updated by another request"):
+        vector_store_s3.upload_vector_store(local, BUCKET, STORE, stale_version)
+    assert builder.s3.objects == objects
+    assert len(stored_chunks(builder, tmp_path)) == 6
+
+
+def stored_vectors(tmp_path):
+    """(original vectors file, the embeddings of the chunk texts) in index position order"""
+    local = str(tmp_path / "vectors.vdb")
+    shutil.rmtree(local, ignore_errors=True)
+    vector_store_s3.download_vector_store(BUCKET, STORE, local)
+    db = load_vector_store(local, DeterministicFakeEmbedding(size=16))
+    texts = [db.docstore.search(db.index_to_docstore_id[i]).page_content for i in range(db.index.ntotal)]
+    original = np.load(os.path.join(local, faiss_index.ORIGINAL_VECTORS_FILE))
+    return original, np.array(DeterministicFakeEmbedding(size=16).embed_documents(texts), dtype=np.float32)
+
+
+def test_lossy_index_is_rebuilt_from_original_vectors(builder, tmp_path):
+    assert run(builder, "docs/a.pdf", indexType="sq8")[0] == 200
+    for location in ("docs/b.pdf", "docs/c.pdf", "docs/a.pdf"):
+        status, body = run(builder, location, mode="append")
+        assert (status, body["index"]["type"]) == (200, "sq8")
+    run(builder, mode="delete", deleteLocations=["docs/b.pdf"])
+
+    # the vectors kept with the store are the embeddings, not the decoded 8-bit codes
+    original, embeddings = stored_vectors(tmp_path)
+    assert original.shape == (6, 16)
+    np.testing.assert_array_equal(original, embeddings)
+
+    # switching to flat drops them
+    run(builder, "docs/d.pdf", mode="append", indexType="flat")
+    with pytest.raises(FileNotFoundError):
+        stored_vectors(tmp_path)
+
+
+def test_lossy_index_without_original_vectors_is_refused(builder, tmp_path):
+    run(builder, "docs/a.pdf", indexType="sq8")
+    # a store built before the original vectors were kept
+    for key in [key for key in builder.s3.objects if key.endswith(faiss_index.ORIGINAL_VECTORS_FILE)]:
+        builder.s3.objects.pop(key)
+    manifest = json.loads(builder.s3.objects[f"{STORE}/manifest.json"])
+    manifest["files"].remove(faiss_index.ORIGINAL_VECTORS_FILE)
+    builder.s3.objects[f"{STORE}/manifest.json"] = json.dumps(manifest).encode()
+
+    status, body = run(builder, "docs/b.pdf", mode="append")
+    assert status == 409 and "mode overwrite" in body["message"]